@@ -0,0 +1,185 @@
+"""
+Async Deck Repository
+
+asyncio counterpart of the blocking deck helpers (fetch_request_record,
+update_slide_record, store_slide_json) for an async front end, backed by its
+own aiomysql pool. A coroutine waiting on MySQL yields the event loop, so a
+few threads can interleave thousands of requests that spend most of their
+time waiting on LLM calls.
+
+Storage semantics match deck_store: both the document and per-slide layouts
+are read and written, values go through deck_codec, every write bumps
+slide_version and invalidates the deck caches.
+
+Usage:
+    from async_deck_store import AsyncDeckRepository
+
+    repo = AsyncDeckRepository(db_config)
+    await repo.open()
+    mindmap_json, slide_json, updated_at = await repo.fetch_request_record(request_id)
+    await repo.store_slide_json(request_id, deck)
+    await repo.close()
+
+Configuration (environment variables):
+    ASYNC_DB_POOL_MIN   Connections opened up front (default 1)
+    ASYNC_DB_POOL_SIZE  Maximum open connections (default 20)
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE are shared with db_pool.
+
+Requires aiomysql (pip install aiomysql).
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Union
+
+import deck_codec
+from db_pool import DB_POOL_TIMEOUT, DB_POOL_RECYCLE, PoolTimeoutError
+from deck_store import (SLIDE_STORAGE_MODE, SLIDE_ROWS_MARKER, SELECT_SLIDE_ROWS_FOR_UPDATE_SQL, DECK_REVISION_KEY,
+                        _parse_header, _assemble, _plan_split, invalidate_deck)
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", 1))
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", 20))
+
+
+class AsyncDeckRepository:
+    """Deck reads and writes over a bounded aiomysql pool bound to the running event loop."""
+
+    def __init__(self, db_config: Dict[str, Any], min_size: int = ASYNC_DB_POOL_MIN,
+                 max_size: int = ASYNC_DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT,
+                 recycle: int = DB_POOL_RECYCLE):
+        self._config = dict(db_config)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._pool = None
+        self._open_lock = asyncio.Lock()
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self._pool is not None:
+                return
+            try:
+                import aiomysql
+            except ImportError:
+                raise ImportError("aiomysql is required for the async deck repository. Install with: pip install aiomysql")
+            self._pool = await aiomysql.create_pool(
+                host=self._config.get("host"),
+                port=int(self._config.get("port", 3306)),
+                user=self._config.get("user"),
+                password=self._config.get("password") or "",
+                db=self._config.get("database"),
+                minsize=self.min_size,
+                maxsize=self.max_size,
+                pool_recycle=self.recycle,
+                autocommit=True,
+            )
+
+    async def close(self) -> None:
+        if self._pool is None:
+            return
+        self._pool.close()
+        await self._pool.wait_closed()
+        self._pool = None
+
+    async def _acquire(self):
+        if self._pool is None:
+            await self.open()
+        try:
+            return await asyncio.wait_for(self._pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(f"No async DB connection available within {self.timeout}s")
+
+    # --- reads ---
+
+    async def fetch_request_record(self, request_id):
+        """``(mindmap_json, slide_json, updated_at)`` with the full-deck JSON string, like deck_store.fetch_record."""
+        conn = await self._acquire()
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT mindmap_json, slide_json, updated_at FROM slide_requests WHERE id = %s",
+                    (request_id,)
+                )
+                row = await cursor.fetchone()
+                if not row:
+                    return row
+                row = (deck_codec.decode(row[0]), deck_codec.decode(row[1]), row[2])
+                if not row[1] or f'"{SLIDE_ROWS_MARKER}"' not in row[1]:
+                    return row
+
+                header, split = _parse_header(row[1])
+                if not split:
+                    return row
+                await cursor.execute(
+                    "SELECT slide_json FROM slide_request_slides WHERE request_id = %s ORDER BY position",
+                    (request_id,)
+                )
+                slides = [json.loads(slide_row[0]) for slide_row in await cursor.fetchall()]
+        finally:
+            self._pool.release(conn)
+
+        return row[0], json.dumps(_assemble(header, slides)), row[2]
+
+    # --- writes ---
+
+    async def _write_deck(self, conn, request_id, slide_doc: Dict[str, Any]) -> None:
+        async with conn.cursor() as cursor:
+            if SLIDE_STORAGE_MODE != "slides":
+                await cursor.execute(
+                    """
+                    UPDATE slide_requests
+                       SET slide_json = %s
+                         , slide_version = slide_version + 1
+                         , updated_at = NOW()
+                     WHERE id = %s
+                    """,
+                    (deck_codec.encode(json.dumps(slide_doc)), request_id)
+                )
+                return
+
+            await conn.begin()
+            try:
+                await cursor.execute(SELECT_SLIDE_ROWS_FOR_UPDATE_SQL, (request_id,))
+                existing = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+                for sql, args, many in _plan_split(request_id, slide_doc, existing):
+                    if many:
+                        await cursor.executemany(sql, args)
+                    else:
+                        await cursor.execute(sql, args)
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+
+    async def update_slide_record(self, request_id, updated_slide_json: Union[str, Dict[str, Any]]) -> None:
+        """Overwrite the deck; accepts the JSON string or the parsed deck."""
+        if isinstance(updated_slide_json, str):
+            updated_slide_json = json.loads(updated_slide_json)
+        # A replaced deck gets a new revision, as with deck_store.save_deck
+        updated_slide_json = {**updated_slide_json, DECK_REVISION_KEY: uuid.uuid4().hex}
+        conn = await self._acquire()
+        try:
+            await self._write_deck(conn, request_id, updated_slide_json)
+        finally:
+            self._pool.release(conn)
+        # The shared tier talks to Redis synchronously; keep it off the event loop.
+        await asyncio.get_running_loop().run_in_executor(None, invalidate_deck, request_id)
+
+    async def store_slide_json(self, request_id, slide_json: Dict[str, Any]) -> None:
+        await self.update_slide_record(request_id, slide_json)
+
+    def stats(self) -> Optional[Dict[str, Any]]:
+        if self._pool is None:
+            return None
+        return {
+            "size": self._pool.size,
+            "idle": self._pool.freesize,
+            "in_use": self._pool.size - self._pool.freesize,
+            "max_size": self.max_size,
+        }
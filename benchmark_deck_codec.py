@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the deck column codec (deck_codec.py)
+
+Compares stored size and write/read latency of slide_json with no
+compression, zlib and zstd (if installed).
+
+    python benchmark_deck_codec.py                       # synthetic deck, codec only
+    python benchmark_deck_codec.py --request-id <id>     # a real deck from the database
+    python benchmark_deck_codec.py --db                  # also time round trips through MySQL
+
+Codec timings are encode (write path) and decode + json.loads (read path).
+With --db a scratch slide_requests row is written and read back for every
+codec, and LENGTH(slide_json) is reported as the stored row size; the row is
+deleted afterwards.
+"""
+
+import os
+import json
+import time
+import uuid
+import argparse
+import statistics
+
+from dotenv import load_dotenv
+
+import deck_codec
+from db_pool import connection as db_connection
+from deck_store import fetch_record
+
+load_dotenv()
+
+db_config = {
+    "host": os.getenv("DB_HOST"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+    "port": int(os.getenv("DB_PORT", 3306))
+}
+
+
+def synthetic_deck(slides=20):
+    """A deck shaped like GeneratePresentation output, with inline HTML for every element."""
+    deck = {"title": "Quarterly Business Review", "is_image_created": False, "slides": []}
+    for i in range(1, slides + 1):
+        deck["slides"].append({
+            "slide_id": f"slide_{i}",
+            "layout": "title-content-image",
+            "content": [
+                {"id": f"s{i}_title", "type": "heading",
+                 "html": f"<h1 class=\"slide-title\" style=\"font-size:40px;color:#1a1a2e\">Section {i}: Growth and Outlook</h1>"},
+                {"id": f"s{i}_body", "type": "bullet_list",
+                 "html": "<ul class=\"bullets\">" + "".join(
+                     f"<li style=\"margin-bottom:12px\">Revenue in region {j} grew {10 + j}% quarter over quarter, "
+                     f"driven by enterprise renewals and expansion.</li>" for j in range(5)) + "</ul>"},
+                {"id": f"s{i}_img", "type": "image", "prompt": f"A clean illustration of growth metrics for section {i}",
+                 "src": "", "is_image_created": False},
+            ],
+        })
+    return deck
+
+
+def codecs():
+    available = ["none", "zlib"]
+    try:
+        deck_codec._zstd()
+        available.append("zstd")
+    except ImportError:
+        print("zstandard not installed, skipping zstd")
+    return available
+
+
+def timed(fn, iterations):
+    samples = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def bench_codec(text, iterations):
+    print(f"\n{'codec':<6} {'bytes':>10} {'ratio':>7} {'encode ms':>10} {'decode ms':>10}")
+    for codec in codecs():
+        stored, encode_ms = timed(lambda: deck_codec.encode(text, codec=codec, min_bytes=0), iterations)
+        _, decode_ms = timed(lambda: json.loads(deck_codec.decode(stored)), iterations)
+        print(f"{codec:<6} {len(stored):>10} {len(text) / len(stored):>7.2f} {encode_ms:>10.3f} {decode_ms:>10.3f}")
+
+
+def bench_db(text, iterations):
+    request_id = f"bench-{uuid.uuid4()}"
+    print(f"\n{'codec':<6} {'row bytes':>10} {'write ms':>10} {'read ms':>10}   (scratch row {request_id})")
+    try:
+        with db_connection(db_config) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("INSERT INTO slide_requests (id, user_id, mindmap_json) VALUES (%s, NULL, '{}')", (request_id,))
+            conn.commit()
+
+        for codec in codecs():
+            def write():
+                with db_connection(db_config) as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(
+                            "UPDATE slide_requests SET slide_json = %s WHERE id = %s",
+                            (deck_codec.encode(text, codec=codec, min_bytes=0), request_id)
+                        )
+                    conn.commit()
+
+            def read():
+                with db_connection(db_config) as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT slide_json FROM slide_requests WHERE id = %s", (request_id,))
+                        return json.loads(deck_codec.decode(cursor.fetchone()[0]))
+
+            _, write_ms = timed(write, iterations)
+            _, read_ms = timed(read, iterations)
+            with db_connection(db_config) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT LENGTH(slide_json) FROM slide_requests WHERE id = %s", (request_id,))
+                    row_bytes = cursor.fetchone()[0]
+            print(f"{codec:<6} {row_bytes:>10} {write_ms:>10.3f} {read_ms:>10.3f}")
+    finally:
+        with db_connection(db_config) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM slide_requests WHERE id = %s", (request_id,))
+            conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark deck column compression")
+    parser.add_argument("--request-id", help="Benchmark this deck instead of a synthetic one")
+    parser.add_argument("--slides", type=int, default=20, help="Slides in the synthetic deck")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--db", action="store_true", help="Also time writes/reads through MySQL")
+    args = parser.parse_args()
+
+    if args.request_id:
+        record = fetch_record(db_config, args.request_id)
+        if not record or not record[1]:
+            raise SystemExit(f"No deck for request_id {args.request_id}")
+        deck_text = record[1]
+    else:
+        deck_text = json.dumps(synthetic_deck(args.slides))
+
+    print(f"Deck JSON: {len(deck_text)} bytes")
+    bench_codec(deck_text, args.iterations)
+    if args.db:
+        bench_db(deck_text, args.iterations)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the image upload preparation path (image_upload.py)
+
+Compares the old path (PIL decode + PNG re-encode into a new buffer) with
+the zero-decode path (upload Gemini's bytes as they are) on a PNG shaped
+like Gemini output, or on a real image file.
+
+    python benchmark_image_upload.py                    # synthetic 1024x1024 PNG
+    python benchmark_image_upload.py --image sample.png
+    python benchmark_image_upload.py --convert webp     # cost of IMAGE_UPLOAD_FORMAT=webp
+
+Each path runs in a fresh process so peak memory is not shared: CPU time
+is the median process time per image and peak memory is the growth of the
+process's max RSS while the path runs.
+"""
+
+import time
+import argparse
+import resource
+import statistics
+import multiprocessing
+from io import BytesIO
+
+from image_upload import prepare_upload, reencode
+
+
+def synthetic_png(size=1024):
+    """An RGB PNG with gradients and noise, so it compresses like an illustration rather than a flat fill."""
+    import os
+    from PIL import Image
+
+    gradient = Image.linear_gradient("L").resize((size, size))
+    noise = Image.frombytes("L", (size, size), os.urandom(size * size)).point(lambda v: v // 8)
+    img = Image.merge("RGB", (gradient, gradient.rotate(90), noise))
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def legacy(data):
+    """The previous upload path: decode, re-encode to PNG, upload from a new buffer."""
+    from PIL import Image
+
+    img = Image.open(BytesIO(data))
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    buf.seek(0)
+    return buf.read()
+
+
+PATHS = {
+    "legacy": legacy,
+    "zero-decode": lambda data: prepare_upload(data, "image/png", convert_to="")[0],
+}
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(name, data, iterations, convert, results):
+    fn = PATHS[name] if name in PATHS else (lambda d: reencode(d, convert))
+    baseline = _max_rss_kb()
+    samples = []
+    body = b""
+    for _ in range(iterations):
+        start = time.process_time()
+        body = fn(data)
+        samples.append((time.process_time() - start) * 1000)
+    results.put((name, statistics.median(samples), (_max_rss_kb() - baseline) / 1024, len(body)))
+
+
+def run(name, data, iterations, convert=None):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(name, data, iterations, convert, results))
+    proc.start()
+    result = results.get()
+    proc.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image upload preparation")
+    parser.add_argument("--image", help="Benchmark this image file instead of a synthetic PNG")
+    parser.add_argument("--size", type=int, default=1024, help="Edge of the synthetic PNG in pixels")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--convert", choices=["png", "jpeg", "webp"],
+                        help="Also time conversion to this format (IMAGE_UPLOAD_FORMAT)")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            image = f.read()
+    else:
+        image = synthetic_png(args.size)
+
+    names = list(PATHS) + ([f"convert-{args.convert}"] if args.convert else [])
+    print(f"Image: {len(image)} bytes")
+    print(f"\n{'path':<14} {'cpu ms/image':>13} {'peak MB':>9} {'upload bytes':>13}")
+    for name in names:
+        name, cpu_ms, peak_mb, body_bytes = run(name, image, args.iterations, args.convert)
+        print(f"{name:<14} {cpu_ms:>13.3f} {peak_mb:>9.1f} {body_bytes:>13}")
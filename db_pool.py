@@ -0,0 +1,259 @@
+"""
+Shared MySQL Connection Pool
+
+All services (slide2, slide_service, mindmap) borrow connections from this
+module instead of calling pymysql.connect per query, so the TCP + auth
+handshake is paid once per pooled connection rather than once per request.
+
+Usage:
+    from db_pool import connection
+
+    with connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+Configuration (environment variables):
+    DB_POOL_SIZE      Maximum open connections per pool (default 10)
+    DB_POOL_TIMEOUT   Seconds to wait for a free connection (default 10)
+    DB_POOL_RECYCLE   Max connection age in seconds before reopening (default 1800)
+    DB_POOL_PRE_PING  Ping idle connections before handing them out (default 1)
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+
+
+class PoolTimeoutError(RuntimeError):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of pymysql connections.
+
+    Connections are opened lazily up to ``max_size``. Idle connections are
+    handed out most-recently-used first, pinged before reuse when
+    ``pre_ping`` is set, and reopened once older than ``recycle`` seconds.
+    """
+
+    def __init__(self, db_config: Dict[str, Any], max_size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT, recycle: int = DB_POOL_RECYCLE,
+                 pre_ping: bool = DB_POOL_PRE_PING):
+        self._config = dict(db_config)
+        # Pooled connections run in autocommit mode so a plain SELECT never
+        # leaves a stale REPEATABLE READ snapshot behind for the next borrower.
+        self._config.setdefault("autocommit", True)
+        self.name = f"{self._config.get('host')}:{self._config.get('port', 3306)}/{self._config.get('database')}"
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._cond = threading.Condition()
+        self._idle: List[Tuple[pymysql.connections.Connection, float]] = []
+        self._open = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    # --- connection lifecycle ---
+
+    def _connect(self) -> Tuple[pymysql.connections.Connection, float]:
+        conn = pymysql.connect(**self._config)
+        with self._cond:
+            self._created += 1
+        return conn, time.monotonic()
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _validate(self, entry):
+        conn, created_at = entry
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            self._close_quietly(conn)
+            with self._cond:
+                self._recycled += 1
+            return self._connect()
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._close_quietly(conn)
+                with self._cond:
+                    self._ping_failures += 1
+                return self._connect()
+        return entry
+
+    def acquire(self):
+        """Check out a ``(connection, created_at)`` entry, waiting up to ``timeout`` seconds."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError(f"Connection pool {self.name} is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a connection from {self.name}"
+                    )
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - started
+            self._in_use += 1
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+        try:
+            return self._connect() if entry is None else self._validate(entry)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, entry, discard: bool = False) -> None:
+        """Return a checked-out entry; broken connections should be released with ``discard=True``."""
+        conn = entry[0]
+        if not discard and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            # Never hand an open transaction to the next borrower.
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._open -= 1
+            else:
+                self._idle.append(entry)
+                entry = None
+            self._cond.notify()
+
+        if entry is not None:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection."""
+        entry = self.acquire()
+        discard = False
+        try:
+            yield entry[0]
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.release(entry, discard=discard)
+
+    def close(self) -> None:
+        """Close all idle connections and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    # --- metrics ---
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool utilisation and checkout wait times."""
+        with self._cond:
+            return {
+                "pool": self.name,
+                "max_size": self.max_size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "ping_failures": self._ping_failures,
+                "wait_ms_total": round(self._total_wait * 1000, 3),
+                "wait_ms_avg": round(self._total_wait * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_ms_max": round(self._max_wait * 1000, 3),
+            }
+
+
+_pools: Dict[Tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(db_config: Dict[str, Any]) -> Tuple:
+    return tuple(sorted((k, repr(v)) for k, v in db_config.items()))
+
+
+def get_pool(db_config: Dict[str, Any]) -> ConnectionPool:
+    """Return the process-wide pool for ``db_config``, creating it on first use."""
+    key = _pool_key(db_config)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_config)
+                _pools[key] = pool
+                logger.info(f"Created MySQL connection pool {pool.name} (max_size={pool.max_size})")
+    return pool
+
+
+@contextmanager
+def connection(db_config: Dict[str, Any]):
+    """Borrow a connection from the shared pool for ``db_config``."""
+    with get_pool(db_config).connection() as conn:
+        yield conn
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """Stats for every pool opened in this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+def close_all_pools() -> None:
+    """Close every pool; used on shutdown."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
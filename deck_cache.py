@@ -0,0 +1,134 @@
+"""
+In-Process Deck Cache
+
+Bounded LRU + TTL cache of parsed slide decks keyed by request_id, so hot
+decks that are being edited interactively are served from memory instead of
+re-reading and json.loads-ing the LONGTEXT column on every call.
+
+Entries are invalidated by the deck_store write functions. Values are shared
+between callers and must be treated as read-only; copy before mutating.
+
+Writes made by other processes (other web workers, job_worker.py,
+slide_service) only reach this cache through the shared tier's invalidations
+(DECK_SHARED_CACHE_URL). Without it, entries are kept for 2 seconds by
+default, so polling clients still see image progress almost immediately.
+
+Configuration (environment variables):
+    DECK_CACHE_SIZE   Maximum cached decks per process (default 256, 0 disables)
+    DECK_CACHE_TTL    Seconds an entry stays fresh (default 300 with
+                      DECK_SHARED_CACHE_URL set, otherwise 2)
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+DECK_CACHE_SIZE = int(os.getenv("DECK_CACHE_SIZE", 256))
+# Long-lived entries are only safe when other processes' writes invalidate them
+DECK_CACHE_TTL = float(os.getenv("DECK_CACHE_TTL", 300 if os.getenv("DECK_SHARED_CACHE_URL") else 2))
+
+
+class DeckCache:
+    """Thread-safe LRU cache with per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_entries: int = DECK_CACHE_SIZE, ttl: float = DECK_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # Stamped on every invalidation so a load that raced with a write never
+        # re-populates the cache with the value read before that write. Keys
+        # pruned from the map fall back to ``_floor``, which only moves forward.
+        self._generations: Dict[Hashable, int] = {}
+        self._clock = 0
+        self._floor = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, self._floor):
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, key: Hashable) -> int:
+        with self._lock:
+            return self._generations.get(key, self._floor)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return the cached value, or call ``loader`` and cache a non-None result."""
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+        generation = self.generation(key)
+        value = loader()
+        if value is not None:
+            self.put(key, value, generation=generation)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._clock += 1
+            self._generations.pop(key, None)
+            self._generations[key] = self._clock
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+            if len(self._generations) > max(self.max_entries, 1) * 4:
+                # Generations only matter while a load is in flight; drop the oldest.
+                for stale in list(self._generations)[: len(self._generations) // 2]:
+                    self._floor = max(self._floor, self._generations.pop(stale))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clock += 1
+            self._generations.clear()
+            self._floor = self._clock
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,85 @@
+"""
+Deck Column Codec
+
+Optional transparent compression for the large JSON columns
+(slide_requests.mindmap_json and slide_requests.slide_json). Decks carry
+inline HTML for every element, so they compress very well.
+
+The columns stay LONGTEXT: a compressed value is one header character
+followed by the base64 of the compressed UTF-8 JSON. Plain JSON always starts
+with "{", "[" or whitespace, so values written before compression was
+enabled (or below the size threshold) are read back unchanged, and turning
+compression off again only affects new writes.
+
+    Z<base64 zlib>   zlib (standard library)
+    S<base64 zstd>   zstandard (pip install zstandard)
+
+Configuration (environment variables):
+    DECK_COMPRESSION            none (default), zlib or zstd
+    DECK_COMPRESSION_LEVEL      Codec level (default 6 for zlib, 3 for zstd)
+    DECK_COMPRESSION_MIN_BYTES  Values shorter than this are stored as plain
+                                JSON (default 1024)
+
+Compressed values are opaque to MySQL's JSON functions, so deck_store turns
+server-side JSON projection off by default while compression is enabled.
+"""
+
+import os
+import base64
+import zlib
+from typing import Optional, Union
+
+DECK_COMPRESSION = os.getenv("DECK_COMPRESSION", "none").lower()
+DECK_COMPRESSION_LEVEL = os.getenv("DECK_COMPRESSION_LEVEL")
+DECK_COMPRESSION_MIN_BYTES = int(os.getenv("DECK_COMPRESSION_MIN_BYTES", 1024))
+
+ZLIB_HEADER = "Z"
+ZSTD_HEADER = "S"
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstandard is required for zstd deck compression. Install with: pip install zstandard")
+    return zstandard
+
+
+def _compress(codec: str, data: bytes, level: Optional[int]) -> str:
+    if codec == "zlib":
+        return ZLIB_HEADER + base64.b64encode(zlib.compress(data, 6 if level is None else level)).decode("ascii")
+    if codec == "zstd":
+        compressor = _zstd().ZstdCompressor(level=3 if level is None else level)
+        return ZSTD_HEADER + base64.b64encode(compressor.compress(data)).decode("ascii")
+    raise ValueError(f"Unknown deck compression codec '{codec}'")
+
+
+def encode(text: Optional[str], codec: str = DECK_COMPRESSION, level: Optional[int] = None,
+           min_bytes: int = DECK_COMPRESSION_MIN_BYTES) -> Optional[str]:
+    """Compress a JSON string for storage; returns it unchanged when compression is off or not worth it."""
+    if text is None or codec == "none" or len(text) < min_bytes:
+        return text
+    if level is None and DECK_COMPRESSION_LEVEL:
+        level = int(DECK_COMPRESSION_LEVEL)
+    encoded = _compress(codec, text.encode("utf-8"), level)
+    return encoded if len(encoded) < len(text) else text
+
+
+def decode(value: Union[str, bytes, None]) -> Optional[str]:
+    """Return the plain JSON string for a stored column value, compressed or not."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    if not value:
+        return value
+    header = value[0]
+    if header == ZLIB_HEADER:
+        return zlib.decompress(base64.b64decode(value[1:])).decode("utf-8")
+    if header == ZSTD_HEADER:
+        return _zstd().ZstdDecompressor().decompress(base64.b64decode(value[1:])).decode("utf-8")
+    return value
+
+
+def enabled() -> bool:
+    return DECK_COMPRESSION != "none"
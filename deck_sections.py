@@ -0,0 +1,128 @@
+"""
+Sectioned Deck Generation
+
+One GeneratePresentation call writes the whole deck on the model side, so its
+latency grows with the outline. For long outlines the outline is split into
+contiguous groups of sections, each group is generated by its own
+GeneratePresentation call through the async BAML client, and the partial
+decks are merged back in outline order:
+
+- slide_ids are renumbered slide_1..slide_N across the deck
+- element ids get the new slide's ``s<N>_`` prefix and are made unique
+- backgrounds of later groups are mapped onto the first group's backgrounds
+  (by order of first use), so the deck keeps one theme
+
+The merge only depends on the group results and their order, never on which
+call finished first, so the same responses always give the same deck.
+
+Usage:
+    from deck_sections import generate_slides
+
+    slides = generate_slides(presentation_input)   # List[types.SlideContent]
+    slides = generate_slides(presentation_input, bypass_cache=True)   # regenerate
+
+Configuration (environment variables):
+    DECK_SECTION_MIN          Outline sections from which generation is split (default 0, disabled)
+    DECK_SECTION_GROUP_SIZE   Outline sections per GeneratePresentation call (default 2)
+    DECK_SECTION_CONCURRENCY  Group calls in flight at once (default 4)
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+# Both clients go through the LLM response cache (llm_cache.py), per section group
+from llm_cache import b as sync_b, async_b
+
+logger = logging.getLogger(__name__)
+
+DECK_SECTION_MIN = int(os.getenv("DECK_SECTION_MIN", 0))
+DECK_SECTION_GROUP_SIZE = int(os.getenv("DECK_SECTION_GROUP_SIZE", 2))
+DECK_SECTION_CONCURRENCY = int(os.getenv("DECK_SECTION_CONCURRENCY", 4))
+
+_SLIDE_PREFIX = re.compile(r"^s\d+_")
+
+
+def partition_outline(outline: List[Any], group_size: int = DECK_SECTION_GROUP_SIZE) -> List[List[Any]]:
+    """Contiguous groups of at most ``group_size`` sections, in outline order."""
+    group_size = max(1, group_size)
+    return [outline[i:i + group_size] for i in range(0, len(outline), group_size)]
+
+
+def _element_id(element_id: Optional[str], slide_number: int, used: set) -> str:
+    base = _SLIDE_PREFIX.sub("", element_id or "el")
+    candidate = f"s{slide_number}_{base}"
+    suffix = 2
+    while candidate in used:
+        candidate = f"s{slide_number}_{base}_{suffix}"
+        suffix += 1
+    used.add(candidate)
+    return candidate
+
+
+def merge_sections(groups: List[List[Any]]) -> List[Any]:
+    """
+    Concatenate per-group slide lists (SlideContent objects, changed in place)
+    into one deck with renumbered slide_ids, unique element ids and the first
+    group's backgrounds.
+    """
+    palette: List[str] = []
+    for slide in groups[0] if groups else []:
+        if slide.background and slide.background not in palette:
+            palette.append(slide.background)
+
+    merged, used_ids = [], set()
+    for group_index, slides in enumerate(groups):
+        backgrounds: Dict[str, str] = {}
+        for slide in slides:
+            if group_index and palette and slide.background:
+                if slide.background not in backgrounds:
+                    backgrounds[slide.background] = palette[len(backgrounds) % len(palette)]
+                slide.background = backgrounds[slide.background]
+
+            number = len(merged) + 1
+            slide.slide_id = f"slide_{number}"
+            for element in slide.content or []:
+                element.id = _element_id(getattr(element, "id", None), number, used_ids)
+            merged.append(slide)
+    return merged
+
+
+async def generate_slides_async(presentation_input: Dict[str, Any],
+                                group_size: int = DECK_SECTION_GROUP_SIZE,
+                                concurrency: int = DECK_SECTION_CONCURRENCY,
+                                bypass_cache: bool = False) -> List[Any]:
+    """Generate every section group concurrently and merge them in outline order."""
+    groups = partition_outline(presentation_input.get("outline", []), group_size)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def generate(sections):
+        async with semaphore:
+            return await async_b.GeneratePresentation(
+                {**presentation_input, "outline": sections}, bypass_cache=bypass_cache
+            )
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(generate(sections) for sections in groups))
+    slides = merge_sections([list(result) for result in results])
+    logger.info(
+        f"Generated {len(slides)} slides from {len(groups)} section groups "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return slides
+
+
+def generate_slides(presentation_input: Dict[str, Any], bypass_cache: bool = False) -> List[Any]:
+    """
+    GeneratePresentation for ``presentation_input``: split into concurrent
+    section groups when the outline has at least DECK_SECTION_MIN sections
+    (and more than one group), otherwise a single call. ``bypass_cache``
+    always calls the model (regenerate) and refreshes the cached responses.
+    """
+    outline = presentation_input.get("outline", [])
+    if not DECK_SECTION_MIN or len(outline) < DECK_SECTION_MIN or len(outline) <= DECK_SECTION_GROUP_SIZE:
+        return sync_b.GeneratePresentation(presentation_input, bypass_cache=bypass_cache)
+    return asyncio.run(generate_slides_async(presentation_input, bypass_cache=bypass_cache))
@@ -0,0 +1,989 @@
+"""
+Slide Deck Storage
+
+Persistence layer for the slide deck stored against each slide_requests row.
+Two storage modes are supported, selected with SLIDE_STORAGE_MODE:
+
+    document  (default) The whole deck is one JSON document in
+              slide_requests.slide_json, as it has always been.
+    slides    Every slide is its own row in slide_request_slides, keyed by
+              (request_id, slide_id) with a per-slide version.
+              slide_requests.slide_json only keeps the deck-level keys plus a
+              "_slide_rows" marker, so editing one slide rewrites one row.
+
+Readers understand both layouts, so decks can be migrated lazily (the first
+per-slide write to a document-layout deck splits it) or in bulk:
+
+    python deck_store.py --create-table --backfill
+
+Every write bumps slide_requests.slide_version. Writers never rewrite a deck
+they read earlier: single content blocks are patched in place, an edited
+slide is three-way merged field by field onto the stored slide, and full
+decks are only written when the deck is replaced (e.g. by generation):
+
+    python deck_store.py --add-version-column
+
+Each replacement also gives the deck a new ``deck_revision`` id. Content
+block updates computed from an earlier deck (e.g. images of a generation run
+that was cancelled because the deck was regenerated) pass the revision they
+read and are rejected once the deck has been replaced, even though the new
+deck reuses the same slide and block ids.
+
+Single slide / content block reads use MySQL JSON functions (JSON_SEARCH +
+JSON_EXTRACT) to project just the requested item server-side, so neither
+mindmap_json nor the rest of the deck crosses the wire or gets parsed in
+Python. Set DECK_JSON_PROJECTION=0 to parse in Python instead. Single
+content block updates (image src, edited text) are likewise applied in place
+with JSON_SET, or to the one slide row of a split deck.
+
+Full documents written here go through deck_codec, which can compress them
+(DECK_COMPRESSION=zlib|zstd); reads decode either form. Split-deck headers
+and slide rows are always stored as plain JSON.
+
+Parsed decks are cached in-process (see deck_cache.py) and, when
+DECK_SHARED_CACHE_URL is set, in a shared Redis tier (see shared_cache.py).
+Every write through this module invalidates both tiers in every process.
+"""
+
+import os
+import copy
+import json
+import uuid
+import logging
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymysql
+
+import deck_codec
+from db_pool import connection as db_connection
+from deck_cache import DeckCache
+from shared_cache import create_shared_cache
+
+logger = logging.getLogger(__name__)
+
+SLIDE_STORAGE_MODE = os.getenv("SLIDE_STORAGE_MODE", "document").lower()
+SLIDE_ROWS_MARKER = "_slide_rows"
+# Compressed documents are opaque to MySQL's JSON functions.
+DECK_JSON_PROJECTION = os.getenv(
+    "DECK_JSON_PROJECTION", "0" if deck_codec.enabled() else "1"
+) not in ("0", "false", "False")
+
+CREATE_SLIDES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS slide_request_slides (
+    request_id VARCHAR(255) NOT NULL,
+    slide_id VARCHAR(255) NOT NULL,
+    position INT NOT NULL,
+    slide_json MEDIUMTEXT NOT NULL,
+    version INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (request_id, slide_id),
+    KEY idx_request_position (request_id, position)
+)
+"""
+
+ADD_VERSION_COLUMN_SQL = "ALTER TABLE slide_requests ADD COLUMN slide_version INT NOT NULL DEFAULT 0"
+
+# Server-side projections. JSON_SEARCH finds the path of the matching id
+# (e.g. '$.slides[2].slide_id'), SUBSTRING_INDEX trims it to the enclosing
+# object ('$.slides[2]') and JSON_EXTRACT returns only that object.
+_SLIDE_PATH_SQL = (
+    "SUBSTRING_INDEX(JSON_UNQUOTE(JSON_SEARCH(slide_json, 'one', %s, NULL, '$.slides[*].slide_id')), '.slide_id', 1)"
+)
+
+PROJECT_SLIDE_SQL = f"""
+SELECT slide_json IS NOT NULL
+     , JSON_EXTRACT(slide_json, '$.{SLIDE_ROWS_MARKER}')
+     , JSON_EXTRACT(slide_json, {_SLIDE_PATH_SQL})
+  FROM slide_requests
+ WHERE id = %s
+"""
+
+PROJECT_CONTENT_SQL = f"""
+SELECT has_deck
+     , split
+     , slide_path IS NOT NULL
+     , JSON_EXTRACT(slide_json, SUBSTRING_INDEX(JSON_UNQUOTE(
+           JSON_SEARCH(slide_json, 'one', %s, NULL, CONCAT(slide_path, '.content[*].id'))), '.id', 1))
+  FROM (SELECT slide_json
+             , slide_json IS NOT NULL AS has_deck
+             , JSON_EXTRACT(slide_json, '$.{SLIDE_ROWS_MARKER}') AS split
+             , {_SLIDE_PATH_SQL} AS slide_path
+          FROM slide_requests
+         WHERE id = %s) AS deck
+"""
+
+LOCATE_CONTENT_SQL = f"""
+SELECT slide_json IS NOT NULL
+     , JSON_EXTRACT(slide_json, '$.{SLIDE_ROWS_MARKER}')
+     , {_SLIDE_PATH_SQL}
+     , SUBSTRING_INDEX(JSON_UNQUOTE(
+           JSON_SEARCH(slide_json, 'one', %s, NULL, CONCAT({_SLIDE_PATH_SQL}, '.content[*].id'))), '.id', 1)
+  FROM slide_requests
+ WHERE id = %s
+   FOR UPDATE
+"""
+
+PROJECT_ROW_CONTENT_SQL = """
+SELECT JSON_EXTRACT(slide_json, SUBSTRING_INDEX(JSON_UNQUOTE(
+           JSON_SEARCH(slide_json, 'one', %s, NULL, '$.content[*].id')), '.id', 1))
+  FROM slide_request_slides
+ WHERE request_id = %s AND slide_id = %s
+"""
+
+
+deck_cache = DeckCache()
+shared_deck_cache = create_shared_cache()
+if shared_deck_cache is not None:
+    shared_deck_cache.add_listener(deck_cache.invalidate)
+
+
+def invalidate_deck(request_id) -> None:
+    """Drop a deck from the in-process cache and the shared tier (all processes)."""
+    deck_cache.invalidate(request_id)
+    if shared_deck_cache is not None:
+        shared_deck_cache.invalidate(request_id)
+
+
+class DeckNotFoundError(LookupError):
+    """Raised when a slide_requests row is missing or has no slides yet."""
+
+
+class DeckReplacedError(DeckNotFoundError):
+    """Raised when a deck was replaced since the revision an update was computed from."""
+
+
+# Deck field changed by every full replacement; see update_content_blocks
+DECK_REVISION_KEY = "deck_revision"
+# Revision argument that applies an update to whatever deck is stored
+ANY_REVISION = object()
+
+
+def deck_revision(slide_doc: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Revision of a parsed deck; None for decks stored before revisions existed."""
+    return slide_doc.get(DECK_REVISION_KEY) if slide_doc else None
+
+
+def _check_revision(request_id, current: Optional[str], expected: Any) -> None:
+    if expected is not ANY_REVISION and current != expected:
+        raise DeckReplacedError(f"Deck {request_id} was replaced (revision {expected} is now {current})")
+
+
+# --- three-way merge ---
+
+_MISSING = object()
+
+
+def _list_key(items: List[Any]) -> Optional[str]:
+    """Identity key for lists of slides or content blocks, None for plain lists."""
+    for key in ("slide_id", "id"):
+        if all(isinstance(item, dict) and key in item for item in items):
+            return key
+    return None
+
+
+def _merge_lists(base: List[Any], mine: List[Any], theirs: List[Any], key: str) -> List[Any]:
+    base_map = {item[key]: item for item in base}
+    mine_map = {item[key]: item for item in mine}
+    theirs_map = {item[key]: item for item in theirs}
+
+    merged = []
+    for item in theirs:
+        k = item[key]
+        if k in mine_map:
+            merged.append(_merge_value(base_map.get(k, _MISSING), mine_map[k], item))
+        elif k not in base_map or item != base_map[k]:
+            # Added by them, or changed by them after we deleted it: keep theirs.
+            merged.append(item)
+
+    for index, item in enumerate(mine):
+        k = item[key]
+        if k in theirs_map or (k in base_map and item == base_map[k]):
+            continue
+        # Added by us (or edited by us after they deleted it): place it after
+        # the nearest preceding item that survived the merge.
+        position = 0
+        for prev in reversed(mine[:index]):
+            hits = [i for i, m in enumerate(merged) if m.get(key) == prev[key]]
+            if hits:
+                position = hits[0] + 1
+                break
+        merged.insert(position, item)
+    return merged
+
+
+def _merge_value(base: Any, mine: Any, theirs: Any) -> Any:
+    if mine == base:
+        return theirs
+    if theirs == base or mine == theirs:
+        return mine
+    if isinstance(mine, dict) and isinstance(theirs, dict) and isinstance(base, dict):
+        merged = {}
+        for k in list(theirs) + [k for k in mine if k not in theirs]:
+            value = _merge_value(base.get(k, _MISSING), mine.get(k, _MISSING), theirs.get(k, _MISSING))
+            if value is not _MISSING:
+                merged[k] = value
+        return merged
+    if isinstance(mine, list) and isinstance(theirs, list) and isinstance(base, list):
+        key = _list_key(base + mine + theirs)
+        if key:
+            return _merge_lists(base, mine, theirs, key)
+    # Both sides changed the same field: the writer being merged wins.
+    return mine
+
+
+def merge_decks(base: Dict[str, Any], mine: Dict[str, Any], theirs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Three-way merge of a deck (or a single slide).
+
+    ``base`` is what the writer originally read, ``mine`` is the writer's
+    result and ``theirs`` is what is stored now. Slides and content blocks
+    are matched by slide_id / id, and only fields the writer actually changed
+    are applied on top of ``theirs``.
+    """
+    return _merge_value(base, mine, theirs)
+
+
+def _is_split(header: Any) -> bool:
+    return isinstance(header, dict) and header.get(SLIDE_ROWS_MARKER) is True
+
+
+def _parse_header(slide_json: str) -> Tuple[Dict[str, Any], bool]:
+    """Parse slide_requests.slide_json and report whether it is a split-deck header."""
+    doc = json.loads(deck_codec.decode(slide_json))
+    return doc, _is_split(doc)
+
+
+def _assemble(header: Dict[str, Any], slides: List[Dict[str, Any]]) -> Dict[str, Any]:
+    doc = {k: v for k, v in header.items() if k != SLIDE_ROWS_MARKER}
+    doc["slides"] = slides
+    return doc
+
+
+def _fetch_slide_rows(cursor, request_id: str) -> List[Dict[str, Any]]:
+    cursor.execute(
+        "SELECT slide_json FROM slide_request_slides WHERE request_id = %s ORDER BY position",
+        (request_id,)
+    )
+    return [json.loads(row[0]) for row in cursor.fetchall()]
+
+
+def _search_literal(value: str) -> str:
+    """Escape LIKE wildcards so JSON_SEARCH matches ids such as 's1_img' exactly."""
+    return str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _json_true(value: Any) -> bool:
+    return value in ("true", b"true")
+
+
+def _find_content(slide: Optional[Dict[str, Any]], content_id) -> Optional[Dict[str, Any]]:
+    if slide is None:
+        return None
+    return next((c for c in slide.get("content", []) if c.get("id") == content_id), None)
+
+
+def _plan_split(request_id: str, slide_doc: Dict[str, Any], existing: Dict[str, Tuple[int, str]]) -> List[Tuple[str, Any, bool]]:
+    """
+    Statements that store ``slide_doc`` in the per-slide layout given the
+    ``existing`` rows ({slide_id: (position, slide_json)}), as
+    ``(sql, args, executemany)``. Only slides whose JSON or position changed
+    are rewritten.
+    """
+    slides = slide_doc.get("slides") or []
+    header = {k: v for k, v in slide_doc.items() if k != "slides"}
+    header[SLIDE_ROWS_MARKER] = True
+
+    statements = []
+    seen = set()
+    inserts = []
+    for position, slide in enumerate(slides):
+        slide_id = slide.get("slide_id") or f"slide_{position + 1}"
+        if slide_id in seen:
+            slide_id = f"{slide_id}#{position}"
+        seen.add(slide_id)
+
+        slide_text = json.dumps(slide)
+        if slide_id not in existing:
+            inserts.append((request_id, slide_id, position, slide_text))
+        elif existing[slide_id] != (position, slide_text):
+            statements.append((
+                """
+                UPDATE slide_request_slides
+                   SET position = %s
+                     , slide_json = %s
+                     , version = version + 1
+                 WHERE request_id = %s AND slide_id = %s
+                """,
+                (position, slide_text, request_id, slide_id),
+                False
+            ))
+
+    if inserts:
+        statements.append((
+            "INSERT INTO slide_request_slides (request_id, slide_id, position, slide_json) VALUES (%s, %s, %s, %s)",
+            inserts,
+            True
+        ))
+
+    removed = [slide_id for slide_id in existing if slide_id not in seen]
+    if removed:
+        statements.append((
+            "DELETE FROM slide_request_slides WHERE request_id = %s AND slide_id = %s",
+            [(request_id, slide_id) for slide_id in removed],
+            True
+        ))
+
+    statements.append((
+        """
+        UPDATE slide_requests
+           SET slide_json = %s
+             , slide_version = slide_version + 1
+             , updated_at = NOW()
+         WHERE id = %s
+        """,
+        (json.dumps(header), request_id),
+        False
+    ))
+    return statements
+
+
+SELECT_SLIDE_ROWS_FOR_UPDATE_SQL = (
+    "SELECT slide_id, position, slide_json FROM slide_request_slides WHERE request_id = %s FOR UPDATE"
+)
+
+
+def _write_split(cursor, request_id: str, slide_doc: Dict[str, Any]) -> None:
+    """
+    Store ``slide_doc`` in the per-slide layout, rewriting only slides whose
+    JSON or position changed. Must run inside a transaction.
+    """
+    cursor.execute(SELECT_SLIDE_ROWS_FOR_UPDATE_SQL, (request_id,))
+    existing = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    for sql, args, many in _plan_split(request_id, slide_doc, existing):
+        if many:
+            cursor.executemany(sql, args)
+        else:
+            cursor.execute(sql, args)
+
+
+# --- reads ---
+
+def fetch_record(db_config, request_id):
+    """
+    Fetch ``(mindmap_json, slide_json, updated_at)`` for a request.
+
+    ``slide_json`` is always the full-deck JSON string regardless of the
+    storage layout, so existing callers keep working unchanged.
+    """
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT mindmap_json, slide_json, updated_at FROM slide_requests WHERE id = %s",
+                (request_id,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return row
+            row = (deck_codec.decode(row[0]), deck_codec.decode(row[1]), row[2])
+            if not row[1] or f'"{SLIDE_ROWS_MARKER}"' not in row[1]:
+                return row
+
+            header, split = _parse_header(row[1])
+            if not split:
+                return row
+            slides = _fetch_slide_rows(cursor, request_id)
+
+    return row[0], json.dumps(_assemble(header, slides)), row[2]
+
+
+def _fetch_slide_row(cursor, request_id, slide_id) -> Optional[Dict[str, Any]]:
+    cursor.execute(
+        "SELECT slide_json FROM slide_request_slides WHERE request_id = %s AND slide_id = %s",
+        (request_id, slide_id)
+    )
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _fetch_slide_parsed(cursor, request_id, slide_id) -> Optional[Dict[str, Any]]:
+    """Python fallback: read slide_json and parse it to find the slide."""
+    cursor.execute("SELECT slide_json FROM slide_requests WHERE id = %s", (request_id,))
+    row = cursor.fetchone()
+    if not row or not row[0]:
+        raise DeckNotFoundError(f"No slides for request_id {request_id}")
+
+    doc, split = _parse_header(row[0])
+    if split:
+        return _fetch_slide_row(cursor, request_id, slide_id)
+    return next((s for s in doc.get("slides", []) if s.get("slide_id") == slide_id), None)
+
+
+def fetch_slide(db_config, request_id, slide_id) -> Optional[Dict[str, Any]]:
+    """
+    Fetch a single slide without reading mindmap_json or the rest of the deck.
+    Split decks read just that slide's row; document decks are projected
+    server-side with JSON_EXTRACT.
+
+    Returns None if the deck has no such slide; raises DeckNotFoundError if the
+    request or its deck does not exist.
+    """
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            if DECK_JSON_PROJECTION:
+                try:
+                    cursor.execute(PROJECT_SLIDE_SQL, (_search_literal(slide_id), request_id))
+                    row = cursor.fetchone()
+                except pymysql.err.MySQLError as e:
+                    logger.warning(f"JSON projection failed for {request_id}, parsing in Python: {e}")
+                else:
+                    if not row or not row[0]:
+                        raise DeckNotFoundError(f"No slides for request_id {request_id}")
+                    if _json_true(row[1]):
+                        return _fetch_slide_row(cursor, request_id, slide_id)
+                    return json.loads(row[2]) if row[2] else None
+
+            return _fetch_slide_parsed(cursor, request_id, slide_id)
+
+
+def fetch_content_block(db_config, request_id, slide_id, content_id) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Fetch one content block as ``(slide_found, content)``, served from a cached
+    deck when one is hot, otherwise projected server-side so only the block
+    itself is transferred and parsed.
+
+    Raises DeckNotFoundError if the request or its deck does not exist.
+    """
+    record = _peek_cached_deck(request_id)
+    if record is not None:
+        if not record[1]:
+            raise DeckNotFoundError(f"No slides for request_id {request_id}")
+        slide = next((s for s in record[1].get("slides", []) if s.get("slide_id") == slide_id), None)
+        content = _find_content(slide, content_id)
+        return slide is not None, copy.deepcopy(content) if content is not None else None
+
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            if DECK_JSON_PROJECTION:
+                try:
+                    cursor.execute(PROJECT_CONTENT_SQL, (_search_literal(content_id), _search_literal(slide_id), request_id))
+                    row = cursor.fetchone()
+                    if row and row[0] and _json_true(row[1]):
+                        cursor.execute(PROJECT_ROW_CONTENT_SQL, (_search_literal(content_id), request_id, slide_id))
+                        slide_row = cursor.fetchone()
+                        if not slide_row:
+                            return False, None
+                        return True, json.loads(slide_row[0]) if slide_row[0] else None
+                except pymysql.err.MySQLError as e:
+                    logger.warning(f"JSON projection failed for {request_id}, parsing in Python: {e}")
+                else:
+                    if not row or not row[0]:
+                        raise DeckNotFoundError(f"No slides for request_id {request_id}")
+                    return bool(row[2]), json.loads(row[3]) if row[3] else None
+
+            slide = _fetch_slide_parsed(cursor, request_id, slide_id)
+    return slide is not None, _find_content(slide, content_id)
+
+
+def _peek_cached_deck(request_id):
+    """Cached record from the in-process or shared tier, without loading from MySQL."""
+    record = deck_cache.get(request_id)
+    if record is None and shared_deck_cache is not None:
+        generation = deck_cache.generation(request_id)
+        record = shared_deck_cache.get(request_id)
+        if record is not None:
+            deck_cache.put(request_id, record, generation=generation)
+    return record
+
+
+def fetch_deck_cached(db_config, request_id):
+    """
+    Read-through cached ``(mindmap_json, slide_doc, updated_at)`` with the deck
+    already parsed (``slide_doc`` is None if no slides were generated yet).
+    The returned objects are shared: do not mutate them.
+    """
+    def load_from_db():
+        record = fetch_record(db_config, request_id)
+        if not record:
+            return None
+        mindmap_json, slide_json, updated_at = record
+        return mindmap_json, json.loads(slide_json) if slide_json else None, updated_at
+
+    def load():
+        if shared_deck_cache is None:
+            return load_from_db()
+        return shared_deck_cache.get_or_load(request_id, load_from_db)
+
+    return deck_cache.get_or_load(request_id, load)
+
+
+def fetch_slide_cached(db_config, request_id, slide_id) -> Optional[Dict[str, Any]]:
+    """
+    Same contract as :func:`fetch_slide`, returning a private copy. Served from
+    a cached deck when one is hot, otherwise projected server-side.
+    """
+    record = _peek_cached_deck(request_id)
+    if record is None:
+        return fetch_slide(db_config, request_id, slide_id)
+    if not record[1]:
+        raise DeckNotFoundError(f"No slides for request_id {request_id}")
+    slide = next((s for s in record[1].get("slides", []) if s.get("slide_id") == slide_id), None)
+    return copy.deepcopy(slide) if slide is not None else None
+
+
+def fetch_deck(db_config, request_id) -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    Fetch the parsed deck together with its ``slide_version``.
+    Returns ``(None, 0)`` if the request is missing.
+    """
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT slide_json, slide_version FROM slide_requests WHERE id = %s",
+                (request_id,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return None, 0
+            if not row[0]:
+                return None, row[1]
+
+            doc, split = _parse_header(row[0])
+            if split:
+                doc = _assemble(doc, _fetch_slide_rows(cursor, request_id))
+    return doc, row[1]
+
+
+# --- writes ---
+
+def save_deck(db_config, request_id, slide_doc: Dict[str, Any]) -> None:
+    """
+    Replace a full deck. In ``slides`` mode only the changed slide rows are written.
+
+    The write is unconditional: it is meant for a new deck (generation), not
+    for writing back a deck read earlier. Use :func:`save_slide` or
+    :func:`update_content_blocks` for edits so concurrent changes are kept.
+    The stored deck gets a new ``deck_revision``.
+    """
+    slide_doc = {**slide_doc, DECK_REVISION_KEY: uuid.uuid4().hex}
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            if SLIDE_STORAGE_MODE != "slides":
+                cursor.execute(
+                    """
+                    UPDATE slide_requests
+                       SET slide_json = %s
+                         , slide_version = slide_version + 1
+                         , updated_at = NOW()
+                     WHERE id = %s
+                    """,
+                    (deck_codec.encode(json.dumps(slide_doc)), request_id)
+                )
+            else:
+                conn.begin()
+                _write_split(cursor, request_id, slide_doc)
+            conn.commit()
+    invalidate_deck(request_id)
+
+
+def save_slide(db_config, request_id, slide_id, slide: Dict[str, Any],
+               base: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Replace one slide of a deck.
+
+    In ``slides`` mode this is a single-row update; a deck still in the
+    document layout is split on the way. In ``document`` mode the deck is
+    read, patched and rewritten as before.
+
+    If ``base`` (the slide as originally read) is given, only the fields the
+    caller changed are applied on top of the stored slide, so concurrent
+    edits to other blocks of the same slide are kept.
+    """
+    same_key = slide.get("slide_id", slide_id) == slide_id
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            conn.begin()
+            if SLIDE_STORAGE_MODE == "slides" and same_key:
+                cursor.execute(
+                    "SELECT slide_json FROM slide_request_slides WHERE request_id = %s AND slide_id = %s FOR UPDATE",
+                    (request_id, slide_id)
+                )
+                row = cursor.fetchone()
+                if row:
+                    if base is not None:
+                        slide = merge_decks(base, slide, json.loads(row[0]))
+                    cursor.execute(
+                        """
+                        UPDATE slide_request_slides
+                           SET slide_json = %s
+                             , version = version + 1
+                         WHERE request_id = %s AND slide_id = %s
+                        """,
+                        (json.dumps(slide), request_id, slide_id)
+                    )
+                    cursor.execute(
+                        "UPDATE slide_requests SET slide_version = slide_version + 1, updated_at = NOW() WHERE id = %s",
+                        (request_id,)
+                    )
+                    conn.commit()
+                    invalidate_deck(request_id)
+                    return
+
+            cursor.execute("SELECT slide_json FROM slide_requests WHERE id = %s FOR UPDATE", (request_id,))
+            row = cursor.fetchone()
+            if not row or not row[0]:
+                raise DeckNotFoundError(f"No slides for request_id {request_id}")
+
+            doc, split = _parse_header(row[0])
+            if split:
+                doc = _assemble(doc, _fetch_slide_rows(cursor, request_id))
+
+            slides = doc.get("slides", [])
+            index = next((i for i, s in enumerate(slides) if s.get("slide_id") == slide_id), None)
+            if index is None:
+                raise ValueError(f"Slide '{slide_id}' not found")
+            slides[index] = merge_decks(base, slide, slides[index]) if base is not None else slide
+
+            if SLIDE_STORAGE_MODE == "slides" or split:
+                _write_split(cursor, request_id, doc)
+            else:
+                cursor.execute(
+                    """
+                    UPDATE slide_requests
+                       SET slide_json = %s
+                         , slide_version = slide_version + 1
+                         , updated_at = NOW()
+                     WHERE id = %s
+                    """,
+                    (deck_codec.encode(json.dumps(doc)), request_id)
+                )
+        conn.commit()
+    invalidate_deck(request_id)
+
+
+def _patch_content(slide: Optional[Dict[str, Any]], slide_id, content_id, changes: Dict[str, Any]) -> Dict[str, Any]:
+    if slide is None:
+        raise ValueError(f"Slide '{slide_id}' not found")
+    content = _find_content(slide, content_id)
+    if content is None:
+        raise ValueError(f"Content '{content_id}' not found in slide '{slide_id}'")
+    content.update(changes)
+    return content
+
+
+def _update_content_in_place(cursor, request_id, updates) -> Optional[List[Dict[str, Any]]]:
+    """
+    Locate every block under a row lock and patch them all with one JSON_SET.
+    Returns the updated blocks, or None if the deck is split (the caller then
+    patches the slide rows).
+    """
+    paths = []
+    for (slide_id, content_id), changes in updates.items():
+        slide_literal = _search_literal(slide_id)
+        cursor.execute(LOCATE_CONTENT_SQL, (slide_literal, _search_literal(content_id), slide_literal, request_id))
+        row = cursor.fetchone()
+        if not row or not row[0]:
+            raise DeckNotFoundError(f"No slides for request_id {request_id}")
+        if _json_true(row[1]):
+            return None
+        if not row[2]:
+            raise ValueError(f"Slide '{slide_id}' not found")
+        if not row[3]:
+            raise ValueError(f"Content '{content_id}' not found in slide '{slide_id}'")
+        paths.append(row[3])
+
+    assignments, args = [], []
+    for content_path, changes in zip(paths, updates.values()):
+        for field, value in changes.items():
+            assignments.append("%s, CAST(%s AS JSON)")
+            args.extend([f"{content_path}.{json.dumps(field)}", json.dumps(value)])
+    cursor.execute(
+        f"""
+        UPDATE slide_requests
+           SET slide_json = JSON_SET(slide_json, {", ".join(assignments)})
+             , slide_version = slide_version + 1
+             , updated_at = NOW()
+         WHERE id = %s
+        """,
+        (*args, request_id)
+    )
+    cursor.execute(
+        f"SELECT {', '.join(['JSON_EXTRACT(slide_json, %s)'] * len(paths))} FROM slide_requests WHERE id = %s",
+        (*paths, request_id)
+    )
+    return [json.loads(value) for value in cursor.fetchone()]
+
+
+def _update_content_rows(cursor, request_id, updates) -> List[Dict[str, Any]]:
+    """Patch the blocks inside a split deck's slide rows, one row write per slide."""
+    slides = {}
+    for slide_id, _ in updates:
+        if slide_id in slides:
+            continue
+        cursor.execute(
+            "SELECT slide_json FROM slide_request_slides WHERE request_id = %s AND slide_id = %s FOR UPDATE",
+            (request_id, slide_id)
+        )
+        row = cursor.fetchone()
+        slides[slide_id] = json.loads(row[0]) if row else None
+
+    contents = [
+        _patch_content(slides[slide_id], slide_id, content_id, changes)
+        for (slide_id, content_id), changes in updates.items()
+    ]
+    cursor.executemany(
+        """
+        UPDATE slide_request_slides
+           SET slide_json = %s
+             , version = version + 1
+         WHERE request_id = %s AND slide_id = %s
+        """,
+        [(json.dumps(slide), request_id, slide_id) for slide_id, slide in slides.items()]
+    )
+    cursor.execute(
+        "UPDATE slide_requests SET slide_version = slide_version + 1, updated_at = NOW() WHERE id = %s",
+        (request_id,)
+    )
+    return contents
+
+
+def update_content_blocks(db_config, request_id, updates: Dict[Tuple[str, str], Dict[str, Any]],
+                          revision: Any = ANY_REVISION) -> List[Dict[str, Any]]:
+    """
+    Apply ``{(slide_id, content_id): changes}`` to a deck in one transaction
+    without rewriting it: a single JSON_SET on the document, or one row update
+    per touched slide for split decks. Other fields and blocks are untouched,
+    so concurrent edits elsewhere in the deck are kept.
+
+    With ``revision`` (see :func:`deck_revision`) nothing is written if the
+    deck has been replaced since that revision was read.
+
+    Returns the updated blocks in ``updates`` order. Raises DeckNotFoundError
+    if the deck does not exist, DeckReplacedError if it was replaced and
+    ValueError if a slide or block does not exist.
+    """
+    if not updates:
+        return []
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            conn.begin()
+            contents = None
+            if DECK_JSON_PROJECTION:
+                try:
+                    if revision is not ANY_REVISION:
+                        cursor.execute(
+                            "SELECT slide_json IS NOT NULL, JSON_UNQUOTE(JSON_EXTRACT(slide_json, %s)) "
+                            "FROM slide_requests WHERE id = %s FOR UPDATE",
+                            (f"$.{DECK_REVISION_KEY}", request_id)
+                        )
+                        row = cursor.fetchone()
+                        if not row or not row[0]:
+                            raise DeckNotFoundError(f"No slides for request_id {request_id}")
+                        _check_revision(request_id, row[1], revision)
+                    contents = _update_content_in_place(cursor, request_id, updates)
+                    if contents is None:
+                        contents = _update_content_rows(cursor, request_id, updates)
+                except pymysql.err.MySQLError as e:
+                    logger.warning(f"JSON_SET update failed for {request_id}, rewriting in Python: {e}")
+
+            if contents is None:
+                cursor.execute("SELECT slide_json FROM slide_requests WHERE id = %s FOR UPDATE", (request_id,))
+                row = cursor.fetchone()
+                if not row or not row[0]:
+                    raise DeckNotFoundError(f"No slides for request_id {request_id}")
+                doc, split = _parse_header(row[0])
+                _check_revision(request_id, deck_revision(doc), revision)
+                if split:
+                    doc = _assemble(doc, _fetch_slide_rows(cursor, request_id))
+                slides = {s.get("slide_id"): s for s in doc.get("slides", [])}
+                contents = [
+                    _patch_content(slides.get(slide_id), slide_id, content_id, changes)
+                    for (slide_id, content_id), changes in updates.items()
+                ]
+                if split:
+                    _write_split(cursor, request_id, doc)
+                else:
+                    cursor.execute(
+                        """
+                        UPDATE slide_requests
+                           SET slide_json = %s
+                             , slide_version = slide_version + 1
+                             , updated_at = NOW()
+                         WHERE id = %s
+                        """,
+                        (deck_codec.encode(json.dumps(doc)), request_id)
+                    )
+        conn.commit()
+    invalidate_deck(request_id)
+    return contents
+
+
+def update_content_block(db_config, request_id, slide_id, content_id, changes: Dict[str, Any]) -> Dict[str, Any]:
+    """Single-block :func:`update_content_blocks`; returns the updated block."""
+    return update_content_blocks(db_config, request_id, {(slide_id, content_id): changes})[0]
+
+
+def update_deck_fields(db_config, request_id, changes: Dict[str, Any]) -> None:
+    """
+    Set top-level deck fields (e.g. ``is_image_created``) in place. These live
+    in slide_requests.slide_json in both layouts, so slide rows are untouched.
+    """
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            conn.begin()
+            if DECK_JSON_PROJECTION:
+                assignments, args = [], []
+                for field, value in changes.items():
+                    assignments.append("%s, CAST(%s AS JSON)")
+                    args.extend([f"$.{json.dumps(field)}", json.dumps(value)])
+                try:
+                    updated = cursor.execute(
+                        f"""
+                        UPDATE slide_requests
+                           SET slide_json = JSON_SET(slide_json, {", ".join(assignments)})
+                             , slide_version = slide_version + 1
+                             , updated_at = NOW()
+                         WHERE id = %s AND slide_json IS NOT NULL
+                        """,
+                        (*args, request_id)
+                    )
+                except pymysql.err.MySQLError as e:
+                    logger.warning(f"JSON_SET update failed for {request_id}, rewriting in Python: {e}")
+                else:
+                    if not updated:
+                        raise DeckNotFoundError(f"No slides for request_id {request_id}")
+                    conn.commit()
+                    invalidate_deck(request_id)
+                    return
+
+            cursor.execute("SELECT slide_json FROM slide_requests WHERE id = %s FOR UPDATE", (request_id,))
+            row = cursor.fetchone()
+            if not row or not row[0]:
+                raise DeckNotFoundError(f"No slides for request_id {request_id}")
+            header, split = _parse_header(row[0])
+            header.update(changes)
+            cursor.execute(
+                """
+                UPDATE slide_requests
+                   SET slide_json = %s
+                     , slide_version = slide_version + 1
+                     , updated_at = NOW()
+                 WHERE id = %s
+                """,
+                (json.dumps(header) if split else deck_codec.encode(json.dumps(header)), request_id)
+            )
+        conn.commit()
+    invalidate_deck(request_id)
+
+
+# --- migration ---
+
+def create_slides_table(db_config) -> None:
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_SLIDES_TABLE_SQL)
+        conn.commit()
+
+
+def add_version_column(db_config) -> bool:
+    """Add slide_requests.slide_version if it is missing. Returns True if it was added."""
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COUNT(*) FROM information_schema.COLUMNS
+                 WHERE TABLE_SCHEMA = DATABASE()
+                   AND TABLE_NAME = 'slide_requests'
+                   AND COLUMN_NAME = 'slide_version'
+                """
+            )
+            if cursor.fetchone()[0]:
+                return False
+            cursor.execute(ADD_VERSION_COLUMN_SQL)
+        conn.commit()
+    return True
+
+
+def migrate_request(db_config, request_id) -> bool:
+    """Split one document-layout deck into slide rows. Returns False if nothing to do."""
+    with db_connection(db_config) as conn:
+        with conn.cursor() as cursor:
+            conn.begin()
+            cursor.execute("SELECT slide_json FROM slide_requests WHERE id = %s FOR UPDATE", (request_id,))
+            row = cursor.fetchone()
+            if not row or not row[0]:
+                return False
+            doc, split = _parse_header(row[0])
+            if split:
+                return False
+            _write_split(cursor, request_id, doc)
+        conn.commit()
+    return True
+
+
+def backfill(db_config, batch_size: int = 200) -> int:
+    """Migrate every document-layout deck to slide rows, one deck per transaction."""
+    migrated = 0
+    last_id = ""
+    while True:
+        with db_connection(db_config) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT id FROM slide_requests
+                     WHERE id > %s
+                       AND slide_json IS NOT NULL
+                       AND slide_json NOT LIKE %s
+                     ORDER BY id
+                     LIMIT %s
+                    """,
+                    (last_id, f'%"{SLIDE_ROWS_MARKER}"%', batch_size)
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            break
+
+        for request_id in ids:
+            try:
+                if migrate_request(db_config, request_id):
+                    migrated += 1
+            except (ValueError, TypeError) as e:
+                logger.error(f"Skipping {request_id}: slide_json is not a valid deck ({e})")
+        last_id = ids[-1]
+        logger.info(f"Backfill progress: {migrated} decks migrated (last id {last_id})")
+
+    return migrated
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Manage per-slide deck storage")
+    parser.add_argument("--create-table", action="store_true", help="Create slide_request_slides if missing")
+    parser.add_argument("--backfill", action="store_true", help="Split existing decks into slide rows")
+    parser.add_argument("--add-version-column", action="store_true", help="Add slide_requests.slide_version")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    db_config = {
+        "host": os.getenv("DB_HOST"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "database": os.getenv("DB_NAME"),
+        "port": int(os.getenv("DB_PORT", 3306))
+    }
+
+    if args.add_version_column:
+        added = add_version_column(db_config)
+        logger.info("slide_version column added" if added else "slide_version column already present")
+    if args.create_table:
+        create_slides_table(db_config)
+        logger.info("slide_request_slides is ready")
+    if args.backfill:
+        count = backfill(db_config, batch_size=args.batch_size)
+        logger.info(f"Backfill complete: {count} decks migrated")
+    if not (args.add_version_column or args.create_table or args.backfill):
+        parser.print_help()
@@ -0,0 +1,240 @@
+"""
+Write-Behind Deck Persister
+
+Buffers per-deck content block updates (e.g. the src of each generated image)
+and writes them with a single deck_store.update_content_blocks call per deck
+once DECK_FLUSH_EVERY updates are pending or the oldest pending update is
+DECK_FLUSH_INTERVAL_MS old, whichever comes first. Clients polling the deck
+see progress in near real time while the write rate per deck stays bounded.
+
+Repeated updates to the same block are coalesced. Callers flush explicitly
+when a job completes, or discard a deck's pending updates when its job is
+cancelled; anything still pending is flushed on shutdown.
+
+Updates carry the deck revision they were computed from (see
+deck_store.update_content_blocks), so a batch that is written after the deck
+was replaced, e.g. by another process regenerating it, is dropped.
+
+Configuration (environment variables):
+    DECK_FLUSH_EVERY        Pending updates per deck that trigger a flush (default 5)
+    DECK_FLUSH_INTERVAL_MS  Maximum age of a pending update (default 2000)
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from deck_store import update_content_blocks, DeckNotFoundError, DeckReplacedError, ANY_REVISION
+
+logger = logging.getLogger(__name__)
+
+DECK_FLUSH_EVERY = int(os.getenv("DECK_FLUSH_EVERY", 5))
+DECK_FLUSH_INTERVAL_MS = int(os.getenv("DECK_FLUSH_INTERVAL_MS", 2000))
+
+
+class DeckWriteBehind:
+    """
+    Coalescing write-behind buffer of content block updates, keyed by request_id.
+
+    Flushes of one deck are serialized, so batches reach the database in the
+    order they were buffered. A batch that fails to write is put back under
+    any newer changes and retried on the next flush, unless the deck, slide or
+    block no longer exists.
+    """
+
+    def __init__(self, db_config, flush_every: int = DECK_FLUSH_EVERY,
+                 flush_interval_ms: int = DECK_FLUSH_INTERVAL_MS, writer=update_content_blocks):
+        self.db_config = db_config
+        self.flush_every = max(flush_every, 1)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._writer = writer
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Dict[Tuple[str, str], Dict[str, Any]]] = {}
+        self._counts: Dict[str, int] = {}
+        self._oldest: Dict[str, float] = {}
+        self._revisions: Dict[str, Any] = {}
+        self._deck_locks: Dict[str, list] = {}  # request_id -> [lock, holders]
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        self.updates = 0
+        self.flushes = 0
+        self.blocks_written = 0
+        self.discarded = 0
+        self.errors = 0
+
+    def update(self, request_id: str, slide_id: str, content_id: str, changes: Dict[str, Any],
+               revision: Any = ANY_REVISION) -> None:
+        """
+        Buffer ``changes`` for one content block of deck ``revision``; may
+        flush this deck synchronously.
+        """
+        with self._cond:
+            other_revision = request_id in self._pending and self._revisions.get(request_id, ANY_REVISION) != revision
+        if other_revision:
+            # Pending updates for another revision of the deck: write (or drop) them first
+            self._flush_deck(request_id, raise_errors=False)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DeckWriteBehind is closed")
+            self._revisions[request_id] = revision
+            pending = self._pending.setdefault(request_id, {})
+            pending.setdefault((slide_id, content_id), {}).update(changes)
+            self._counts[request_id] = self._counts.get(request_id, 0) + 1
+            self._oldest.setdefault(request_id, time.monotonic())
+            self.updates += 1
+            due = self._counts[request_id] >= self.flush_every
+            self._ensure_thread()
+            self._cond.notify()
+        if due:
+            self._flush_deck(request_id, raise_errors=False)
+
+    def flush(self, request_id: Optional[str] = None) -> None:
+        """
+        Write pending updates now, for one deck or all of them. Errors are
+        raised for a single deck (after re-queueing the batch) and logged when
+        flushing everything.
+        """
+        if request_id is not None:
+            self._flush_deck(request_id, raise_errors=True)
+            return
+        with self._cond:
+            request_ids = list(self._pending)
+        for pending_id in request_ids:
+            self._flush_deck(pending_id, raise_errors=False)
+
+    def discard(self, request_id: str) -> int:
+        """Drop the pending updates of a deck (its job was cancelled); returns how many blocks."""
+        with self._deck_lock(request_id):
+            with self._cond:
+                batch = self._pending.pop(request_id, None) or {}
+                self._counts.pop(request_id, None)
+                self._oldest.pop(request_id, None)
+                self._revisions.pop(request_id, None)
+                self.discarded += len(batch)
+        if batch:
+            logger.info(f"Discarded {len(batch)} buffered updates for {request_id}")
+        return len(batch)
+
+    def close(self) -> None:
+        """Flush everything and stop the background thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+
+    @contextmanager
+    def _deck_lock(self, request_id: str):
+        with self._cond:
+            entry = self._deck_locks.setdefault(request_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._cond:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._deck_locks[request_id]
+
+    def _flush_deck(self, request_id: str, raise_errors: bool) -> None:
+        with self._deck_lock(request_id):
+            with self._cond:
+                batch = self._pending.pop(request_id, None)
+                self._counts.pop(request_id, None)
+                self._oldest.pop(request_id, None)
+                revision = self._revisions.pop(request_id, ANY_REVISION)
+            if not batch:
+                return
+            try:
+                if revision is ANY_REVISION:
+                    self._writer(self.db_config, request_id, batch)
+                else:
+                    self._writer(self.db_config, request_id, batch, revision=revision)
+            except DeckReplacedError as e:
+                with self._cond:
+                    self.discarded += len(batch)
+                logger.info(f"Dropping {len(batch)} buffered updates for {request_id}: {e}")
+                if raise_errors:
+                    raise
+                return
+            except (DeckNotFoundError, ValueError) as e:
+                with self._cond:
+                    self.errors += 1
+                logger.error(f"Dropping {len(batch)} buffered updates for {request_id}: {e}")
+                if raise_errors:
+                    raise
+                return
+            except Exception as e:
+                self._requeue(request_id, batch, revision)
+                logger.error(f"Flushing {len(batch)} buffered updates for {request_id} failed, will retry: {e}")
+                if raise_errors:
+                    raise
+                return
+            with self._cond:
+                self.flushes += 1
+                self.blocks_written += len(batch)
+
+    def _requeue(self, request_id: str, batch: Dict[Tuple[str, str], Dict[str, Any]], revision: Any) -> None:
+        with self._cond:
+            self.errors += 1
+            if request_id in self._pending and self._revisions.get(request_id, ANY_REVISION) != revision:
+                # Newer updates target another revision of the deck: this batch is stale
+                logger.error(f"Dropping {len(batch)} updates for a replaced revision of {request_id}")
+                return
+            self._revisions[request_id] = revision
+            newer = self._pending.get(request_id, {})
+            for key, changes in newer.items():
+                batch.setdefault(key, {}).update(changes)
+            self._pending[request_id] = batch
+            self._counts[request_id] = self._counts.get(request_id, 0)
+            self._oldest[request_id] = time.monotonic()
+            self._cond.notify()
+
+    def _ensure_thread(self) -> None:
+        # Caller holds self._cond.
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="deck-write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._oldest:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [rid for rid, oldest in self._oldest.items() if now - oldest >= self.flush_interval]
+                if not due:
+                    self._cond.wait(self.flush_interval - (now - min(self._oldest.values())))
+                    continue
+            for request_id in due:
+                self._flush_deck(request_id, raise_errors=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pending_decks": len(self._pending),
+                "pending_blocks": sum(len(p) for p in self._pending.values()),
+                "updates": self.updates,
+                "flushes": self.flushes,
+                "blocks_written": self.blocks_written,
+                "discarded": self.discarded,
+                "errors": self.errors,
+                "flush_every": self.flush_every,
+                "flush_interval_ms": int(self.flush_interval * 1000),
+            }
+
+
+def create_write_behind(db_config, **kwargs) -> DeckWriteBehind:
+    """Build a persister that is flushed when the process exits."""
+    writer = DeckWriteBehind(db_config, **kwargs)
+    atexit.register(writer.close)
+    return writer
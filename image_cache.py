@@ -0,0 +1,157 @@
+"""
+Prompt-Addressed Image Cache
+
+Maps a normalized image prompt (plus the model that renders it) to an image
+already uploaded to S3, so regenerated decks, cloned decks and retried jobs
+reuse the image instead of paying for another Gemini call and upload.
+
+Prompts are normalized (Unicode NFC, case-folded, whitespace collapsed) and
+hashed with SHA-256 together with the model name. Uploaded images get
+content-addressed keys (images/<sha256 of the bytes>.png), so identical
+images are stored once.
+
+Lookups and stores never raise: if the cache table is unavailable, images
+are simply generated as before.
+
+Explicit requests for a new image of one block bypass the lookup; the fresh
+image then replaces the cached one for its prompt.
+
+Configuration (environment variables):
+    IMAGE_CACHE_ENABLED  Set to 0 to always generate (default 1)
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, Optional
+
+from db_pool import connection as db_connection
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "1") not in ("0", "false", "False")
+
+CREATE_IMAGE_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS image_cache (
+    prompt_hash CHAR(64) PRIMARY KEY,
+    model VARCHAR(128) NOT NULL,
+    s3_key VARCHAR(255) NOT NULL,
+    url VARCHAR(1024) NOT NULL,
+    width INT NULL,
+    height INT NULL,
+    size_bytes INT NULL,
+    hits INT NOT NULL DEFAULT 0,
+    created_at DOUBLE NOT NULL,
+    last_hit_at DOUBLE NULL
+)
+"""
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", prompt).casefold().split())
+
+
+def prompt_hash(prompt: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+def content_key(data: bytes, extension: str = "png", prefix: str = "images") -> str:
+    """S3 key derived from the image bytes."""
+    return f"{prefix}/{hashlib.sha256(data).hexdigest()}.{extension}"
+
+
+class ImageCache:
+    """prompt_hash -> uploaded image lookups in the ``image_cache`` table, with hit/miss counters."""
+
+    def __init__(self, db_config: Dict[str, Any], enabled: bool = IMAGE_CACHE_ENABLED):
+        self.db_config = db_config
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._counts = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "errors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def create_table(self) -> None:
+        with db_connection(self.db_config) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(CREATE_IMAGE_CACHE_TABLE_SQL)
+            conn.commit()
+        self._table_ready = True
+
+    def lookup(self, prompt: str, model: str, bypass: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Cached image for ``prompt`` as ``{s3_key, url, width, height}``, or None.
+        ``bypass`` always returns None (counted as bypassed) so a fresh image is made.
+        """
+        if not self.enabled:
+            return None
+        if bypass:
+            self._count("bypassed")
+            return None
+        key = prompt_hash(prompt, model)
+        try:
+            if not self._table_ready:
+                self.create_table()
+            with db_connection(self.db_config) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT s3_key, url, width, height FROM image_cache WHERE prompt_hash = %s",
+                        (key,)
+                    )
+                    row = cursor.fetchone()
+                    if row:
+                        cursor.execute(
+                            "UPDATE image_cache SET hits = hits + 1, last_hit_at = %s WHERE prompt_hash = %s",
+                            (time.time(), key)
+                        )
+                conn.commit()
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Image cache lookup failed: {e}")
+            return None
+
+        if not row:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return {"s3_key": row[0], "url": row[1], "width": row[2], "height": row[3]}
+
+    def store(self, prompt: str, model: str, s3_key: str, url: str,
+              width: Optional[int] = None, height: Optional[int] = None, size_bytes: Optional[int] = None) -> None:
+        if not self.enabled:
+            return
+        try:
+            if not self._table_ready:
+                self.create_table()
+            with db_connection(self.db_config) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        INSERT INTO image_cache (prompt_hash, model, s3_key, url, width, height, size_bytes, created_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        ON DUPLICATE KEY UPDATE s3_key = VALUES(s3_key), url = VALUES(url),
+                                                width = VALUES(width), height = VALUES(height),
+                                                size_bytes = VALUES(size_bytes)
+                        """,
+                        (prompt_hash(prompt, model), model, s3_key, url, width, height, size_bytes, time.time())
+                    )
+                conn.commit()
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Image cache store failed: {e}")
+            return
+        self._count("stores")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = round(counts["hits"] / lookups, 4) if lookups else 0.0
+        counts["enabled"] = self.enabled
+        return counts
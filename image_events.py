@@ -0,0 +1,146 @@
+"""
+Image Progress Events
+
+Publish/subscribe for per-image progress of deck image generation, feeding
+the Server-Sent Events stream at GET /api/v1/slides/images/stream.
+
+Events are delivered to subscribers in the same process directly and, when
+a Redis URL is configured, broadcast on one pub/sub channel so a stream
+served by any web worker sees images generated by any job worker.
+
+Usage:
+    from image_events import create_event_bus
+
+    bus = create_event_bus()
+    bus.publish(request_id, {"type": "image", "slide_id": ..., "content_id": ..., "src": ...})
+
+    with bus.listen(request_id) as events:
+        event = events.get(timeout=15)
+
+Configuration (environment variables):
+    IMAGE_EVENTS_URL  redis://host:6379/0 or memory:// (defaults to DECK_SHARED_CACHE_URL;
+                      unset delivers events within the process only)
+"""
+
+import os
+import json
+import uuid
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from shared_cache import DECK_SHARED_CACHE_URL, MemoryBackend, RedisBackend
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EVENTS_URL = os.getenv("IMAGE_EVENTS_URL", DECK_SHARED_CACHE_URL)
+
+EVENTS_CHANNEL = "slidecraft:image-events"
+# Events buffered per subscriber; past this the oldest are dropped (slow
+# client), so the latest events, e.g. the final summary, always get through
+SUBSCRIBER_BUFFER = 1000
+
+
+class ImageEventBus:
+    """Fan-out of ``{request_id: event}`` messages to local subscriber queues, optionally across processes."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[queue.Queue]] = {}
+        self._subscribed = False
+        self._counts = {"published": 0, "received": 0, "delivered": 0, "dropped": 0, "errors": 0}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += n
+
+    def _deliver(self, request_id: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            targets = list(self._subscribers.get(request_id, ()))
+        for events in targets:
+            while True:
+                try:
+                    events.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        events.get_nowait()
+                        self._count("dropped")
+                    except queue.Empty:
+                        pass
+            self._count("delivered")
+
+    def publish(self, request_id: str, event: Dict[str, Any]) -> None:
+        """Send ``event`` to every listener of ``request_id``. Never raises."""
+        self._count("published")
+        self._deliver(request_id, event)
+        if self.backend is None:
+            return
+        try:
+            self.backend.publish(EVENTS_CHANNEL, json.dumps({
+                "request_id": request_id, "origin": self.origin, "event": event,
+            }).encode("utf-8"))
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Image event broadcast failed for {request_id}: {e}")
+
+    def _on_message(self, raw) -> None:
+        try:
+            message = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if message.get("origin") == self.origin:
+            return
+        self._count("received")
+        self._deliver(message.get("request_id"), message.get("event"))
+
+    def _ensure_subscribed(self) -> None:
+        if self.backend is None or self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        try:
+            self.backend.subscribe(EVENTS_CHANNEL, self._on_message)
+        except Exception as e:
+            self._subscribed = False
+            self._count("errors")
+            logger.warning(f"Image event subscribe failed: {e}")
+
+    @contextmanager
+    def listen(self, request_id: str) -> Iterator[queue.Queue]:
+        """Queue receiving events for ``request_id`` until the block exits."""
+        self._ensure_subscribed()
+        events: queue.Queue = queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._subscribers.setdefault(request_id, []).append(events)
+        try:
+            yield events
+        finally:
+            with self._lock:
+                listeners = self._subscribers.get(request_id, [])
+                if events in listeners:
+                    listeners.remove(events)
+                if not listeners:
+                    self._subscribers.pop(request_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            counts["listeners"] = sum(len(listeners) for listeners in self._subscribers.values())
+        counts["backend"] = type(self.backend).__name__ if self.backend is not None else None
+        return counts
+
+
+def create_event_bus(url: Optional[str] = IMAGE_EVENTS_URL) -> ImageEventBus:
+    """Bus broadcasting over ``url`` (redis:// or memory://), or process-local when unset."""
+    if not url:
+        return ImageEventBus()
+    if url.startswith("memory://"):
+        return ImageEventBus(MemoryBackend())
+    return ImageEventBus(RedisBackend(url))
@@ -0,0 +1,102 @@
+"""
+Priority Image Scheduling
+
+Orders the image blocks of one deck run so the slides a user sees first get
+their images first: slides the client reports as visible (in the order
+given), then the rest in document order. Priorities can change while the run
+is in progress, and a cancelled run starts no further images.
+
+Worker threads pull the next block from the run instead of receiving a fixed
+list up front, so a re-prioritization or cancellation applies to every block
+not yet started.
+
+Usage:
+    run = ImageRun(request_id, [(slide_index, slide_id, content_id, content), ...],
+                   visible_slides=["slide_3"], cancelled=threading.Event())
+    for item, result, error in run.results(generate, workers=4):
+        ...
+    run.prioritize(["slide_7", "slide_8"])   # from another thread
+    run.cancel()
+"""
+
+import heapq
+import queue
+import itertools
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# (slide_index, slide_id, content_id, content)
+Item = Tuple[int, str, str, Any]
+
+
+class ImageRun:
+    """Thread-safe priority queue of a deck's pending image blocks."""
+
+    def __init__(self, request_id: str, items: Iterable[Item], visible_slides: Optional[Sequence[str]] = None,
+                 cancelled: Optional[threading.Event] = None):
+        self.request_id = request_id
+        self.cancelled = cancelled or threading.Event()
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._visible = {slide_id: rank for rank, slide_id in enumerate(visible_slides or ())}
+        self._heap: List[Tuple[Tuple[int, int, int], int, Item]] = [
+            (self._key(item), next(self._seq), item) for item in items
+        ]
+        heapq.heapify(self._heap)
+
+    def _key(self, item: Item) -> Tuple[int, int, int]:
+        slide_index, slide_id = item[0], item[1]
+        rank = self._visible.get(slide_id)
+        return (0, rank, slide_index) if rank is not None else (1, slide_index, 0)
+
+    def prioritize(self, visible_slides: Sequence[str]) -> None:
+        """Generate images for ``visible_slides`` (in that order) before all others not started yet."""
+        with self._lock:
+            self._visible = {slide_id: rank for rank, slide_id in enumerate(visible_slides)}
+            self._heap = [(self._key(entry[2]), entry[1], entry[2]) for entry in self._heap]
+            heapq.heapify(self._heap)
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def next(self) -> Optional[Item]:
+        """Highest-priority block not started yet, or None when done or cancelled."""
+        with self._lock:
+            if self.cancelled.is_set() or not self._heap:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def remaining(self) -> int:
+        with self._lock:
+            return len(self._heap)
+
+    def results(self, fn: Callable[[Item], Any], workers: int) -> Iterator[Tuple[Item, Any, Optional[BaseException]]]:
+        """
+        Run ``fn(item)`` on ``workers`` threads in priority order and yield
+        ``(item, result, error)`` as each block finishes.
+        """
+        done: queue.Queue = queue.Queue()
+
+        def work():
+            try:
+                while True:
+                    item = self.next()
+                    if item is None:
+                        return
+                    try:
+                        done.put((item, fn(item), None))
+                    except Exception as e:
+                        done.put((item, None, e))
+            finally:
+                done.put(None)
+
+        threads = [threading.Thread(target=work, name=f"image-gen-{i}", daemon=True) for i in range(max(1, workers))]
+        for thread in threads:
+            thread.start()
+        running = len(threads)
+        while running:
+            entry = done.get()
+            if entry is None:
+                running -= 1
+                continue
+            yield entry
@@ -0,0 +1,96 @@
+"""
+Image Upload Preparation
+
+Gemini returns generated images as already-encoded bytes (inline_data.data,
+normally PNG). Those bytes are uploaded to S3 as they are, with the content
+type Gemini reported (or sniffed from the magic bytes); the image is only
+decoded and re-encoded when IMAGE_UPLOAD_FORMAT asks for a different format.
+
+Usage:
+    from image_upload import prepare_upload
+
+    body, content_type, extension = prepare_upload(part.inline_data.data, part.inline_data.mime_type)
+
+Configuration (environment variables):
+    IMAGE_UPLOAD_FORMAT  Convert uploads to png, jpeg or webp (default: upload as received)
+    IMAGE_UPLOAD_QUALITY Quality for jpeg/webp conversion (default 85)
+"""
+
+import os
+from io import BytesIO
+from typing import Optional, Tuple
+
+IMAGE_UPLOAD_FORMAT = os.getenv("IMAGE_UPLOAD_FORMAT", "").lower()
+IMAGE_UPLOAD_QUALITY = int(os.getenv("IMAGE_UPLOAD_QUALITY", 85))
+
+FORMATS = {
+    # format: (content type, extension, PIL format)
+    "png": ("image/png", "png", "PNG"),
+    "jpeg": ("image/jpeg", "jpg", "JPEG"),
+    "jpg": ("image/jpeg", "jpg", "JPEG"),
+    "webp": ("image/webp", "webp", "WEBP"),
+    "gif": ("image/gif", "gif", "GIF"),
+}
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Image format from the magic bytes, or None if unrecognised."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def _format_from_mime(mime_type: Optional[str]) -> Optional[str]:
+    if not mime_type:
+        return None
+    fmt = mime_type.split(";")[0].strip().lower().rpartition("/")[2]
+    return fmt if fmt in FORMATS else None
+
+
+def image_size(data: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """``(width, height)`` read from the image header; pixels are not decoded."""
+    from PIL import Image
+
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+
+def reencode(data: bytes, fmt: str, quality: int = IMAGE_UPLOAD_QUALITY) -> bytes:
+    """Decode ``data`` and encode it again as ``fmt``."""
+    from PIL import Image
+
+    pil_format = FORMATS[fmt][2]
+    img = Image.open(BytesIO(data))
+    if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = BytesIO()
+    if pil_format in ("JPEG", "WEBP"):
+        img.save(buf, format=pil_format, quality=quality)
+    else:
+        img.save(buf, format=pil_format)
+    return buf.getvalue()
+
+
+def prepare_upload(data: bytes, mime_type: Optional[str] = None,
+                   convert_to: str = IMAGE_UPLOAD_FORMAT) -> Tuple[bytes, str, str]:
+    """
+    ``(body, content_type, extension)`` for uploading an encoded image.
+    ``data`` is returned unchanged unless ``convert_to`` names another format.
+    """
+    source = sniff_format(data) or _format_from_mime(mime_type) or "png"
+    target = convert_to or source
+    if target not in FORMATS:
+        raise ValueError(f"Unsupported IMAGE_UPLOAD_FORMAT: {target}")
+    content_type, extension, _ = FORMATS[target]
+    if FORMATS[target][2] != FORMATS[source][2]:
+        data = reencode(data, target)
+    return data, content_type, extension
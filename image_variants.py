@@ -0,0 +1,171 @@
+"""
+Responsive Image Variants
+
+Gemini images are ~1024px or larger while most image elements occupy a few
+hundred pixels of the 960x540 canvas. After the source image is uploaded,
+this stage renders, for the element's width x height:
+
+    master   source format, just large enough to cover the box at IMAGE_VARIANT_DPR
+    webp_1x  WebP covering the box at 1x
+    webp_2x  WebP covering the box at IMAGE_VARIANT_DPR
+    thumb    small WebP (IMAGE_THUMBNAIL_WIDTH wide) for slide lists and previews
+
+Images are never upscaled. Resizing is CPU-bound, so it runs in a process
+pool shared by all image threads; uploads stay in the calling thread. The
+pool's processes are started by a fork server (spawn where unavailable),
+never forked from the multi-threaded web app: a fork could copy locks held
+by other threads (logging, DB pool) into a child that then deadlocks on them.
+Like any spawned process they re-import the main script, so modules it
+imports must not start background work in a child process (see slide2's
+embedded job workers).
+
+Variant keys are derived from the source key and the element size, so a
+cached source image that was already processed for the same size is not
+rendered again.
+
+Configuration (environment variables):
+    IMAGE_VARIANTS_ENABLED    Set to 0 to store only the source image (default 1)
+    IMAGE_VARIANT_DPR         Device pixel ratio for master / webp_2x (default 2)
+    IMAGE_VARIANT_PROCESSES   Worker processes for resizing, 0 renders in-thread (default 2)
+    IMAGE_THUMBNAIL_WIDTH     Thumbnail width in pixels (default 320)
+    IMAGE_WEBP_QUALITY        WebP quality (default 80)
+"""
+
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from image_upload import FORMATS, sniff_format
+
+IMAGE_VARIANTS_ENABLED = os.getenv("IMAGE_VARIANTS_ENABLED", "1") not in ("0", "false", "False")
+IMAGE_VARIANT_DPR = int(os.getenv("IMAGE_VARIANT_DPR", 2))
+IMAGE_VARIANT_PROCESSES = int(os.getenv("IMAGE_VARIANT_PROCESSES", 2))
+IMAGE_THUMBNAIL_WIDTH = int(os.getenv("IMAGE_THUMBNAIL_WIDTH", 320))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", 80))
+
+VARIANTS = ("webp_1x", "webp_2x", "thumb", "master")
+
+
+def variant_keys(source_key: str, width: int, height: int, dpr: int = IMAGE_VARIANT_DPR,
+                 thumb_width: int = IMAGE_THUMBNAIL_WIDTH) -> Dict[str, str]:
+    """S3 keys of the variants of ``source_key`` for a ``width`` x ``height`` element."""
+    base, _, extension = source_key.rpartition(".")
+    return {
+        "webp_1x": f"{base}/{width}x{height}.webp",
+        "webp_2x": f"{base}/{width}x{height}@{dpr}x.webp",
+        "thumb": f"{base}/thumb-{thumb_width}.webp",
+        "master": f"{base}/{width}x{height}@{dpr}x.{extension or 'png'}",
+    }
+
+
+def _cover(img, width: int, height: int):
+    """``img`` scaled to cover ``width`` x ``height`` with its aspect ratio kept; never upscaled."""
+    from PIL import Image
+
+    scale = min(1.0, max(width / img.width, height / img.height))
+    if scale >= 1.0:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+def _encode(img, pil_format: str, quality: int) -> bytes:
+    buf = BytesIO()
+    if pil_format == "WEBP":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    elif pil_format == "JPEG":
+        img.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True)
+    else:
+        img.save(buf, format=pil_format, optimize=True)
+    return buf.getvalue()
+
+
+def render_variants(data: bytes, width: int, height: int, dpr: int = IMAGE_VARIANT_DPR,
+                    thumb_width: int = IMAGE_THUMBNAIL_WIDTH,
+                    quality: int = IMAGE_WEBP_QUALITY) -> Dict[str, Tuple[bytes, str]]:
+    """
+    ``{variant: (body, content_type)}`` for an element of ``width`` x ``height``.
+    Pure function of its arguments so it can run in a worker process.
+    """
+    from PIL import Image
+
+    source_format = sniff_format(data) or "png"
+    content_type, _, pil_format = FORMATS[source_format]
+
+    img = Image.open(BytesIO(data))
+    img.load()
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+    hi = _cover(img, width * dpr, height * dpr)
+    thumb = img.copy()
+    thumb.thumbnail((thumb_width, img.height), Image.LANCZOS)
+    return {
+        "webp_1x": (_encode(_cover(hi, width, height), "WEBP", quality), "image/webp"),
+        "webp_2x": (_encode(hi, "WEBP", quality), "image/webp"),
+        "thumb": (_encode(thumb, "WEBP", quality), "image/webp"),
+        "master": (_encode(hi, pil_format, quality), content_type),
+    }
+
+
+class VariantProcessor:
+    """Runs render_variants in a lazily started process pool and counts the work done."""
+
+    def __init__(self, processes: int = IMAGE_VARIANT_PROCESSES, enabled: bool = IMAGE_VARIANTS_ENABLED):
+        self.processes = processes
+        self.enabled = enabled
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counts = {"rendered": 0, "reused": 0, "failed": 0, "source_bytes": 0, "master_bytes": 0}
+        self._render_seconds = 0.0
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.processes <= 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context(method))
+                atexit.register(self.close)
+            return self._pool
+
+    def render(self, data: bytes, width: int, height: int) -> Dict[str, Tuple[bytes, str]]:
+        start = time.monotonic()
+        try:
+            pool = self._executor()
+            if pool is None:
+                variants = render_variants(data, width, height)
+            else:
+                variants = pool.submit(render_variants, data, width, height).result()
+        except Exception:
+            self.count("failed")
+            raise
+        with self._lock:
+            self._counts["rendered"] += 1
+            self._counts["source_bytes"] += len(data)
+            self._counts["master_bytes"] += len(variants["master"][0])
+            self._render_seconds += time.monotonic() - start
+        return variants
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counts)
+            stats["render_seconds"] = round(self._render_seconds, 3)
+        stats["enabled"] = self.enabled
+        stats["processes"] = self.processes
+        return stats
@@ -0,0 +1,441 @@
+"""
+Durable Job Queue
+
+Persistent queue for background work (image generation) that used to run in
+fire-and-forget threads. Jobs are rows in an ``image_jobs`` table, so they
+survive restarts and any number of worker processes on any number of nodes
+can share the work (see job_worker.py).
+
+    queued ──lease──▶ running ──complete──▶ succeeded
+       ▲                 │
+       └──fail (retry)───┤──fail (attempts exhausted)──▶ failed
+
+    queued / running ──cancel──▶ cancelled
+
+Leasing claims one due job with SELECT ... FOR UPDATE SKIP LOCKED (MySQL 8)
+or under BEGIN IMMEDIATE (SQLite), so two workers never claim the same row.
+A running job's lease expires after the visibility timeout unless the
+worker heartbeats; an expired job becomes leasable again, which is how work
+held by a crashed worker is picked up. Failed attempts are retried with
+exponential backoff until max_attempts.
+
+cancel() stops a request's queued or running jobs: a running job's worker
+loses its lease, sees that on its next heartbeat and stops.
+
+enqueue_once() gives single-flight semantics: while a job for the same
+(kind, request_id) is queued or running, its unique ``active_key`` makes a
+repeat trigger attach to that job instead of creating another one.
+
+Times are stored as epoch seconds, so worker nodes need reasonably synced
+clocks (NTP).
+
+Configuration (environment variables):
+    JOB_QUEUE_BACKEND             mysql (default, the app database) or sqlite
+    JOB_QUEUE_SQLITE_PATH         Database file for the sqlite backend (default jobs.db)
+    JOB_VISIBILITY_TIMEOUT        Seconds a lease lasts without a heartbeat (default 120)
+    JOB_MAX_ATTEMPTS              Attempts before a job is marked failed (default 3)
+    JOB_BACKOFF_BASE              First retry delay in seconds, doubled per attempt (default 10)
+    JOB_BACKOFF_MAX               Retry delay cap in seconds (default 600)
+
+Create the table up front with ``python job_queue.py --create-table``
+(it is also created on first use).
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pymysql
+
+from db_pool import connection as db_connection
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "mysql").lower()
+JOB_QUEUE_SQLITE_PATH = os.getenv("JOB_QUEUE_SQLITE_PATH", "jobs.db")
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 120))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", 10))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", 600))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+
+CREATE_JOBS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS image_jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    kind VARCHAR(64) NOT NULL,
+    request_id VARCHAR(64) NOT NULL,
+    payload TEXT NULL,
+    status VARCHAR(16) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL,
+    available_at DOUBLE NOT NULL,
+    lease_owner VARCHAR(128) NULL,
+    lease_expires_at DOUBLE NULL,
+    last_error TEXT NULL,
+    result MEDIUMTEXT NULL,
+    active_key VARCHAR(200) NULL,
+    created_at DOUBLE NOT NULL,
+    updated_at DOUBLE NOT NULL,
+    KEY idx_image_jobs_due (status, available_at),
+    KEY idx_image_jobs_lease (status, lease_expires_at),
+    KEY idx_image_jobs_request (request_id),
+    UNIQUE KEY uq_image_jobs_active (active_key)
+)
+"""
+
+CREATE_JOBS_TABLE_SQLITE = [
+    """
+    CREATE TABLE IF NOT EXISTS image_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        request_id TEXT NOT NULL,
+        payload TEXT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        available_at REAL NOT NULL,
+        lease_owner TEXT NULL,
+        lease_expires_at REAL NULL,
+        last_error TEXT NULL,
+        result TEXT NULL,
+        active_key TEXT NULL UNIQUE,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_image_jobs_due ON image_jobs (status, available_at)",
+    "CREATE INDEX IF NOT EXISTS idx_image_jobs_lease ON image_jobs (status, lease_expires_at)",
+    "CREATE INDEX IF NOT EXISTS idx_image_jobs_request ON image_jobs (request_id)",
+]
+
+JOB_COLUMNS = ("id, kind, request_id, payload, status, attempts, max_attempts, available_at, "
+               "lease_owner, lease_expires_at, last_error, result, created_at, updated_at")
+
+
+def _row_to_job(row) -> Dict[str, Any]:
+    job = dict(zip([c.strip() for c in JOB_COLUMNS.split(",")], row))
+    job["payload"] = json.loads(job["payload"]) if job["payload"] else {}
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class JobQueue:
+    """Lease-based job queue over MySQL (``db_config``) or SQLite (``sqlite_path``)."""
+
+    def __init__(self, db_config: Optional[Dict[str, Any]] = None, sqlite_path: Optional[str] = None,
+                 visibility_timeout: float = JOB_VISIBILITY_TIMEOUT, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 backoff_base: float = JOB_BACKOFF_BASE, backoff_max: float = JOB_BACKOFF_MAX):
+        if (db_config is None) == (sqlite_path is None):
+            raise ValueError("JobQueue needs exactly one of db_config or sqlite_path")
+        self.db_config = db_config
+        self.sqlite_path = sqlite_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._local = threading.local()
+        self._table_ready = False
+
+    @property
+    def backend(self) -> str:
+        return "sqlite" if self.sqlite_path else "mysql"
+
+    # --- connections ---
+
+    def _sqlite(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.sqlite_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Yield ``execute(sql, args) -> cursor`` inside one transaction."""
+        if not self._table_ready:
+            self.create_table()
+
+        if self.sqlite_path:
+            conn = self._sqlite()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield lambda sql, args=(): conn.execute(sql.replace("%s", "?"), args)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return
+
+        with db_connection(self.db_config) as conn:
+            conn.begin()
+            with conn.cursor() as cursor:
+                def execute(sql, args=()):
+                    cursor.execute(sql, args)
+                    return cursor
+                yield execute
+            conn.commit()
+
+    def create_table(self) -> None:
+        if self.sqlite_path:
+            conn = self._sqlite()
+            for statement in CREATE_JOBS_TABLE_SQLITE:
+                conn.execute(statement)
+        else:
+            with db_connection(self.db_config) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(CREATE_JOBS_TABLE_SQL)
+                conn.commit()
+        self._table_ready = True
+
+    # --- producer side ---
+
+    def enqueue(self, kind: str, request_id: str, payload: Optional[Dict[str, Any]] = None,
+                max_attempts: Optional[int] = None, delay: float = 0, active_key: Optional[str] = None) -> int:
+        """Add a job; returns its id."""
+        now = time.time()
+        with self._transaction() as execute:
+            cursor = execute(
+                """
+                INSERT INTO image_jobs (kind, request_id, payload, status, attempts, max_attempts,
+                                        available_at, active_key, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, 0, %s, %s, %s, %s, %s)
+                """,
+                (kind, request_id, json.dumps(payload or {}), QUEUED,
+                 max_attempts or self.max_attempts, now + delay, active_key, now, now)
+            )
+            return cursor.lastrowid
+
+    def enqueue_once(self, kind: str, request_id: str, payload: Optional[Dict[str, Any]] = None,
+                     max_attempts: Optional[int] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Single-flight enqueue: returns ``(job, created)``. If a ``kind`` job for
+        ``request_id`` is already queued or running, that job is returned with
+        ``created`` False and nothing new is queued.
+        """
+        active_key = f"{kind}:{request_id}"
+        for _ in range(3):
+            try:
+                job_id = self.enqueue(kind, request_id, payload, max_attempts, active_key=active_key)
+                return self.get(job_id), True
+            except (pymysql.err.IntegrityError, sqlite3.IntegrityError):
+                pass
+            with self._transaction() as execute:
+                row = execute(f"SELECT {JOB_COLUMNS} FROM image_jobs WHERE active_key = %s", (active_key,)).fetchone()
+            if row:
+                return _row_to_job(row), False
+            # The active job finished between our insert and lookup; try again.
+        raise RuntimeError(f"Could not enqueue {kind} for {request_id}")
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._transaction() as execute:
+            row = execute(f"SELECT {JOB_COLUMNS} FROM image_jobs WHERE id = %s", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def jobs_for_request(self, request_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._transaction() as execute:
+            rows = execute(
+                f"SELECT {JOB_COLUMNS} FROM image_jobs WHERE request_id = %s ORDER BY id DESC LIMIT %s",
+                (request_id, limit)
+            ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    # --- worker side ---
+
+    def lease(self, worker_id: str, kinds: Optional[Sequence[str]] = None,
+              visibility_timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Claim the next due job (a queued job whose time has come, or a running
+        job whose lease expired) for ``worker_id``. Returns None if there is none.
+        """
+        timeout = visibility_timeout or self.visibility_timeout
+        kind_filter, kind_args = "", ()
+        if kinds:
+            kind_filter = f" AND kind IN ({', '.join(['%s'] * len(kinds))})"
+            kind_args = tuple(kinds)
+        lock = "" if self.sqlite_path else " FOR UPDATE SKIP LOCKED"
+
+        while True:
+            now = time.time()
+            with self._transaction() as execute:
+                row = execute(
+                    f"""
+                    SELECT {JOB_COLUMNS} FROM image_jobs
+                     WHERE ((status = %s AND available_at <= %s) OR (status = %s AND lease_expires_at <= %s))
+                           {kind_filter}
+                     ORDER BY available_at, id
+                     LIMIT 1{lock}
+                    """,
+                    (QUEUED, now, RUNNING, now, *kind_args)
+                ).fetchone()
+                if not row:
+                    return None
+                job = _row_to_job(row)
+
+                if job["status"] == RUNNING and job["attempts"] >= job["max_attempts"]:
+                    # Its last worker died mid-attempt and no attempts are left.
+                    execute(
+                        """
+                        UPDATE image_jobs
+                           SET status = %s, lease_owner = NULL, lease_expires_at = NULL, active_key = NULL,
+                               last_error = %s, updated_at = %s
+                         WHERE id = %s
+                        """,
+                        (FAILED, f"Lease held by {job['lease_owner']} expired", now, job["id"])
+                    )
+                    logger.error(f"Job {job['id']} ({job['kind']} {job['request_id']}) failed: lease expired on last attempt")
+                    continue
+
+                # The updated_at guard makes the claim safe even where the row
+                # lock is unavailable: a concurrent claim changes it.
+                claimed = execute(
+                    """
+                    UPDATE image_jobs
+                       SET status = %s, attempts = attempts + 1, lease_owner = %s,
+                           lease_expires_at = %s, updated_at = %s
+                     WHERE id = %s AND updated_at = %s
+                    """,
+                    (RUNNING, worker_id, now + timeout, now, job["id"], job["updated_at"])
+                ).rowcount
+                if not claimed:
+                    continue
+                if job["status"] == RUNNING:
+                    logger.warning(f"Job {job['id']} lease held by {job['lease_owner']} expired; reclaimed by {worker_id}")
+            job.update(status=RUNNING, attempts=job["attempts"] + 1, lease_owner=worker_id,
+                       lease_expires_at=now + timeout)
+            return job
+
+    def heartbeat(self, job_id: int, worker_id: str, visibility_timeout: Optional[float] = None) -> bool:
+        """Extend the lease; False means the lease was lost and the job may run elsewhere."""
+        now = time.time()
+        with self._transaction() as execute:
+            cursor = execute(
+                """
+                UPDATE image_jobs SET lease_expires_at = %s, updated_at = %s
+                 WHERE id = %s AND lease_owner = %s AND status = %s
+                """,
+                (now + (visibility_timeout or self.visibility_timeout), now, job_id, worker_id, RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str, result: Any = None) -> bool:
+        now = time.time()
+        with self._transaction() as execute:
+            cursor = execute(
+                """
+                UPDATE image_jobs
+                   SET status = %s, result = %s, lease_owner = NULL, lease_expires_at = NULL, active_key = NULL,
+                       updated_at = %s
+                 WHERE id = %s AND lease_owner = %s AND status = %s
+                """,
+                (SUCCEEDED, json.dumps(result, default=str), now, job_id, worker_id, RUNNING)
+            )
+            updated = cursor.rowcount == 1
+        if not updated:
+            logger.warning(f"Job {job_id} finished by {worker_id} after its lease was lost")
+        return updated
+
+    def backoff(self, attempts: int) -> float:
+        """Delay before retry number ``attempts`` (exponential with jitter)."""
+        delay = min(self.backoff_base * (2 ** max(attempts - 1, 0)), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> Optional[str]:
+        """
+        Record a failed attempt. The job is re-queued with backoff while attempts
+        remain, otherwise marked failed. Returns the new status, or None if the
+        lease was already lost.
+        """
+        now = time.time()
+        with self._transaction() as execute:
+            row = execute(
+                "SELECT attempts, max_attempts FROM image_jobs WHERE id = %s AND lease_owner = %s AND status = %s"
+                + ("" if self.sqlite_path else " FOR UPDATE"),
+                (job_id, worker_id, RUNNING)
+            ).fetchone()
+            if not row:
+                logger.warning(f"Job {job_id} failed on {worker_id} after its lease was lost: {error}")
+                return None
+            attempts, max_attempts = row
+            if attempts < max_attempts:
+                status, available_at = QUEUED, now + self.backoff(attempts)
+            else:
+                status, available_at = FAILED, now
+            # A retry stays the active job for its request; a final failure frees the slot.
+            release = ", active_key = NULL" if status == FAILED else ""
+            execute(
+                f"""
+                UPDATE image_jobs
+                   SET status = %s, available_at = %s, lease_owner = NULL, lease_expires_at = NULL{release},
+                       last_error = %s, updated_at = %s
+                 WHERE id = %s
+                """,
+                (status, available_at, error[:4000], now, job_id)
+            )
+        return status
+
+    def cancel(self, kind: str, request_id: str) -> int:
+        """Cancel the queued or running jobs of ``kind`` for ``request_id``; returns how many."""
+        now = time.time()
+        with self._transaction() as execute:
+            cursor = execute(
+                """
+                UPDATE image_jobs
+                   SET status = %s, lease_owner = NULL, lease_expires_at = NULL, active_key = NULL, updated_at = %s
+                 WHERE kind = %s AND request_id = %s AND status IN (%s, %s)
+                """,
+                (CANCELLED, now, kind, request_id, QUEUED, RUNNING)
+            )
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._transaction() as execute:
+            rows = execute("SELECT status, COUNT(*) FROM image_jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)}
+        counts.update({status: count for status, count in rows})
+        counts["backend"] = self.backend
+        return counts
+
+
+def create_job_queue(db_config: Dict[str, Any], backend: str = JOB_QUEUE_BACKEND) -> JobQueue:
+    """Build the queue selected by JOB_QUEUE_BACKEND."""
+    if backend == "sqlite":
+        return JobQueue(sqlite_path=JOB_QUEUE_SQLITE_PATH)
+    return JobQueue(db_config=db_config)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Manage the background job queue")
+    parser.add_argument("--create-table", action="store_true", help="Create image_jobs if missing")
+    parser.add_argument("--stats", action="store_true", help="Print job counts by status")
+    args = parser.parse_args()
+
+    db_config = {
+        "host": os.getenv("DB_HOST"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "database": os.getenv("DB_NAME"),
+        "port": int(os.getenv("DB_PORT", 3306))
+    }
+    queue = create_job_queue(db_config)
+
+    if args.create_table:
+        queue.create_table()
+        logger.info("image_jobs is ready")
+    if args.stats:
+        print(json.dumps(queue.stats(), indent=2))
+    if not (args.create_table or args.stats):
+        parser.print_help()
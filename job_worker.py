@@ -0,0 +1,170 @@
+"""
+Background Job Worker
+
+Runs jobs from the durable queue (job_queue.py). Start as many of these as
+needed, on any node that can reach the queue database:
+
+    python job_worker.py --threads 2
+
+Each thread leases one job at a time, heartbeats its lease while the job
+runs and records success or failure (failed jobs are retried with backoff by
+the queue). If the lease is lost, e.g. because the job was cancelled, the
+job's ``cancelled`` event is set so the handler can stop early. SIGTERM / SIGINT stop leasing new jobs and let running ones
+finish.
+
+The web app can also run a few worker threads in-process
+(JOB_QUEUE_EMBEDDED_WORKERS, default 1) so jobs are processed without a
+separate deployment; set it to 0 when dedicated workers are running.
+
+Configuration (environment variables):
+    JOB_QUEUE_EMBEDDED_WORKERS  Worker threads started inside the web app (default 1)
+    JOB_POLL_INTERVAL           Seconds between polls when the queue is empty (default 1)
+"""
+
+import os
+import socket
+import signal
+import logging
+import argparse
+import threading
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+from job_queue import JobQueue
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_EMBEDDED_WORKERS = int(os.getenv("JOB_QUEUE_EMBEDDED_WORKERS", 1))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+
+GENERATE_ALL_IMAGES = "generate_all_images"
+
+
+def run_generate_all_images(job: Dict[str, Any]) -> Dict[str, Any]:
+    from slide_service import generate_all_images_for_presentation
+
+    result = generate_all_images_for_presentation(
+        job["request_id"],
+        visible_slides=job["payload"].get("visible_slides"),
+        cancelled=job.get("cancelled"),
+        final_attempt=job["attempts"] >= job["max_attempts"],
+    )
+    if not result.get("success") and not result.get("cancelled"):
+        raise RuntimeError(result.get("error") or "Image generation failed")
+    return result
+
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    GENERATE_ALL_IMAGES: run_generate_all_images,
+}
+
+
+class Worker:
+    """Leases and runs jobs of the kinds in ``handlers`` until ``stop_event`` is set."""
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = HANDLERS,
+                 worker_id: Optional[str] = None, poll_interval: float = JOB_POLL_INTERVAL,
+                 stop_event: Optional[threading.Event] = None):
+        self.queue = queue
+        self.handlers = handlers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.poll_interval = poll_interval
+        self.stop_event = stop_event or threading.Event()
+
+    def _heartbeat(self, job_id: int, done: threading.Event, cancelled: threading.Event) -> None:
+        interval = max(self.queue.visibility_timeout / 3, 1)
+        while not done.wait(interval):
+            try:
+                if not self.queue.heartbeat(job_id, self.worker_id):
+                    logger.warning(f"Worker {self.worker_id} lost the lease on job {job_id}")
+                    cancelled.set()
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat for job {job_id} failed: {e}")
+
+    def run_once(self) -> bool:
+        """Lease and run one job. Returns False if nothing was due."""
+        job = self.queue.lease(self.worker_id, kinds=list(self.handlers))
+        if job is None:
+            return False
+
+        logger.info(f"Job {job['id']} ({job['kind']} {job['request_id']}) attempt {job['attempts']}/{job['max_attempts']}")
+        done = threading.Event()
+        job["cancelled"] = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], done, job["cancelled"]), daemon=True)
+        heartbeat.start()
+        try:
+            result = self.handlers[job["kind"]](job)
+        except Exception as e:
+            done.set()
+            if job["cancelled"].is_set():
+                logger.info(f"Job {job['id']} stopped after its lease was lost: {e}")
+            else:
+                logger.error(f"Job {job['id']} failed: {e}\n{traceback.format_exc()}")
+                status = self.queue.fail(job["id"], self.worker_id, f"{type(e).__name__}: {e}")
+                logger.info(f"Job {job['id']} is now {status}")
+        else:
+            done.set()
+            if job["cancelled"].is_set():
+                logger.info(f"Job {job['id']} stopped after its lease was lost")
+            else:
+                self.queue.complete(job["id"], self.worker_id, result)
+                logger.info(f"Job {job['id']} succeeded")
+        return True
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} could not poll the queue: {e}")
+            self.stop_event.wait(self.poll_interval)
+
+
+def start_workers(queue: JobQueue, count: int, handlers=HANDLERS,
+                  stop_event: Optional[threading.Event] = None) -> List[threading.Thread]:
+    """Start ``count`` daemon worker threads sharing ``stop_event``."""
+    stop_event = stop_event or threading.Event()
+    threads = []
+    for i in range(count):
+        worker = Worker(queue, handlers, stop_event=stop_event)
+        thread = threading.Thread(target=worker.run, name=f"job-worker-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--threads", type=int, default=1, help="Jobs run concurrently by this process")
+    args = parser.parse_args()
+
+    from job_queue import create_job_queue
+
+    db_config = {
+        "host": os.getenv("DB_HOST"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "database": os.getenv("DB_NAME"),
+        "port": int(os.getenv("DB_PORT", 3306))
+    }
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        logger.info("Stopping: finishing running jobs, leasing no new ones")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    workers = start_workers(create_job_queue(db_config), args.threads, stop_event=stop)
+    logger.info(f"{len(workers)} job worker threads running")
+    for thread in workers:
+        while thread.is_alive():
+            thread.join(timeout=1)
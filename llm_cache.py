@@ -0,0 +1,313 @@
+"""
+Persistent LLM Response Cache
+
+Reuses the result of a BAML function called again with the same inputs
+(retries, regenerate buttons, QA replays) instead of another LLM call.
+Responses are stored in a local SQLite file shared by every thread and
+process on the host.
+
+The cache key is a SHA-256 over a canonical JSON form of:
+- the function name
+- its arguments (Pydantic models dumped, None fields dropped, keys sorted,
+  strings NFC-normalized)
+- the LLM client the function uses
+- a hash of the BAML sources in baml_client/inlinedbaml.py
+
+Any prompt, schema or client change therefore misses the old entries.
+
+Entries expire after LLM_CACHE_TTL. When the file grows past
+LLM_CACHE_MAX_MB, the least recently used entries are evicted. Lookups and
+stores never raise: if the cache file is unavailable, the LLM is called as
+before.
+
+Usage:
+    from llm_cache import b                     # cached BamlSyncClient
+    outline = b.GenerateQuickOutline(content=..., audience=None, ...)
+    fresh = b.EditSlide(request, bypass_cache=True)   # always call, then refresh
+
+    from llm_cache import async_b               # same for the async client
+
+Configuration (environment variables):
+    LLM_CACHE_ENABLED    Set to 0 to always call the LLM (default 1)
+    LLM_CACHE_PATH       SQLite file (default llm_cache.sqlite3)
+    LLM_CACHE_TTL        Seconds an entry is reused (default 604800, 7 days)
+    LLM_CACHE_MAX_MB     Size of stored responses before LRU eviction (default 512)
+    LLM_CACHE_FUNCTIONS  Comma-separated cached functions
+                         (default GeneratePresentation,GenerateStrategicSalesOutline,
+                         GenerateQuickOutline,EditSlide)
+"""
+
+import os
+import re
+import json
+import time
+import typing
+import hashlib
+import inspect
+import logging
+import sqlite3
+import threading
+import functools
+import unicodedata
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, TypeAdapter
+
+from baml_client.inlinedbaml import get_baml_files
+from baml_client.sync_client import b as sync_b
+from baml_client.async_client import b as _async_b
+from llm_metrics import InstrumentedBamlClient
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", 512))
+LLM_CACHE_FUNCTIONS = [
+    name.strip() for name in os.getenv(
+        "LLM_CACHE_FUNCTIONS", "GeneratePresentation,GenerateStrategicSalesOutline,GenerateQuickOutline,EditSlide"
+    ).split(",") if name.strip()
+]
+
+CREATE_LLM_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key TEXT PRIMARY KEY,
+    function TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_hit_at REAL NOT NULL
+)
+"""
+
+# Fraction of LLM_CACHE_MAX_MB kept after an eviction pass
+EVICT_TO = 0.9
+
+
+def baml_source_hash(files: Optional[Dict[str, str]] = None) -> str:
+    files = get_baml_files() if files is None else files
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode("utf-8") + b"\0" + files[name].encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def function_client(function: str, files: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """LLM client named in ``function``'s BAML definition."""
+    pattern = re.compile(rf"function\s+{re.escape(function)}\s*\(.*?\{{\s*client\s+\"?([\w\-/.]+)", re.DOTALL)
+    for source in (get_baml_files() if files is None else files).values():
+        match = pattern.search(source)
+        if match:
+            return match.group(1)
+    return None
+
+
+def normalize_args(value: Any) -> Any:
+    """JSON-ready form of BAML arguments, equal for a dict and the equivalent Pydantic model."""
+    if isinstance(value, BaseModel):
+        value = value.model_dump(mode="json")
+    if isinstance(value, dict):
+        return {str(k): normalize_args(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize_args(v) for v in value]
+    if isinstance(value, str):
+        return unicodedata.normalize("NFC", value)
+    return value
+
+
+def cache_key(function: str, arguments: Dict[str, Any], client: Optional[str], source_hash: str) -> str:
+    canonical = json.dumps(
+        {"function": function, "args": normalize_args(arguments), "client": client, "baml": source_hash},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """cache_key -> JSON response in a SQLite file, with TTL, LRU size eviction and hit/miss counters."""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: int = LLM_CACHE_TTL,
+                 max_bytes: int = LLM_CACHE_MAX_MB * 1024 * 1024, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "expired": 0, "evicted": 0, "errors": 0}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += n
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(CREATE_LLM_CACHE_TABLE_SQL)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT response, created_at FROM llm_cache WHERE cache_key = ?", (key,)).fetchone()
+            now = time.time()
+            if row and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                self._count("expired")
+                row = None
+            if not row:
+                self._count("misses")
+                return None
+            conn.execute(
+                "UPDATE llm_cache SET hits = hits + 1, last_hit_at = ? WHERE cache_key = ?", (now, key)
+            )
+            self._count("hits")
+            return json.loads(row[0])
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+
+    def put(self, key: str, function: str, response: Any) -> None:
+        if not self.enabled:
+            return
+        try:
+            body = json.dumps(response, ensure_ascii=False)
+            now = time.time()
+            conn = self._conn()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO llm_cache (cache_key, function, response, size_bytes, hits, created_at, last_hit_at)
+                VALUES (?, ?, ?, ?, 0, ?, ?)
+                """,
+                (key, function, body, len(body.encode("utf-8")), now, now)
+            )
+            self._count("stores")
+            self._evict(conn, now)
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"LLM cache store failed for {function}: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+        if expired > 0:
+            self._count("expired", expired)
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess, victims = total - self.max_bytes * EVICT_TO, []
+        for key, size in conn.execute("SELECT cache_key, size_bytes FROM llm_cache ORDER BY last_hit_at"):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM llm_cache WHERE cache_key = ?", victims)
+        self._count("evicted", len(victims))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counts)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        try:
+            entries, size = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_cache"
+            ).fetchone() if self.enabled else (0, 0)
+            stats.update(entries=entries, size_mb=round(size / 1024 / 1024, 2))
+        except Exception:
+            pass
+        return stats
+
+
+class CachedBamlClient:
+    """
+    Wraps a BAML sync or async client. Functions in ``functions`` look up the
+    cache before calling the LLM and accept ``bypass_cache=True`` to always
+    call it (the fresh response replaces the cached one). Calls passing
+    ``baml_options`` (client registry, type builder) are never cached.
+    Everything else is delegated to the wrapped client unchanged.
+    """
+
+    def __init__(self, client, cache: LLMResponseCache, functions=LLM_CACHE_FUNCTIONS):
+        self._client = client
+        self._cache = cache
+        self._functions = set(functions)
+        self._source_hash = baml_source_hash()
+        self._wrapped: Dict[str, Any] = {}
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or name not in self._functions:
+            return getattr(self._client, name)
+        wrapped = self._wrapped.get(name)
+        if wrapped is None:
+            wrapped = self._wrapped[name] = self._wrap(name)
+        return wrapped
+
+    def _wrap(self, name: str):
+        call = getattr(self._client, name)
+        # Signature and return type of the generated function, through any wrappers
+        # (e.g. llm_metrics); a subclass may not repeat the annotations
+        method = inspect.unwrap(call)
+        signature = inspect.signature(method)
+        owner = getattr(method, "__self__", None)
+        hints = next(hints for hints in (
+            [typing.get_type_hints(method)] +
+            [typing.get_type_hints(getattr(cls, name)) for cls in type(owner).__mro__ if name in vars(cls)]
+        ) if "return" in hints)
+        adapter = TypeAdapter(hints["return"])
+        client_name = function_client(name)
+        cache = self._cache
+
+        def prepare(args, kwargs):
+            bypass = kwargs.pop("bypass_cache", False)
+            bound = signature.bind(*args, **kwargs)
+            arguments = {k: v for k, v in bound.arguments.items() if k != "baml_options"}
+            if bound.arguments.get("baml_options"):
+                return None, False
+            return cache_key(name, arguments, client_name, self._source_hash), bypass
+
+        def cached(key, bypass):
+            if key is None:
+                return None
+            if bypass:
+                cache._count("bypassed")
+                return None
+            hit = cache.get(key)
+            return None if hit is None else adapter.validate_python(hit)
+
+        def store(key, result):
+            if key is not None:
+                cache.put(key, name, adapter.dump_python(result, mode="json"))
+            return result
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                key, bypass = prepare(args, kwargs)
+                hit = cached(key, bypass)
+                if hit is not None:
+                    return hit
+                return store(key, await call(*args, **kwargs))
+        else:
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                key, bypass = prepare(args, kwargs)
+                hit = cached(key, bypass)
+                if hit is not None:
+                    return hit
+                return store(key, call(*args, **kwargs))
+        return wrapper
+
+
+llm_cache = LLMResponseCache()
+# Misses reach the LLM through llm_metrics, which accounts tokens and latency per call
+b = CachedBamlClient(InstrumentedBamlClient(sync_b), llm_cache)
+async_b = CachedBamlClient(InstrumentedBamlClient(_async_b), llm_cache)
@@ -0,0 +1,306 @@
+"""
+LLM Call Accounting
+
+Attaches a BAML Collector to every BAML function call and records, per call:
+- function and client (and provider)
+- input/output tokens and estimated cost
+- latency and the number of retries or fallbacks
+- success, and the request_id the call was made for
+
+Per-function aggregates are reported under ``llm`` in GET /api/v1/metrics.
+Individual calls are written in batches to the ``llm_calls`` table, for
+capacity planning and for spotting regressions after prompt or model changes.
+
+The request_id is taken from the surrounding ``llm_request`` block. It
+follows the call into asyncio tasks, e.g. sectioned deck generation.
+
+Usage:
+    from llm_metrics import InstrumentedBamlClient, llm_request, tracked
+
+    b = InstrumentedBamlClient(baml_client.sync_client.b)   # done by llm_cache
+    with llm_request(request_id):
+        b.GeneratePresentation(presentation_input)
+
+    # Streaming calls pass the collector themselves
+    with tracked("GeneratePresentation") as options:
+        stream = b.stream.GeneratePresentation(presentation_input, baml_options=options)
+        ...
+        stream.get_final_response()
+
+Configuration (environment variables):
+    LLM_METRICS_ENABLED        Set to 0 to call BAML without collectors (default 1)
+    LLM_METRICS_DB             Set to 0 to keep aggregates in memory only (default 1)
+    LLM_METRICS_FLUSH_EVERY    Buffered calls that trigger a table write (default 50)
+    LLM_METRICS_FLUSH_INTERVAL Seconds between table writes (default 5)
+    LLM_PRICES                 JSON of USD per million tokens by client, e.g.
+                               {"CustomGPT4o": [2.5, 10], "Gemini20Flash": [0.1, 0.4]}
+"""
+
+import os
+import json
+import time
+import atexit
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from db_pool import connection as db_connection
+
+try:
+    from baml_py import Collector
+except ImportError:  # pragma: no cover - baml-py is required by baml_client anyway
+    Collector = None
+
+# Importers load .env after their imports; the database settings are needed now
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_METRICS_ENABLED = os.getenv("LLM_METRICS_ENABLED", "1") not in ("0", "false", "False")
+LLM_METRICS_DB = os.getenv("LLM_METRICS_DB", "1") not in ("0", "false", "False")
+LLM_METRICS_FLUSH_EVERY = int(os.getenv("LLM_METRICS_FLUSH_EVERY", 50))
+LLM_METRICS_FLUSH_INTERVAL = float(os.getenv("LLM_METRICS_FLUSH_INTERVAL", 5))
+LLM_PRICES: Dict[str, List[float]] = json.loads(os.getenv("LLM_PRICES", "{}") or "{}")
+
+# Latencies kept per function for percentiles
+LATENCY_SAMPLES = 500
+
+CREATE_LLM_CALLS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    request_id VARCHAR(64) NULL,
+    function_name VARCHAR(128) NOT NULL,
+    client VARCHAR(128) NULL,
+    provider VARCHAR(64) NULL,
+    input_tokens INT NULL,
+    output_tokens INT NULL,
+    cost_usd DECIMAL(12, 6) NULL,
+    latency_ms INT NOT NULL,
+    retries INT NOT NULL DEFAULT 0,
+    success TINYINT(1) NOT NULL,
+    error VARCHAR(512) NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_llm_calls_request (request_id),
+    INDEX idx_llm_calls_function (function_name, created_at)
+)
+"""
+
+INSERT_LLM_CALL_SQL = """
+INSERT INTO llm_calls (request_id, function_name, client, provider, input_tokens, output_tokens,
+                       cost_usd, latency_ms, retries, success, error)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar("llm_request_id", default=None)
+
+
+@contextmanager
+def llm_request(request_id: Optional[str]) -> Iterator[None]:
+    """Attribute the BAML calls made inside the block to ``request_id``."""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+def call_cost(client: Optional[str], input_tokens: Optional[int], output_tokens: Optional[int]) -> Optional[float]:
+    price = LLM_PRICES.get(client or "")
+    if not price or input_tokens is None or output_tokens is None:
+        return None
+    return round((input_tokens * price[0] + output_tokens * price[1]) / 1_000_000, 6)
+
+
+def call_record(function: str, collector, latency_ms: float, error: Optional[BaseException] = None) -> Dict[str, Any]:
+    """One llm_calls row from the Collector's log of the call (falling back to measured latency)."""
+    log = collector.last if collector is not None else None
+    calls = list(getattr(log, "calls", None) or [])
+    selected = getattr(log, "selected_call", None) or (calls[-1] if calls else None)
+    usage = getattr(log, "usage", None)
+    timing = getattr(log, "timing", None)
+    client = getattr(selected, "client_name", None)
+    input_tokens = getattr(usage, "input_tokens", None)
+    output_tokens = getattr(usage, "output_tokens", None)
+    return {
+        "request_id": _request_id.get(),
+        "function": function,
+        "client": client,
+        "provider": getattr(selected, "provider", None),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cost_usd": call_cost(client, input_tokens, output_tokens),
+        "latency_ms": int(getattr(timing, "duration_ms", None) or latency_ms),
+        "retries": max(0, len(calls) - 1),
+        "success": error is None,
+        "error": str(error)[:512] if error is not None else None,
+    }
+
+
+class LLMCallRecorder:
+    """Per-function aggregates in memory, plus write-behind batches of call rows to ``llm_calls``."""
+
+    def __init__(self, db_config: Optional[Dict[str, Any]], flush_every: int = LLM_METRICS_FLUSH_EVERY,
+                 flush_interval: float = LLM_METRICS_FLUSH_INTERVAL):
+        self.db_config = db_config
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending: List[Dict[str, Any]] = []
+        self._functions: Dict[str, Dict[str, Any]] = {}
+        self._latencies: Dict[str, Deque[int]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._table_ready = False
+        self.written = 0
+        self.write_errors = 0
+
+    def record(self, row: Dict[str, Any]) -> None:
+        with self._cond:
+            totals = self._functions.setdefault(row["function"], {
+                "calls": 0, "errors": 0, "retries": 0, "input_tokens": 0, "output_tokens": 0,
+                "cost_usd": 0.0, "latency_ms": 0, "clients": {},
+            })
+            totals["calls"] += 1
+            totals["errors"] += 0 if row["success"] else 1
+            totals["retries"] += row["retries"]
+            totals["input_tokens"] += row["input_tokens"] or 0
+            totals["output_tokens"] += row["output_tokens"] or 0
+            totals["cost_usd"] += row["cost_usd"] or 0.0
+            totals["latency_ms"] += row["latency_ms"]
+            if row["client"]:
+                totals["clients"][row["client"]] = totals["clients"].get(row["client"], 0) + 1
+            self._latencies.setdefault(row["function"], deque(maxlen=LATENCY_SAMPLES)).append(row["latency_ms"])
+
+            if self.db_config is None:
+                return
+            self._pending.append(row)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-metrics-writer", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.flush_every:
+                self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        with self._cond:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            with db_connection(self.db_config) as conn:
+                with conn.cursor() as cursor:
+                    if not self._table_ready:
+                        cursor.execute(CREATE_LLM_CALLS_TABLE_SQL)
+                        self._table_ready = True
+                    cursor.executemany(INSERT_LLM_CALL_SQL, [(
+                        row["request_id"], row["function"], row["client"], row["provider"],
+                        row["input_tokens"], row["output_tokens"], row["cost_usd"],
+                        row["latency_ms"], row["retries"], 1 if row["success"] else 0, row["error"],
+                    ) for row in rows])
+                conn.commit()
+            self.written += len(rows)
+        except Exception as e:
+            # Accounting must never affect the calls themselves: drop the batch
+            self.write_errors += 1
+            logger.warning(f"Could not write {len(rows)} LLM call records: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            functions = {}
+            for name, totals in self._functions.items():
+                latencies = sorted(self._latencies.get(name, ()))
+                functions[name] = {
+                    **totals,
+                    "clients": dict(totals["clients"]),
+                    "cost_usd": round(totals["cost_usd"], 4),
+                    "avg_latency_ms": round(totals["latency_ms"] / totals["calls"]) if totals["calls"] else 0,
+                    "p50_latency_ms": latencies[len(latencies) // 2] if latencies else None,
+                    "p95_latency_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+                }
+            pending = len(self._pending)
+        return {"functions": functions, "pending_rows": pending, "written_rows": self.written,
+                "write_errors": self.write_errors}
+
+
+def _db_config_from_env() -> Optional[Dict[str, Any]]:
+    if not LLM_METRICS_DB or not os.getenv("DB_HOST"):
+        return None
+    return {
+        "host": os.getenv("DB_HOST"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "database": os.getenv("DB_NAME"),
+        "port": int(os.getenv("DB_PORT", 3306)),
+    }
+
+
+recorder = LLMCallRecorder(_db_config_from_env())
+atexit.register(recorder.flush)
+
+
+@contextmanager
+def tracked(function: str, baml_options: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    ``baml_options`` with a fresh Collector added; the call made with them
+    inside the block is recorded when the block exits (failed or not).
+    """
+    options = dict(baml_options or {})
+    if not LLM_METRICS_ENABLED or Collector is None:
+        yield options
+        return
+    collector = Collector(name=function)
+    existing = options.get("collector")
+    options["collector"] = ([*existing] if isinstance(existing, list) else [existing] if existing else []) + [collector]
+    started = time.monotonic()
+    try:
+        yield options
+    except Exception as e:
+        recorder.record(call_record(function, collector, (time.monotonic() - started) * 1000, e))
+        raise
+    recorder.record(call_record(function, collector, (time.monotonic() - started) * 1000))
+
+
+class InstrumentedBamlClient:
+    """
+    Wraps a BAML sync or async client so every function call (attributes
+    starting with an upper-case letter) runs inside ``tracked``. Other
+    attributes (stream, parse, with_options, ...) are the wrapped client's.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._wrapped: Dict[str, Any] = {}
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if not name[:1].isupper() or not callable(attr):
+            return attr
+        wrapped = self._wrapped.get(name)
+        if wrapped is None:
+            wrapped = self._wrapped[name] = self._wrap(name, attr)
+        return wrapped
+
+    @staticmethod
+    def _wrap(name: str, attr):
+        if inspect.iscoroutinefunction(attr):
+            @functools.wraps(attr)
+            async def wrapper(*args, baml_options=None, **kwargs):
+                with tracked(name, baml_options) as options:
+                    return await attr(*args, baml_options=options, **kwargs)
+        else:
+            @functools.wraps(attr)
+            def wrapper(*args, baml_options=None, **kwargs):
+                with tracked(name, baml_options) as options:
+                    return attr(*args, baml_options=options, **kwargs)
+        return wrapper
@@ -11,6 +11,7 @@ from logging.handlers import RotatingFileHandler
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from dotenv import load_dotenv
+from db_pool import connection as db_connection
 
 # Import strategic outline generator
 try:
@@ -70,10 +71,8 @@ class MeetingAnalysis:
             raise
 
 def fetch_transcripts(db_config, meeting_unique_id):  
-    connection = None
-    try:  
-        connection = pymysql.connect(**db_config, cursorclass=pymysql.cursors.DictCursor)
-        cursor = connection.cursor()
+    with db_connection(db_config) as connection:
+        cursor = connection.cursor(pymysql.cursors.DictCursor)
         transcript_query = """SELECT eventID, speaker, start, end, transcript, created_at FROM meeting_transcript WHERE eventID = %s"""
         cursor.execute(transcript_query, (meeting_unique_id,))
         transcript_rows = cursor.fetchall()
@@ -85,15 +84,10 @@ def fetch_transcripts(db_config, meeting_unique_id):
             'transcript': tr['transcript'],
             'created_at': tr['created_at']
         } for tr in transcript_rows]
-    finally:
-        if connection:
-            connection.close()
 
 def get_meeting_participants(db_config, meeting_id):  
-    connection = None
-    try:  
-        connection = pymysql.connect(**db_config, cursorclass=pymysql.cursors.DictCursor)
-        cursor = connection.cursor()
+    with db_connection(db_config) as connection:
+        cursor = connection.cursor(pymysql.cursors.DictCursor)
         transcript_query = """
                     SELECT attendee
                         FROM meeting_participant_metadata
@@ -104,9 +98,6 @@ def get_meeting_participants(db_config, meeting_id):
         attendees = [tr['attendee'] for tr in transcript_rows]
         attendees_str = ", ".join(attendees)
         return attendees_str
-    finally:
-        if connection:
-            connection.close()
 
 
 
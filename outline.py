@@ -11,7 +11,7 @@ import json
 import logging
 from typing import Optional, Dict, Any, List
 from dataclasses import dataclass, asdict
-from baml_client import b
+from llm_cache import b
 from baml_client.types import DynamicInputContext, StrategicPresentationOutline
 
 # Configure logging
@@ -0,0 +1,406 @@
+"""
+Per-Provider Rate Limiting
+
+Token-bucket limiters shared by every thread in the process, one per
+external provider (e.g. "gemini"), so parallel workers never exceed the
+provider's request rate no matter how many decks are being processed.
+
+On top of the fixed rate, provider_call() adapts to what the provider can
+actually take right now:
+
+- AdaptiveConcurrencyLimiter (AIMD) bounds the calls in flight. The limit
+  grows by one per window of fast successes and is cut multiplicatively on
+  overload (429 / 5xx / timeouts) or when latency rises well above the
+  recent minimum, so throughput settles near the provider's capacity.
+- CircuitBreaker opens when the overload rate over recent calls crosses a
+  threshold. Callers wait out the open period instead of hammering the
+  provider, then a single probe decides whether it closes again.
+
+Usage:
+    from rate_limit import get_rate_limiter, provider_call
+
+    get_rate_limiter("gemini").acquire()
+    client.models.generate_content(...)
+
+    with provider_call("gemini"):          # circuit + concurrency + rate
+        client.models.generate_content(...)
+
+Configuration (environment variables, PROVIDER upper-cased):
+    RATE_LIMIT_<PROVIDER>_RPS                Sustained requests per second (default 2, 0 disables)
+    RATE_LIMIT_<PROVIDER>_BURST              Requests allowed back to back (default 4)
+    CONCURRENCY_<PROVIDER>_INITIAL           Starting in-flight limit (default 4)
+    CONCURRENCY_<PROVIDER>_MIN / _MAX        Bounds of the in-flight limit (default 1 / 16)
+    CONCURRENCY_<PROVIDER>_LATENCY_TOLERANCE Latency over the recent minimum treated as congestion (default 2.5x)
+    CIRCUIT_<PROVIDER>_FAILURE_RATE          Overload share of recent calls that opens the circuit (default 0.5)
+    CIRCUIT_<PROVIDER>_MIN_CALLS             Calls in the window before it can open (default 10)
+    CIRCUIT_<PROVIDER>_WINDOW                Recent calls considered (default 20)
+    CIRCUIT_<PROVIDER>_RESET_SECONDS         Open period before a probe, doubled while probes fail (default 30)
+    CIRCUIT_<PROVIDER>_MAX_WAIT              Seconds a caller waits for the circuit before giving up (default 60)
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+DEFAULT_RPS = 2.0
+DEFAULT_BURST = 4
+
+
+# Call outcomes fed back to the adaptive limiter and circuit breaker
+SUCCESS, OVERLOAD, ERROR = "success", "overload", "error"
+
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when a token does not become available within the acquire timeout."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a provider's circuit stays open for longer than the caller waits."""
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    OVERLOAD for errors that mean "slow down" (HTTP 429 / 5xx, timeouts,
+    RESOURCE_EXHAUSTED / UNAVAILABLE), ERROR for everything else (bad request,
+    safety block, cancelled run), which says nothing about provider load.
+    """
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int) and (code == 429 or code >= 500):
+        return OVERLOAD
+    if isinstance(error, TimeoutError):
+        return OVERLOAD
+    message = str(error).upper()
+    if any(marker in message for marker in ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE", "TIMED OUT", "TIMEOUT", "429")):
+        return OVERLOAD
+    return ERROR
+
+
+class RateLimiter:
+    """Thread-safe token bucket refilled at ``rate`` tokens/second up to ``burst``."""
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """Block until a request may be sent; returns the seconds spent waiting."""
+        if self.rate <= 0:
+            with self._lock:
+                self.acquired += 1
+            return 0.0
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.acquired += 1
+                    elapsed = now - start
+                    if waited:
+                        self.throttled += 1
+                        self.wait_seconds += elapsed
+                    return elapsed
+                delay = (1 - self._tokens) / self.rate
+            if deadline is not None and now + delay > deadline:
+                raise RateLimitTimeout(f"Rate limit for {self.name} not available within {timeout}s")
+            waited = True
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "provider": self.name,
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "available": round(self._tokens, 2),
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on concurrent calls. ``release`` feeds back each call's latency
+    and outcome: fast successes add ``1 / limit`` (one per window), overloads
+    halve the limit and slow successes shrink it by 10%. Decreases are applied
+    at most once per cooldown so one burst of failures counts once.
+    """
+
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int,
+                 latency_tolerance: float, backoff: float = 0.5, latency_backoff: float = 0.9):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._latencies: Deque[float] = deque(maxlen=100)
+        self._last_decrease = 0.0
+
+        self.successes = 0
+        self.overloads = 0
+        self.slow = 0
+        self.waited = 0
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if self._in_flight >= int(self.limit):
+                self.waited += 1
+            while self._in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise RateLimitTimeout(f"No {self.name} concurrency slot within {timeout}s")
+                self._cond.wait(remaining)
+            self._in_flight += 1
+
+    def _decrease(self, factor: float, now: float, cooldown: float) -> None:
+        if now - self._last_decrease < cooldown:
+            return
+        self.limit = max(float(self.minimum), self.limit * factor)
+        self._last_decrease = now
+
+    def release(self, latency: float, outcome: str) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            baseline = min(self._latencies) if self._latencies else None
+            # Wait about one call duration between decreases
+            cooldown = baseline or latency
+            if outcome == OVERLOAD:
+                self.overloads += 1
+                self._decrease(self.backoff, now, cooldown)
+            elif outcome == SUCCESS:
+                self.successes += 1
+                self._latencies.append(latency)
+                if baseline is not None and latency > baseline * self.latency_tolerance:
+                    self.slow += 1
+                    self._decrease(self.latency_backoff, now, cooldown)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "provider": self.name,
+                "limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "min": self.minimum,
+                "max": self.maximum,
+                "baseline_latency": round(min(self._latencies), 3) if self._latencies else None,
+                "successes": self.successes,
+                "overloads": self.overloads,
+                "slow": self.slow,
+                "waited": self.waited,
+            }
+
+
+class CircuitBreaker:
+    """
+    closed ──overload rate over the window ≥ failure_rate──▶ open
+    open ──reset period elapsed──▶ half-open (one probe call)
+    half-open ──probe succeeds──▶ closed / ──probe overloaded──▶ open (period doubled)
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_rate: float, min_calls: int, window: int,
+                 reset_seconds: float, max_wait: float, max_reset_seconds: float = 600):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_seconds = reset_seconds
+        self.max_reset_seconds = max(max_reset_seconds, reset_seconds)
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.state = self.CLOSED
+        self._open_until = 0.0
+        self._open_seconds = reset_seconds
+        self._probing = False
+
+        self.opened = 0
+        self.rejected = 0
+
+    def _open(self, now: float, seconds: float) -> None:
+        self.state = self.OPEN
+        self._open_seconds = seconds
+        self._open_until = now + seconds
+        self._outcomes.clear()
+        self.opened += 1
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """Wait until a call may be made; raises CircuitOpenError after ``timeout`` (default max_wait)."""
+        deadline = time.monotonic() + (self.max_wait if timeout is None else timeout)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.state == self.CLOSED:
+                    return
+                if self.state == self.OPEN and now >= self._open_until:
+                    self.state = self.HALF_OPEN
+                if self.state == self.HALF_OPEN and not self._probing:
+                    self._probing = True
+                    return
+                wake = self._open_until if self.state == self.OPEN else deadline
+                if now >= deadline:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit is open")
+                self._cond.wait(max(0.01, min(wake, deadline) - now))
+
+    def record(self, outcome: str) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN and self._probing:
+                self._probing = False
+                if outcome == OVERLOAD:
+                    self._open(now, min(self._open_seconds * 2, self.max_reset_seconds))
+                elif outcome == SUCCESS:
+                    self.state = self.CLOSED
+                    self._open_seconds = self.reset_seconds
+                self._cond.notify_all()
+                return
+            if outcome == ERROR or self.state != self.CLOSED:
+                return
+            self._outcomes.append(outcome == OVERLOAD)
+            failures = sum(self._outcomes)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now, self.reset_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "provider": self.name,
+                "state": self.state,
+                "open_for_seconds": round(max(0.0, self._open_until - time.monotonic()), 1) if self.state == self.OPEN else 0,
+                "recent_calls": len(self._outcomes),
+                "recent_overloads": sum(self._outcomes),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """Return the process-wide limiter for ``provider``, configured from the environment."""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            prefix = f"RATE_LIMIT_{provider.upper()}"
+            limiter = RateLimiter(
+                provider,
+                rate=float(os.getenv(f"{prefix}_RPS", DEFAULT_RPS)),
+                burst=int(os.getenv(f"{prefix}_BURST", DEFAULT_BURST)),
+            )
+            _limiters[provider] = limiter
+        return limiter
+
+
+_concurrency: Dict[str, AdaptiveConcurrencyLimiter] = {}
+_circuits: Dict[str, CircuitBreaker] = {}
+
+
+def get_concurrency_limiter(provider: str) -> AdaptiveConcurrencyLimiter:
+    with _limiters_lock:
+        limiter = _concurrency.get(provider)
+        if limiter is None:
+            prefix = f"CONCURRENCY_{provider.upper()}"
+            limiter = AdaptiveConcurrencyLimiter(
+                provider,
+                initial=int(os.getenv(f"{prefix}_INITIAL", 4)),
+                minimum=int(os.getenv(f"{prefix}_MIN", 1)),
+                maximum=int(os.getenv(f"{prefix}_MAX", 16)),
+                latency_tolerance=float(os.getenv(f"{prefix}_LATENCY_TOLERANCE", 2.5)),
+            )
+            _concurrency[provider] = limiter
+        return limiter
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    with _limiters_lock:
+        breaker = _circuits.get(provider)
+        if breaker is None:
+            prefix = f"CIRCUIT_{provider.upper()}"
+            breaker = CircuitBreaker(
+                provider,
+                failure_rate=float(os.getenv(f"{prefix}_FAILURE_RATE", 0.5)),
+                min_calls=int(os.getenv(f"{prefix}_MIN_CALLS", 10)),
+                window=int(os.getenv(f"{prefix}_WINDOW", 20)),
+                reset_seconds=float(os.getenv(f"{prefix}_RESET_SECONDS", 30)),
+                max_wait=float(os.getenv(f"{prefix}_MAX_WAIT", 60)),
+            )
+            _circuits[provider] = breaker
+        return breaker
+
+
+@contextmanager
+def provider_call(provider: str):
+    """
+    Guard one call to ``provider``: wait for the circuit, an adaptive
+    concurrency slot and a rate token, then report the call's latency and
+    outcome (see classify_error) when the block exits.
+    """
+    breaker = get_circuit_breaker(provider)
+    concurrency = get_concurrency_limiter(provider)
+    breaker.acquire()
+    try:
+        concurrency.acquire()
+    except BaseException:
+        breaker.record(ERROR)
+        raise
+    outcome, start = ERROR, time.monotonic()
+    try:
+        get_rate_limiter(provider).acquire()
+        start = time.monotonic()
+        yield
+        outcome = SUCCESS
+    except Exception as e:
+        outcome = classify_error(e)
+        raise
+    finally:
+        concurrency.release(time.monotonic() - start, outcome)
+        breaker.record(outcome)
+
+
+def rate_limit_stats() -> List[Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
+
+
+def provider_stats() -> Dict[str, Any]:
+    """Adaptive concurrency and circuit state per provider."""
+    with _limiters_lock:
+        concurrency = list(_concurrency.values())
+        circuits = list(_circuits.values())
+    return {
+        "concurrency": [limiter.stats() for limiter in concurrency],
+        "circuits": [breaker.stats() for breaker in circuits],
+    }
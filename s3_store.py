@@ -0,0 +1,170 @@
+"""
+Shared S3 Access
+
+One boto3 client per process, shared by every thread and module that talks to
+S3, with a connection pool sized for the parallel image workers and a
+TransferConfig that switches large uploads (file uploads of up to 200MB) to
+concurrent multipart transfers. Every upload goes through upload_bytes(), so
+URLs are built the same way everywhere and transfer metrics are collected in
+one place (GET /api/v1/metrics).
+
+Usage:
+    import s3_store
+
+    url = s3_store.upload_bytes(data, "images/abc.png", "image/png")
+    if s3_store.exists("images/abc/480x300@2x.png"):
+        ...
+
+Public URLs are virtual-hosted (https://<bucket>.s3.<region>.amazonaws.com/<key>),
+or path-style for bucket names containing dots, which don't match the S3
+TLS certificate as a host name. A caller can pass a ``base_url`` (e.g. a CDN)
+instead.
+
+Configuration (environment variables):
+    AWS_S3_BUCKET_NAME          Default bucket
+    AWS_REGION                  Bucket region
+    S3_MAX_POOL_CONNECTIONS     HTTP connections kept per process (default 50)
+    S3_MAX_ATTEMPTS             Attempts per request, standard retry mode (default 5)
+    S3_MULTIPART_THRESHOLD_MB   Uploads at least this large use multipart (default 8)
+    S3_MULTIPART_CHUNKSIZE_MB   Multipart part size (default 8)
+    S3_MAX_CONCURRENCY          Parts transferred in parallel per upload (default 10)
+"""
+
+import os
+import time
+import threading
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+# Importers load .env after their imports; the bucket settings are needed now
+load_dotenv()
+
+S3_BUCKET_NAME = os.getenv("AWS_S3_BUCKET_NAME")
+S3_REGION = os.getenv("AWS_REGION")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 5))
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", 8))
+S3_MULTIPART_CHUNKSIZE_MB = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", 8))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 10))
+
+MB = 1024 * 1024
+
+_client = None
+_transfer_config = None
+_client_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "uploads": 0, "multipart_uploads": 0, "upload_bytes": 0, "upload_seconds": 0.0,
+    "downloads": 0, "download_bytes": 0, "download_seconds": 0.0,
+    "head_requests": 0, "errors": 0,
+}
+
+
+def get_client():
+    """The process-wide S3 client (boto3 clients are thread-safe)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                from botocore.config import Config
+
+                _client = boto3.client(
+                    "s3",
+                    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                    region_name=S3_REGION,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"mode": "standard", "max_attempts": S3_MAX_ATTEMPTS},
+                        tcp_keepalive=True,
+                    ),
+                )
+    return _client
+
+
+def transfer_config():
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD_MB * MB,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE_MB * MB,
+            max_concurrency=S3_MAX_CONCURRENCY,
+        )
+    return _transfer_config
+
+
+def _record(**deltas) -> None:
+    with _stats_lock:
+        for name, value in deltas.items():
+            _stats[name] += value
+
+
+def public_url(key: str, bucket: Optional[str] = None, base_url: Optional[str] = None) -> str:
+    """Public URL of ``key``; ``base_url`` (ending in /) replaces the S3 endpoint."""
+    if base_url:
+        return f"{base_url}{key}"
+    bucket = bucket or S3_BUCKET_NAME
+    if "." in bucket:
+        return f"https://s3.{S3_REGION}.amazonaws.com/{bucket}/{key}"
+    return f"https://{bucket}.s3.{S3_REGION}.amazonaws.com/{key}"
+
+
+def upload_bytes(data: bytes, key: str, content_type: str, bucket: Optional[str] = None,
+                 base_url: Optional[str] = None) -> str:
+    """Upload ``data`` to ``key`` (no ACLs) and return its public URL."""
+    bucket = bucket or S3_BUCKET_NAME
+    start = time.monotonic()
+    try:
+        get_client().upload_fileobj(
+            BytesIO(data), bucket, key,
+            ExtraArgs={"ContentType": content_type},
+            Config=transfer_config(),
+        )
+    except Exception:
+        _record(errors=1)
+        raise
+    _record(
+        uploads=1,
+        multipart_uploads=1 if len(data) >= S3_MULTIPART_THRESHOLD_MB * MB else 0,
+        upload_bytes=len(data),
+        upload_seconds=time.monotonic() - start,
+    )
+    return public_url(key, bucket, base_url)
+
+
+def download_bytes(key: str, bucket: Optional[str] = None) -> bytes:
+    start = time.monotonic()
+    try:
+        data = get_client().get_object(Bucket=bucket or S3_BUCKET_NAME, Key=key)["Body"].read()
+    except Exception:
+        _record(errors=1)
+        raise
+    _record(downloads=1, download_bytes=len(data), download_seconds=time.monotonic() - start)
+    return data
+
+
+def exists(key: str, bucket: Optional[str] = None) -> bool:
+    _record(head_requests=1)
+    try:
+        get_client().head_object(Bucket=bucket or S3_BUCKET_NAME, Key=key)
+        return True
+    except Exception:
+        return False
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["upload_seconds"] = round(stats["upload_seconds"], 3)
+    stats["download_seconds"] = round(stats["download_seconds"], 3)
+    stats["upload_mb_per_second"] = (
+        round(stats["upload_bytes"] / MB / stats["upload_seconds"], 2) if stats["upload_seconds"] else 0.0
+    )
+    stats["max_pool_connections"] = S3_MAX_POOL_CONNECTIONS
+    return stats
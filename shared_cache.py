@@ -0,0 +1,310 @@
+"""
+Shared (Cross-Process) Deck Cache
+
+Second cache tier behind the in-process deck cache. Serialized decks are
+stored in a Redis-protocol server so that every gunicorn worker and the
+separate slide_service / slide_edit_api processes can serve a deck without a
+MySQL round trip, and deck invalidations are broadcast over pub/sub so each
+process also drops its in-process copy.
+
+Configuration (environment variables):
+    DECK_SHARED_CACHE_URL  redis://host:6379/0 for Redis, memory:// for the
+                           in-process stand-in (tests / single process dev).
+                           Unset disables the shared tier.
+    DECK_SHARED_CACHE_TTL  Seconds a serialized deck lives in the shared tier
+                           (default 600)
+
+The redis package is only required when a redis:// URL is configured.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DECK_SHARED_CACHE_URL = os.getenv("DECK_SHARED_CACHE_URL", "")
+DECK_SHARED_CACHE_TTL = int(os.getenv("DECK_SHARED_CACHE_TTL", 600))
+
+KEY_PREFIX = "slidecraft:deck:"
+# Generation counters outlive any in-flight load by a wide margin, then expire.
+GENERATION_TTL = 86400
+INVALIDATION_CHANNEL = "slidecraft:deck:invalidate"
+
+
+class MemoryBackend:
+    """
+    In-process stand-in for Redis implementing the subset of operations the
+    shared cache needs. Coherent only within one process; meant for tests and
+    local development.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, tuple] = {}
+        self._counters: Dict[str, int] = {}
+        self._subscribers: List[Callable[[bytes], None]] = []
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._values[key]
+                return None
+            return entry[0]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key: str, ttl: int) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def set_if_counter(self, key: str, value: bytes, ttl: int, counter_key: str, expected: int) -> bool:
+        with self._lock:
+            if self._counters.get(counter_key, 0) != expected:
+                return False
+            self._values[key] = (value, time.monotonic() + ttl)
+            return True
+
+    def publish(self, channel: str, message: bytes) -> None:
+        for callback in list(self._subscribers):
+            callback(message)
+
+    def subscribe(self, channel: str, callback: Callable[[bytes], None]) -> None:
+        self._subscribers.append(callback)
+
+
+class RedisBackend:
+    """Redis (or fakeredis) implementation of the shared cache backend."""
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("redis is required for the shared deck cache. Install with: pip install redis")
+            client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self._client = client
+        self._pubsub_thread = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(key)
+
+    def get_counter(self, key: str) -> int:
+        value = self._client.get(key)
+        return int(value) if value else 0
+
+    def incr(self, key: str, ttl: int) -> int:
+        with self._client.pipeline() as pipe:
+            pipe.incr(key)
+            pipe.expire(key, ttl)
+            return pipe.execute()[0]
+
+    def set_if_counter(self, key: str, value: bytes, ttl: int, counter_key: str, expected: int) -> bool:
+        from redis.exceptions import WatchError
+
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(counter_key)
+                current = pipe.get(counter_key)
+                if (int(current) if current else 0) != expected:
+                    return False
+                pipe.multi()
+                pipe.set(key, value, ex=ttl)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def publish(self, channel: str, message: bytes) -> None:
+        self._client.publish(channel, message)
+
+    def subscribe(self, channel: str, callback: Callable[[bytes], None]) -> None:
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: lambda message: callback(message["data"])})
+        self._pubsub_thread = pubsub.run_in_thread(sleep_time=0.5, daemon=True)
+
+
+class SharedDeckCache:
+    """
+    Cross-process cache of ``(mindmap_json, slide_doc, updated_at)`` records.
+
+    Writers call :meth:`invalidate`, which bumps a per-deck generation
+    counter, deletes the serialized deck and broadcasts the request_id. Readers
+    only store a deck loaded from MySQL if the generation is unchanged since
+    before the load, so a slow reader can't resurrect a deck that was
+    overwritten meanwhile. Backend errors are logged and counted, never raised:
+    the database stays the source of truth.
+    """
+
+    def __init__(self, backend, ttl: int = DECK_SHARED_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str], None]] = []
+        self._subscribed = False
+        self._counts = {
+            "hits": 0, "misses": 0, "stores": 0, "stale_stores_skipped": 0,
+            "invalidations_sent": 0, "invalidations_received": 0, "errors": 0,
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    @staticmethod
+    def _data_key(request_id: str) -> str:
+        return f"{KEY_PREFIX}{request_id}"
+
+    @staticmethod
+    def _generation_key(request_id: str) -> str:
+        return f"{KEY_PREFIX}gen:{request_id}"
+
+    # --- serialization ---
+
+    @staticmethod
+    def _serialize(record) -> bytes:
+        mindmap_json, slide_doc, updated_at = record
+        return json.dumps({
+            "mindmap_json": mindmap_json,
+            "slide_json": slide_doc,
+            "updated_at": updated_at.isoformat() if isinstance(updated_at, datetime) else updated_at,
+        }).encode("utf-8")
+
+    @staticmethod
+    def _deserialize(raw: bytes):
+        data = json.loads(raw)
+        updated_at = data.get("updated_at")
+        if isinstance(updated_at, str):
+            updated_at = datetime.fromisoformat(updated_at)
+        return data.get("mindmap_json"), data.get("slide_json"), updated_at
+
+    # --- read path ---
+
+    def get(self, request_id: str):
+        # Whatever a caller copies from here into its local tier must be
+        # invalidated later, so listen before the first read
+        self._ensure_subscribed()
+        try:
+            raw = self.backend.get(self._data_key(request_id))
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Shared deck cache read failed for {request_id}: {e}")
+            return None
+        if raw is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return self._deserialize(raw)
+
+    def generation(self, request_id: str) -> Optional[int]:
+        try:
+            return self.backend.get_counter(self._generation_key(request_id))
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Shared deck cache generation read failed for {request_id}: {e}")
+            return None
+
+    def put(self, request_id: str, record, generation: Optional[int]) -> None:
+        if generation is None:
+            return
+        try:
+            stored = self.backend.set_if_counter(
+                self._data_key(request_id), self._serialize(record), self.ttl,
+                self._generation_key(request_id), generation
+            )
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Shared deck cache write failed for {request_id}: {e}")
+            return
+        self._count("stores" if stored else "stale_stores_skipped")
+
+    def get_or_load(self, request_id: str, loader: Callable[[], Any]):
+        record = self.get(request_id)
+        if record is not None:
+            return record
+        generation = self.generation(request_id)
+        record = loader()
+        if record is not None:
+            self.put(request_id, record, generation)
+        return record
+
+    # --- invalidation ---
+
+    def invalidate(self, request_id: str) -> None:
+        try:
+            self.backend.incr(self._generation_key(request_id), GENERATION_TTL)
+            self.backend.delete(self._data_key(request_id))
+            self.backend.publish(
+                INVALIDATION_CHANNEL,
+                json.dumps({"request_id": request_id, "origin": self.origin}).encode("utf-8")
+            )
+            self._count("invalidations_sent")
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"Shared deck cache invalidation failed for {request_id}: {e}")
+
+    def add_listener(self, callback: Callable[[str], None]) -> None:
+        """Register ``callback(request_id)`` for invalidations published by other processes."""
+        self._listeners.append(callback)
+
+    def _on_message(self, raw) -> None:
+        try:
+            message = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if message.get("origin") == self.origin:
+            return
+        self._count("invalidations_received")
+        for callback in list(self._listeners):
+            callback(message.get("request_id"))
+
+    def _ensure_subscribed(self) -> None:
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        try:
+            self.backend.subscribe(INVALIDATION_CHANNEL, self._on_message)
+        except Exception as e:
+            self._subscribed = False
+            self._count("errors")
+            logger.warning(f"Shared deck cache subscribe failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = round(counts["hits"] / lookups, 4) if lookups else 0.0
+        counts["backend"] = type(self.backend).__name__
+        counts["ttl_seconds"] = self.ttl
+        return counts
+
+
+def create_shared_cache(url: str = DECK_SHARED_CACHE_URL) -> Optional[SharedDeckCache]:
+    """Build the shared tier for ``url``; returns None when it is not configured."""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return SharedDeckCache(MemoryBackend())
+    return SharedDeckCache(RedisBackend(url))
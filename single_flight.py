@@ -0,0 +1,169 @@
+"""
+Cross-Node Single-Flight
+
+Makes sure only one worker, on any node, runs an expensive first-time
+computation for a key (e.g. generating a deck with GeneratePresentation)
+while concurrent requests for the same key wait for its result instead of
+repeating the work.
+
+The leader holds a MySQL named lock (GET_LOCK) for the key. The lock is
+taken on its own connection, closed when the leader finishes, so:
+- a lock can never leak into the connection pool
+- a crashed worker's lock is released by MySQL when its connection drops
+
+Within a process, a per-key lock lets only one thread contend for the MySQL
+lock. Followers poll ``is_done`` until the result is stored, or take over
+as leader if the previous leader went away without storing it.
+
+Usage:
+    from single_flight import SingleFlight
+
+    flight = SingleFlight(db_config, "deck")
+    with flight.lead(request_id, is_done=lambda: deck_exists(request_id)) as leader:
+        if leader:
+            generate_and_store(request_id)
+    # here the result is stored, by this request or another
+
+If GET_LOCK is unavailable (database unreachable), the in-process lock is
+still applied and a warning is logged.
+
+Configuration (environment variables):
+    SINGLE_FLIGHT_WAIT  Seconds a follower waits for the leader's result (default 300)
+    SINGLE_FLIGHT_POLL  Seconds between checks for the result (default 0.5)
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_WAIT = float(os.getenv("SINGLE_FLIGHT_WAIT", 300))
+SINGLE_FLIGHT_POLL = float(os.getenv("SINGLE_FLIGHT_POLL", 0.5))
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised when a follower's wait for the leader's result exceeds the wait limit."""
+
+
+class SingleFlight:
+    """One leader per key across processes (MySQL GET_LOCK) and threads (per-key lock)."""
+
+    def __init__(self, db_config: Dict[str, Any], namespace: str,
+                 wait: float = SINGLE_FLIGHT_WAIT, poll: float = SINGLE_FLIGHT_POLL):
+        self.db_config = db_config
+        self.namespace = namespace
+        self.wait = wait
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._local: Dict[str, list] = {}  # key -> [threading.Lock, users]
+        self._counts = {"leaders": 0, "followers": 0, "takeovers": 0, "timeouts": 0, "lock_errors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def lock_name(self, key: str) -> str:
+        # MySQL lock names are limited to 64 characters
+        return f"slidecraft:{self.namespace}:{key}"[:64]
+
+    @contextmanager
+    def _local_lock(self, key: str) -> Iterator[threading.Lock]:
+        with self._lock:
+            entry = self._local.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    self._local.pop(key, None)
+
+    def _try_db_lock(self, key: str):
+        """
+        ``(held, conn)``: whether this process now holds the MySQL lock, and
+        the connection holding it. ``(True, None)`` when GET_LOCK can't be used.
+        """
+        try:
+            conn = pymysql.connect(**self.db_config)
+        except Exception as e:
+            self._count("lock_errors")
+            logger.warning(f"Single-flight lock for {key} unavailable, locking in-process only: {e}")
+            return True, None
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (self.lock_name(key),))
+                row = cursor.fetchone()
+        except Exception as e:
+            conn.close()
+            self._count("lock_errors")
+            logger.warning(f"Single-flight lock for {key} unavailable, locking in-process only: {e}")
+            return True, None
+        if row and row[0] == 1:
+            return True, conn
+        conn.close()
+        return False, None
+
+    @staticmethod
+    def _release_db_lock(conn) -> None:
+        # Closing the session releases every lock it holds
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def lead(self, key: str, is_done: Callable[[], bool], wait: Optional[float] = None) -> Iterator[bool]:
+        """
+        Yield True if this caller should compute the result for ``key`` (it is
+        the only one doing so until the block exits), or False once
+        ``is_done()`` reports that another caller stored it. Raises
+        SingleFlightTimeout after ``wait`` seconds (default SINGLE_FLIGHT_WAIT).
+        """
+        deadline = time.monotonic() + (self.wait if wait is None else wait)
+        waited = False
+        with self._local_lock(key) as local:
+            while True:
+                if local.acquire(timeout=self.poll):
+                    try:
+                        held, conn = self._try_db_lock(key)
+                        if held:
+                            try:
+                                # The previous leader may have stored the result just now
+                                if is_done():
+                                    self._count("followers")
+                                    leader = False
+                                else:
+                                    self._count("takeovers" if waited else "leaders")
+                                    leader = True
+                                yield leader
+                                return
+                            finally:
+                                if conn is not None:
+                                    self._release_db_lock(conn)
+                    finally:
+                        local.release()
+                    # Another node leads: wait outside the local lock
+                    time.sleep(self.poll)
+
+                waited = True
+                if is_done():
+                    self._count("followers")
+                    yield False
+                    return
+                if time.monotonic() >= deadline:
+                    self._count("timeouts")
+                    raise SingleFlightTimeout(f"Timed out waiting for {self.namespace} {key}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counts)
+            stats["in_flight"] = len(self._local)
+        stats["namespace"] = self.namespace
+        return stats
@@ -11,6 +11,7 @@ from flask_cors import CORS  # Import CORS
 import configparser
 from flask import Flask, request, jsonify, Response
 import uuid
+import multiprocessing
 import json
 import pymysql
 import configparser
@@ -19,21 +20,33 @@ import json
 import logging
 import google.generativeai as genai
 import base64
-import boto3
 from google.generativeai import GenerativeModel
 from google.genai import types
 from PIL import Image
 from io import BytesIO
-from slide_service import generate_image_for_content, generate_all_images_for_presentation
+from slide_service import generate_image_for_content, progress_writer, image_cache, image_variants, image_events
 from slide_edit_api import edit_slide_function
+import deck_codec
+import s3_store
+from db_pool import connection as db_connection, pool_stats
+from rate_limit import rate_limit_stats, provider_stats
+from deck_store import (fetch_record, fetch_deck_cached, fetch_slide_cached, fetch_content_block, save_deck,
+                        save_slide, update_content_block, deck_cache, shared_deck_cache, DeckNotFoundError)
 from baml_client.sync_client import b
+from deck_sections import generate_slides
+from llm_cache import llm_cache
+from llm_metrics import llm_request, tracked, recorder as llm_calls
+from single_flight import SingleFlight, SingleFlightTimeout
 from functools import lru_cache
 import time
-from threading import Thread
+import copy
+from job_queue import create_job_queue, QUEUED, RUNNING
+from job_worker import GENERATE_ALL_IMAGES, JOB_QUEUE_EMBEDDED_WORKERS, start_workers
 import requests
 from urllib.parse import urlparse
 import mimetypes
 import tempfile
+import queue
 
 
 # Load environment variables
@@ -51,24 +64,22 @@ db_config = {
     "port": int(os.getenv("DB_PORT", 3306))
 }
 
-# AWS S3 Setup from environment variables
+# Durable queue for image generation; run more workers with `python job_worker.py`
+image_jobs = create_job_queue(db_config)
+# Pool processes (image_variants) re-import the main script: only the app process runs jobs
+if JOB_QUEUE_EMBEDDED_WORKERS > 0 and multiprocessing.current_process().name == "MainProcess":
+    start_workers(image_jobs, JOB_QUEUE_EMBEDDED_WORKERS)
+
+# First-time deck generation runs once per deck across all workers and nodes
+deck_generation = SingleFlight(db_config, "deck")
+
+# Image progress stream: seconds before an idle stream is closed, and between keep-alives
+IMAGE_STREAM_TIMEOUT = int(os.getenv("IMAGE_STREAM_TIMEOUT", 900))
+IMAGE_STREAM_KEEPALIVE = 15
+
+# S3 buckets; every upload goes through the shared client in s3_store.py
 BUCKET_NAME = os.getenv("AWS_S3_BUCKET_MEETINGS")
 BASE_URL = os.getenv("AWS_S3_BASE_URL")
-ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
-SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION")
-
-# S3 Configuration from environment variables
-S3_BUCKET_NAME = os.getenv("AWS_S3_BUCKET_NAME")
-S3_REGION = os.getenv("AWS_REGION")
-
-# Initialize S3 client with environment variables
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION")
-)
 
 
 
@@ -86,11 +97,12 @@ CORS(app)  # 🔥 This allows all origins by default
 
 
 def stream_headers():
+    # Connection / Transfer-Encoding are hop-by-hop: WSGI apps must leave them to
+    # the server, which chunks the streamed body itself.
     return {
         "Content-Type": "text/event-stream",
         "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "Transfer-Encoding": "chunked",
+        "X-Accel-Buffering": "no",  # nginx: don't buffer the stream
     }
 
 
@@ -121,16 +133,13 @@ def initiate_slide_stream():
 
     request_id = str(uuid.uuid4())
 
-    conn = pymysql.connect(**db_config)
-    try:
+    with db_connection(db_config) as conn:
         with conn.cursor() as cursor:
             cursor.execute(
                 "INSERT INTO slide_requests (id, user_id, mindmap_json) VALUES (%s, %s, %s)",
-                (request_id, None, json.dumps(data))
+                (request_id, None, deck_codec.encode(json.dumps(data)))
             )
         conn.commit()
-    finally:
-        conn.close()
 
     return jsonify({"request_id": request_id}), 200
 
@@ -410,22 +419,9 @@ This input includes the "theme" property. Adjust your styles accordingly.
         raise ValueError(f"Gemini output not valid JSON: {e}\nRaw:\n{cleaned}")
 
 
-# Initialize S3 client using environment variables
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY,
-    region_name=AWS_REGION,
-)
-
-# Setup AWS S3 client
-
-
 def upload_image_to_s3(image_data: bytes, filename: str) -> str:
     s3_key = f"slides/{filename}.png"
-    s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key,
-                         Body=image_data, ContentType='image/png')
-    return f"{BASE_URL}{s3_key}"
+    return s3_store.upload_bytes(image_data, s3_key, 'image/png', bucket=BUCKET_NAME, base_url=BASE_URL)
 
 
 def generate_image_from_prompt(prompt: str) -> bytes:
@@ -461,13 +457,12 @@ def update_slide_json_with_generated_images(slide_json: dict) -> dict:
 # --- DB fetch logic ---
 def fetch_mindmap_by_request_id(request_id, db_config):
     try:
-        conn = pymysql.connect(**db_config)
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT mindmap_json FROM slide_requests WHERE id = %s", (request_id,))
-            result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+        with db_connection(db_config) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT mindmap_json FROM slide_requests WHERE id = %s", (request_id,))
+                result = cursor.fetchone()
+        return deck_codec.decode(result[0]) if result else None
     except Exception as e:
         raise e
 
@@ -475,64 +470,24 @@ def fetch_mindmap_by_request_id(request_id, db_config):
 
 
 def fetch_request_record(request_id):
-    conn = pymysql.connect(**db_config)
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT mindmap_json, slide_json, updated_at FROM slide_requests WHERE id = %s",
-                (request_id,)
-            )
-            row = cursor.fetchone()
-    finally:
-        conn.close()
-    return row  # (mindmap_json, slide_json, updated_at)
+    return fetch_record(db_config, request_id)  # (mindmap_json, slide_json, updated_at)
 
 
 def fetch_slide_json(request_id):
-    conn = pymysql.connect(**db_config)
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT slide_json FROM slide_requests WHERE id = %s",
-                (request_id,)
-            )
-            row = cursor.fetchone()
-            return json.loads(row["slide_json"]) if row and row.get("slide_json") else None
-    finally:
-        conn.close()
+    record = fetch_record(db_config, request_id)
+    return json.loads(record[1]) if record and record[1] else None
 
 
 def update_slide_record(request_id, updated_slide_json):
-    conn = pymysql.connect(**db_config)
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                UPDATE slide_requests
-                   SET slide_json = %s
-                     , updated_at = NOW()
-                 WHERE id = %s
-                """,
-                (updated_slide_json, request_id)
-            )
-        conn.commit()
-    finally:
-        conn.close()
+    if isinstance(updated_slide_json, str):
+        updated_slide_json = json.loads(updated_slide_json)
+    save_deck(db_config, request_id, updated_slide_json)
 
 # Helper to update slide_json and updated_at
 
 
 def store_slide_json(request_id, slide_json):
-    conn = pymysql.connect(**db_config)
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "UPDATE slide_requests SET slide_json = %s WHERE id = %s",
-                (json.dumps(slide_json), request_id)
-            )
-        conn.commit()
-    finally:
-        conn.close()
+    save_deck(db_config, request_id, slide_json)
 
 
 
@@ -597,27 +552,13 @@ def get_slide_content():
         if not (request_id and slide_id and content_id):
             return jsonify({"error": "Missing one or more required fields"}), 400
 
-        # Fetch record from DB
-        record = fetch_request_record(request_id)
-        if not record:
+        # Fetch only the target content block (projected server-side unless the deck is cached)
+        try:
+            slide_found, target_content = fetch_content_block(db_config, request_id, slide_id, content_id)
+        except DeckNotFoundError:
             return jsonify({"error": "No record found for this request ID"}), 404
-
-        mindmap_json, slide_json_str, updated_at = record
-
-        # Parse slide JSON
-        slide_json = json.loads(slide_json_str)
-        slides = slide_json.get("slides", [])
-
-        # Find the target slide
-        target_slide = next(
-            (s for s in slides if s.get("slide_id") == slide_id), None)
-        if not target_slide:
+        if not slide_found:
             return jsonify({"error": "Slide not found"}), 404
-
-        # Find the target content
-        content_items = target_slide.get("content", [])
-        target_content = next(
-            (c for c in content_items if c.get("id") == content_id), None)
         if not target_content:
             return jsonify({"error": "Content not found"}), 404
 
@@ -633,10 +574,12 @@ def get_slide_content():
 def image_endpoint():
     data = request.get_json() or {}
     try:
+        # An explicit request for this block's image: always a new one
         updated_block = generate_image_for_content(
             data["request_id"],
             data["slide_id"],
-            data["content_id"]
+            data["content_id"],
+            bypass_cache=True
         )
         return jsonify({"data": updated_block}), 200
 
@@ -653,6 +596,26 @@ def hello():
     return "Hello, this is the LangChain Google Gemini 1.5 Flash API for generating slides!"
 
 
+@app.route("/api/v1/metrics", methods=["GET"])
+def metrics():
+    """Runtime metrics for the shared infrastructure used by this process."""
+    return jsonify({
+        "db_pools": pool_stats(),
+        "deck_cache": deck_cache.stats(),
+        "shared_deck_cache": shared_deck_cache.stats() if shared_deck_cache else None,
+        "deck_write_behind": progress_writer.stats(),
+        "rate_limits": rate_limit_stats(),
+        "providers": provider_stats(),
+        "image_cache": image_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm": llm_calls.stats(),
+        "deck_generation": deck_generation.stats(),
+        "image_variants": image_variants.stats(),
+        "image_events": image_events.stats(),
+        "s3": s3_store.stats()
+    }), 200
+
+
 @app.route("/api/v1/slides/content/edit-text", methods=["POST"])
 def edit_slide_content2():
     """
@@ -670,19 +633,15 @@ def edit_slide_content2():
         if not (request_id and slide_id and new_prompt):
             return jsonify({"error": "Missing required fields"}), 400
 
-        # Fetch from DB
-        record = fetch_request_record(request_id)
-        if not record:
+        # Fetch only the target slide (served from the deck cache when hot)
+        try:
+            target_slide = fetch_slide_cached(db_config, request_id, slide_id)
+        except DeckNotFoundError:
             return jsonify({"error": "No record found for this request ID"}), 404
 
-        mindmap_json, slide_json_str, updated_at = record
-        slide_json = json.loads(slide_json_str)
-        slides = slide_json.get("slides", [])
-        target_slide = next(
-            (s for s in slides if s.get("slide_id") == slide_id), None)
-
         if not target_slide:
             return jsonify({"error": "Slide not found"}), 404
+        base_slide = copy.deepcopy(target_slide)
 
         content_items = target_slide.get("content", [])
         content_type = target_slide.get("type")
@@ -695,25 +654,7 @@ def edit_slide_content2():
             if not (request_id and slide_id and content_id and new_prompt):
                 return jsonify({"error": "Missing one or more required fields"}), 400
 
-            # Fetch record from DB
-            record = fetch_request_record(request_id)
-            if not record:
-                return jsonify({"error": "No record found for this request ID"}), 404
-
-            mindmap_json, slide_json_str, updated_at = record
-
-            # Parse slide JSON
-            slide_json = json.loads(slide_json_str)
-            slides = slide_json.get("slides", [])
-
-            # Find the target slide
-            target_slide = next(
-                (s for s in slides if s.get("slide_id") == slide_id), None)
-            if not target_slide:
-                return jsonify({"error": "Slide not found"}), 404
-
             # Find the target content
-            content_items = target_slide.get("content", [])
             target_content = next(
                 (c for c in content_items if c.get("id") == content_id), None)
             if not target_content:
@@ -756,12 +697,8 @@ def edit_slide_content2():
             logger.info(
                 f"Updated content for {content_id} from: '{old_content}' to: '{new_text}'")
 
-            # Update the content with new text
-            target_content["html"] = new_text
-
-            # Update the slide JSON in the database
-            updated_slide_json = json.dumps(slide_json)
-            update_slide_record(request_id, updated_slide_json)
+            # Persist only the edited block
+            target_content = update_content_block(db_config, request_id, slide_id, content_id, {"html": new_text})
 
             return jsonify({
                 "message": "Content updated successfully",
@@ -769,25 +706,13 @@ def edit_slide_content2():
             }), 200
 
         else:
-            target_slide = next(
-                (s for s in slides if s.get("slide_id") == slide_id), None)
-            if not target_slide:
-                return jsonify({"error": "Slide not found"}), 404
-
             # Edit the slide using the edit_slide_function
             response = edit_slide_function(target_slide, new_prompt)
             new_updated_slide = response.get("editedSlide", {})
             print(f"New updated slide: {new_updated_slide}")
 
-            # Find and update the slide in the slides array
-            for i, slide in enumerate(slides):
-                if slide.get("slide_id") == slide_id:
-                    slides[i] = new_updated_slide
-                    break
-
-            # Update the slide JSON in the database
-            updated_slide_json = json.dumps(slide_json)
-            update_slide_record(request_id, updated_slide_json)
+            # Persist only the edited slide
+            save_slide(db_config, request_id, slide_id, new_updated_slide, base=base_slide)
 
             logger.info(f"Updated entire slide {slide_id} with new content based on prompt: {new_prompt}")
 
@@ -807,31 +732,118 @@ def edit_slide_content2():
 
 
 def fetch_request_record_cached(request_id):
-    return fetch_request_record(request_id)
+    # (mindmap_json, parsed slide_json or None, updated_at) from the in-process
+    # deck cache; shared objects, do not mutate.
+    return fetch_deck_cached(db_config, request_id)
+
+
+def presentation_input_from(input_data):
+    """BAML PresentationInput for a stored mind map; raises ValueError/TypeError on non-integer ids."""
+    return {
+        "id": int(input_data.get('id', 0)),
+        "title": input_data.get('title', ''),
+        "outline": [{
+            "id": int(section.get('id', 0)),
+            "title": section.get('title', ''),
+            "points": section.get('points', [])
+        } for section in input_data.get('outline', [])]
+    }
+
+
+def slide_to_dict(slide):
+    """JSON form of a generated SlideContent (final or a completed partial)."""
+    content = []
+    for element in slide.content:
+        element_dict = {
+            "id": getattr(element, 'id', None),
+            "type": None,
+            "x": getattr(element, 'x', 0),
+            "y": getattr(element, 'y', 0),
+            "width": getattr(element, 'width', 0),
+            "height": getattr(element, 'height', 0)
+        }
+
+        if hasattr(element, 'html'):
+            element_dict.update({"type": "html", "html": element.html})
+        elif hasattr(element, 'content'):
+            style = {}
+            if hasattr(element, 'style'):
+                style = {k: v for k, v in {
+                    "font_family": getattr(element.style, 'font_family', None),
+                    "font_size": getattr(element.style, 'font_size', None),
+                    "color": getattr(element.style, 'color', None),
+                    "line_height": getattr(element.style, 'line_height', None),
+                    "alignment": getattr(element.style, 'alignment', None)
+                }.items() if v is not None}
+            element_dict.update({
+                "type": "text",
+                "content": element.content,
+                **({"style": style} if style else {})
+            })
+        elif hasattr(element, 'src'):
+            style = {}
+            if hasattr(element, 'style'):
+                style = {k: v for k, v in {
+                    "border_radius": getattr(element.style, 'border_radius', None),
+                    "object_fit": getattr(element.style, 'object_fit', None),
+                    "border": getattr(element.style, 'border', None),
+                    "shadow": getattr(element.style, 'shadow', None)
+                }.items() if v is not None}
+            element_dict.update({
+                "type": "image",
+                "src": element.src,
+                "alt_text": getattr(element, 'alt_text', ''),
+                "caption": getattr(element, 'caption', ''),
+                "prompt": getattr(element, 'prompt', ''),
+                **({"style": style} if style else {})
+            })
+
+        # Only add non-None values
+        content.append(
+            {k: v for k, v in element_dict.items() if v is not None})
+
+    slide_dict = {
+        "slide_id": slide.slide_id,
+        "background": slide.background
+    }
+    if content:
+        slide_dict["content"] = content
+    return slide_dict
 
 
 @app.route('/api/v1/slides/generate', methods=['GET'])
 def generate_presentation():
+    """
+    Slides for a stored mind map, generated on first request and cached after.
+    With ``stream=true`` the slides are sent as Server-Sent Events instead,
+    each one as soon as the model has finished it (see stream_presentation).
+    """
     try:
         request_id = request.args.get("id")
         if not request_id:
             return jsonify({"error": "Missing request ID"}), 400
 
         # Get from DB with caching
-        record = fetch_request_record(request_id)
+        record = fetch_request_record_cached(request_id)
         if not record:
             return jsonify({"error": "No record found"}), 404
 
         input_data, cached_slides, updated_at = record
+        # A deck still being streamed (or whose stream was abandoned) is not complete
+        if cached_slides and cached_slides.get("generating"):
+            cached_slides = None
+
+        if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+            return Response(stream_presentation(request_id, input_data, cached_slides, updated_at),
+                            headers=stream_headers())
 
         # Return cached slides if available
         if cached_slides:
-            data = json.loads(cached_slides)
             return Response(
                 json.dumps({
                     "cached": True,
                     "last_updated": updated_at.strftime("%Y-%m-%d %H:%M:%S") if updated_at else None,
-                    "data": data
+                    "data": cached_slides
                 }, indent=2),
                 mimetype="application/json"
             )
@@ -842,107 +854,41 @@ def generate_presentation():
 
         # Structure for BAML - ensure proper type conversion
         try:
-            presentation_input = {
-                "id": int(input_data.get('id', 0)),
-                "title": input_data.get('title', ''),
-                "outline": [{
-                    "id": int(section.get('id', 0)),
-                    "title": section.get('title', ''),
-                    "points": section.get('points', [])
-                } for section in input_data.get('outline', [])]
-            }
+            presentation_input = presentation_input_from(input_data)
         except (ValueError, TypeError) as e:
             return jsonify({"error": f"Invalid data format - could not convert IDs to integers: {str(e)}"}), 400
 
-        # Generate presentation
-        slides = b.GeneratePresentation(presentation_input)
-
-        # Convert to JSON format efficiently
-        slides_json = []
-        for slide in slides:
-            content = []
-            for element in slide.content:
-                element_dict = {
-                    "id": getattr(element, 'id', None),
-                    "type": None,
-                    "x": getattr(element, 'x', 0),
-                    "y": getattr(element, 'y', 0),
-                    "width": getattr(element, 'width', 0),
-                    "height": getattr(element, 'height', 0)
-                }
+        # One worker generates a new deck; concurrent requests (any node) wait for it
+        ready = {}
+        try:
+            with deck_generation.lead(request_id, is_done=lambda: _completed_deck(request_id, ready)) as leader:
+                if leader:
+                    with llm_request(request_id):
+                        slides = generate_slides(presentation_input)
 
-                if hasattr(element, 'html'):
-                    element_dict.update({"type": "html", "html": element.html})
-                elif hasattr(element, 'content'):
-                    style = {}
-                    if hasattr(element, 'style'):
-                        style = {k: v for k, v in {
-                            "font_family": getattr(element.style, 'font_family', None),
-                            "font_size": getattr(element.style, 'font_size', None),
-                            "color": getattr(element.style, 'color', None),
-                            "line_height": getattr(element.style, 'line_height', None),
-                            "alignment": getattr(element.style, 'alignment', None)
-                        }.items() if v is not None}
-                    element_dict.update({
-                        "type": "text",
-                        "content": element.content,
-                        **({"style": style} if style else {})
-                    })
-                elif hasattr(element, 'src'):
-                    style = {}
-                    if hasattr(element, 'style'):
-                        style = {k: v for k, v in {
-                            "border_radius": getattr(element.style, 'border_radius', None),
-                            "object_fit": getattr(element.style, 'object_fit', None),
-                            "border": getattr(element.style, 'border', None),
-                            "shadow": getattr(element.style, 'shadow', None)
-                        }.items() if v is not None}
-                    element_dict.update({
-                        "type": "image",
-                        "src": element.src,
-                        "alt_text": getattr(element, 'alt_text', ''),
-                        "caption": getattr(element, 'caption', ''),
-                        "prompt": getattr(element, 'prompt', ''),
-                        **({"style": style} if style else {})
-                    })
-
-                # Only add non-None values
-                content.append(
-                    {k: v for k, v in element_dict.items() if v is not None})
-
-            slide_dict = {
-                "slide_id": slide.slide_id,
-                "background": slide.background
-            }
-            if content:
-                slide_dict["content"] = content
-            slides_json.append(slide_dict)
+                    # Convert to JSON format efficiently
+                    slides_json = [slide_to_dict(slide) for slide in slides]
 
-        response_data = {"slides": slides_json}
+                    response_data = {"slides": slides_json}
 
-        # Store in DB asynchronously
-        store_slide_json(request_id, response_data)
-        
-        # Generate images for the presentation
-        # image_response = generate_all_images_for_presentation(request_id)
-            # Fire-and-forget async processing
-        thread = Thread(target=generate_all_images_for_presentation,
-                        args=(request_id,))
-        thread.start()
-        # Get the updated record from DB after storing
-        # updated_record = fetch_request_record(request_id)
-        # if updated_record:
-        #     input_data, updated_slides, updated_at = updated_record
-        #     if updated_slides:
-        #         data = json.loads(updated_slides)
-        #         return Response(
-        #             json.dumps({
-        #                 "cached": False,
-        #                 "last_updated": updated_at.strftime("%Y-%m-%d %H:%M:%S") if updated_at else None,
-        #                 "data": data
-        #             }, indent=2),
-        #             mimetype="application/json"
-        #         )
+                    # Store in DB asynchronously
+                    store_slide_json(request_id, response_data)
+
+                    # Generate images for the presentation
+                    queue_image_generation(request_id)
+        except SingleFlightTimeout:
+            return jsonify({"error": "Slides for this request are still being generated, retry later"}), 503
+
+        if not leader:
+            _, slides_doc, updated_at = ready["record"]
+            return Response(
+                json.dumps({
+                    "cached": True,
+                    "last_updated": updated_at.strftime("%Y-%m-%d %H:%M:%S") if updated_at else None,
+                    "data": slides_doc
+                }, indent=2),
+                mimetype="application/json"
+            )
 
         # Fallback response if DB update failed
         return Response(
@@ -950,7 +896,6 @@ def generate_presentation():
                 "cached": False,
                 "last_updated": None,
                 "data": response_data,
-                # "images": image_response
             }, indent=2),
             mimetype="application/json"
         )
@@ -958,9 +903,225 @@ def generate_presentation():
     except Exception as e:
         logger.error(f"Error in generate_presentation: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    
 
 
+def _completed_deck(request_id, ready):
+    """
+    Whether another request has stored the finished deck; if so its
+    ``(mindmap_json, slides, updated_at)`` is put in ``ready["record"]``.
+    Reads the database directly, not the deck caches, which may predate it.
+    """
+    record = fetch_request_record(request_id)
+    if not record or not record[1]:
+        return False
+    slides_doc = json.loads(record[1]) if isinstance(record[1], str) else record[1]
+    if not slides_doc or slides_doc.get("generating"):
+        return False
+    ready["record"] = (record[0], slides_doc, record[2])
+    return True
+
+
+def _replay_slides(request_id, slides_doc, updated_at):
+    for index, slide in enumerate(slides_doc.get("slides", [])):
+        yield sse_event("slide", {"index": index, "slide": slide})
+    yield sse_event("done", {
+        "request_id": request_id,
+        "cached": True,
+        "last_updated": updated_at.strftime("%Y-%m-%d %H:%M:%S") if updated_at else None,
+        "slide_count": len(slides_doc.get("slides", [])),
+    })
+
+
+def stream_presentation(request_id, input_data, cached_slides, updated_at):
+    """
+    SSE body of GET /api/v1/slides/generate?stream=true: one ``slide`` event
+    ({index, slide}) per slide, then ``done``. Slides come from the cache when
+    the deck exists; otherwise from the BAML stream, where a slide counts as
+    finished once the model has started the next one. Each finished slide is
+    saved with the deck marked ``generating`` until the final response, which
+    re-sends any slide whose final form differs from what was streamed.
+    While another request generates the deck, this one sends keep-alives and
+    then replays the stored deck.
+    """
+    if cached_slides:
+        yield from _replay_slides(request_id, cached_slides, updated_at)
+        return
+
+    try:
+        if isinstance(input_data, str):
+            input_data = json.loads(input_data)
+        presentation_input = presentation_input_from(input_data)
+    except (ValueError, TypeError) as e:
+        yield sse_event("error", {"error": f"Invalid data format - could not convert IDs to integers: {str(e)}"})
+        return
+
+    deadline = time.monotonic() + deck_generation.wait
+    ready = {}
+    while True:
+        try:
+            with deck_generation.lead(request_id, is_done=lambda: _completed_deck(request_id, ready),
+                                      wait=IMAGE_STREAM_KEEPALIVE) as leader:
+                if leader:
+                    yield from _stream_generated_slides(request_id, presentation_input)
+                    return
+            _, slides_doc, updated_at = ready["record"]
+            yield from _replay_slides(request_id, slides_doc, updated_at)
+            return
+        except SingleFlightTimeout:
+            if time.monotonic() >= deadline:
+                yield sse_event("error", {"error": "Slides for this request are still being generated, retry later"})
+                return
+            yield ": keep-alive\n\n"
+
+
+def _stream_generated_slides(request_id, presentation_input):
+    started = time.monotonic()
+    sent = []
+    try:
+        with llm_request(request_id), tracked("GeneratePresentation") as options:
+            stream = b.stream.GeneratePresentation(presentation_input, baml_options=options)
+            for partial in stream:
+                # Every slide but the last one in a partial response is complete
+                while len(partial or []) > len(sent) + 1:
+                    slide = slide_to_dict(partial[len(sent)])
+                    if not sent:
+                        logger.info(f"First slide of {request_id} after {time.monotonic() - started:.1f}s")
+                    sent.append(slide)
+                    store_slide_json(request_id, {"slides": sent, "generating": True})
+                    yield sse_event("slide", {"index": len(sent) - 1, "slide": slide})
+
+            slides_json = [slide_to_dict(slide) for slide in stream.get_final_response()]
+    except Exception as e:
+        logger.error(f"Error streaming presentation {request_id}: {str(e)}")
+        yield sse_event("error", {"error": str(e)})
+        return
+
+    for index, slide in enumerate(slides_json):
+        if index >= len(sent) or sent[index] != slide:
+            yield sse_event("slide", {"index": index, "slide": slide})
+
+    store_slide_json(request_id, {"slides": slides_json})
+    queue_image_generation(request_id)
+    logger.info(f"Streamed {len(slides_json)} slides of {request_id} in {time.monotonic() - started:.1f}s")
+    yield sse_event("done", {"request_id": request_id, "cached": False, "last_updated": None,
+                             "slide_count": len(slides_json)})
+
+
+def queue_image_generation(request_id, visible_slides=None):
+    """
+    Start image generation for a deck, or attach to the run already queued or
+    in progress for it. ``visible_slides`` (slide_ids) get their images first;
+    when attaching, the running generation is re-prioritized.
+    Returns ``(job, created)``; job is None if it could not be queued.
+    """
+    try:
+        job, created = image_jobs.enqueue_once(
+            GENERATE_ALL_IMAGES, request_id, {"visible_slides": visible_slides} if visible_slides else None
+        )
+    except Exception as e:
+        logger.error(f"Could not queue image generation for {request_id}: {str(e)}")
+        return None, False
+    if visible_slides and not created:
+        image_events.publish(request_id, {"type": "priority", "slide_ids": visible_slides})
+    return job, created
+
+
+def cancel_image_generation(request_id):
+    """Cancel queued or running image generation for a deck; returns the number of jobs cancelled."""
+    try:
+        cancelled = image_jobs.cancel(GENERATE_ALL_IMAGES, request_id)
+    except Exception as e:
+        logger.error(f"Could not cancel image generation for {request_id}: {str(e)}")
+        cancelled = 0
+    # Stops a running generation right away instead of at its next heartbeat
+    image_events.publish(request_id, {"type": "cancel"})
+    # Images of a run in this process that are not written yet never will be;
+    # runs elsewhere are stopped by the deck revision check on their writes
+    progress_writer.discard(request_id)
+    return cancelled
+
+
+@app.route("/api/v1/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id):
+    job = image_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"data": job}), 200
+
+
+@app.route("/api/v1/jobs", methods=["GET"])
+def list_jobs():
+    request_id = request.args.get("request_id")
+    if not request_id:
+        return jsonify({"error": "Missing request_id"}), 400
+    return jsonify({"data": image_jobs.jobs_for_request(request_id)}), 200
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _created_images(slide_doc):
+    images = []
+    for slide in (slide_doc or {}).get("slides", []):
+        for content in slide.get("content", []):
+            if content.get("type") == "image" and content.get("is_image_created"):
+                images.append({
+                    "slide_id": slide.get("slide_id"),
+                    "content_id": content.get("id"),
+                    **{field: content[field] for field in ("src", "srcset", "thumbnail") if field in content}
+                })
+    return images
+
+
+@app.route("/api/v1/slides/images/stream", methods=["GET"])
+def stream_image_progress():
+    """
+    Server-Sent Events for a deck's image generation:
+    ``snapshot`` with the images already created, one ``image`` event per
+    completed or failed block (slide_id, content_id, src / error), and a final
+    ``summary``, after which the stream closes. If no generation is queued or
+    running, the snapshot is followed by a summary straight away.
+    """
+    request_id = request.args.get("id")
+    if not request_id:
+        return jsonify({"error": "Missing request ID"}), 400
+    if not fetch_deck_cached(db_config, request_id):
+        return jsonify({"error": "No record found"}), 404
+
+    def events():
+        # Subscribe before reading the snapshot so nothing falls between the two
+        with image_events.listen(request_id) as pending:
+            record = fetch_deck_cached(db_config, request_id)
+            yield sse_event("snapshot", {"request_id": request_id, "images": _created_images(record[1] if record else None)})
+
+            jobs = image_jobs.jobs_for_request(request_id, limit=1)
+            job = jobs[0] if jobs else None
+            if not job or job["status"] not in (QUEUED, RUNNING):
+                yield sse_event("summary", {
+                    "type": "summary",
+                    "request_id": request_id,
+                    "job_id": job["id"] if job else None,
+                    "status": job["status"] if job else None,
+                    **((job or {}).get("result") or {}),
+                })
+                return
+
+            deadline = time.monotonic() + IMAGE_STREAM_TIMEOUT
+            while time.monotonic() < deadline:
+                try:
+                    event = pending.get(timeout=IMAGE_STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event.get("type") == "summary":
+                    yield sse_event("summary", {"request_id": request_id, "job_id": job["id"], **event})
+                    return
+                if event.get("type") == "image":
+                    yield sse_event("image", event)
+            yield sse_event("timeout", {"request_id": request_id})
+
+    return Response(events(), headers=stream_headers())
 
 
 @app.route("/api/v1/slides/generate-all-images", methods=["POST"])
@@ -970,14 +1131,39 @@ def generate_all_images():
     if not request_id:
         return jsonify({"error": "Missing request ID"}), 400
 
-    # Fire-and-forget async processing
-    thread = Thread(target=generate_all_images_for_presentation,
-                    args=(request_id,))
-    thread.start()
-    
-    
+    # Durable background processing; repeat triggers attach to the running job
+    job, created = queue_image_generation(request_id, data.get("visible_slide_ids"))
+    if job is None:
+        return jsonify({"error": "Could not queue image generation"}), 503
+
+    return jsonify({
+        "success": True,
+        "message": "Image generation started" if created else "Image generation already in progress",
+        "job_id": job["id"],
+        "attached": not created,
+        "data": job
+    }), 202
+
 
-    return jsonify({"success": True, "message": "Image generation started","data": generate_all_images_for_presentation(request_id)}), 202
+@app.route("/api/v1/slides/images/priority", methods=["POST"])
+def prioritize_images():
+    """Generate images for the given slides (e.g. those on screen) before the rest."""
+    data = request.get_json() or {}
+    request_id = data.get("request_id")
+    slide_ids = data.get("slide_ids")
+    if not request_id or not isinstance(slide_ids, list):
+        return jsonify({"error": "Missing request_id or slide_ids"}), 400
+    image_events.publish(request_id, {"type": "priority", "slide_ids": slide_ids})
+    return jsonify({"success": True}), 202
+
+
+@app.route("/api/v1/slides/images/cancel", methods=["POST"])
+def cancel_images():
+    data = request.get_json() or {}
+    request_id = data.get("request_id")
+    if not request_id:
+        return jsonify({"error": "Missing request ID"}), 400
+    return jsonify({"success": True, "cancelled_jobs": cancel_image_generation(request_id)}), 200
 
 
 @app.route("/api/v1/slides/slide-data", methods=["POST"])
@@ -1029,80 +1215,20 @@ def getSlideData():
     except (ValueError, TypeError) as e:
         return jsonify({"error": f"Invalid data format - could not convert IDs to integers: {str(e)}"}), 400
 
-    # Generate presentation
-    slides = b.GeneratePresentation(presentation_input)
-
-    # Convert to JSON format efficiently (same logic as in generate_presentation route)
-    slides_json = []
-    for slide in slides:
-        content = []
-        for element in slide.content:
-            element_dict = {
-                "id": getattr(element, 'id', None),
-                "type": None,
-                "x": getattr(element, 'x', 0),
-                "y": getattr(element, 'y', 0),
-                "width": getattr(element, 'width', 0),
-                "height": getattr(element, 'height', 0)
-            }
+    # Regenerate: always call the model, even for inputs seen before
+    with llm_request(request_id):
+        slides = generate_slides(presentation_input, bypass_cache=True)
 
-            if hasattr(element, 'html'):
-                element_dict.update({"type": "html", "html": element.html})
-            elif hasattr(element, 'content'):
-                style = {}
-                if hasattr(element, 'style'):
-                    style = {k: v for k, v in {
-                        "font_family": getattr(element.style, 'font_family', None),
-                        "font_size": getattr(element.style, 'font_size', None),
-                        "color": getattr(element.style, 'color', None),
-                        "line_height": getattr(element.style, 'line_height', None),
-                        "alignment": getattr(element.style, 'alignment', None)
-                    }.items() if v is not None}
-                element_dict.update({
-                    "type": "text",
-                    "content": element.content,
-                    **({"style": style} if style else {})
-                })
-            elif hasattr(element, 'src'):
-                style = {}
-                if hasattr(element, 'style'):
-                    style = {k: v for k, v in {
-                        "border_radius": getattr(element.style, 'border_radius', None),
-                        "object_fit": getattr(element.style, 'object_fit', None),
-                        "border": getattr(element.style, 'border', None),
-                        "shadow": getattr(element.style, 'shadow', None)
-                    }.items() if v is not None}
-                element_dict.update({
-                    "type": "image",
-                    "src": element.src,
-                    "alt_text": getattr(element, 'alt_text', ''),
-                    "caption": getattr(element, 'caption', ''),
-                    "prompt": getattr(element, 'prompt', ''),
-                    **({"style": style} if style else {})
-                })
+    slides_json = [slide_to_dict(slide) for slide in slides]
+    response_data = {"slides": slides_json}
 
-            # Only add non-None values
-            content.append(
-                {k: v for k, v in element_dict.items() if v is not None})
+    # The deck is replaced: stop generating images for the old one
+    cancel_image_generation(request_id)
 
-        slide_dict = {
-            "slide_id": slide.slide_id,
-            "background": slide.background
-        }
-        if content:
-            slide_dict["content"] = content
-        slides_json.append(slide_dict)
-        
-        
-        response_data = {"slides": slides_json}
+    # Store in DB asynchronously
+    store_slide_json(request_id, response_data)
 
-        # Store in DB asynchronously
-        store_slide_json(request_id, response_data)
-        
-        
-        thread = Thread(target=generate_all_images_for_presentation,
-                        args=(request_id,))
-        thread.start()
+    queue_image_generation(request_id)
 
     return jsonify({"data": {"slides": slides_json}}), 200
 
@@ -1251,17 +1377,8 @@ def upload_file():
         try:
             s3_key = f"uploads/{filename}"
             
-            # Use the existing S3 client (s3) defined earlier in the file
-            s3.put_object(
-                Bucket=S3_BUCKET_NAME,
-                Key=s3_key,
-                Body=file_data,
-                ContentType=content_type,
-                # Remove ACL to avoid access denied errors
-            )
-            
-            # Construct the public URL
-            file_url = f"https://s3.{AWS_REGION}.amazonaws.com/{S3_BUCKET_NAME}/{s3_key}"
+            # Multipart above S3_MULTIPART_THRESHOLD_MB (no ACL to avoid access denied errors)
+            file_url = s3_store.upload_bytes(file_data, s3_key, content_type)
             
             # Get file type from filename
             file_type = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'unknown'
@@ -23,7 +23,7 @@ import json
 
 # Import BAML client
 try:
-    from baml_client import b
+    from llm_cache import b
 except ImportError as e:
     print(f"Error importing BAML client: {e}")
     print("Make sure you have run 'pip install baml-py' and generated the BAML client")
@@ -273,8 +273,8 @@ def edit_slide_function(slide_data, edit_prompt, theme="light"):
         logger.info(f"Processing slide edit request for slide_id: {normalized_slide_data['slide_id']}")
         logger.info(f"Edit prompt: {edit_prompt}")
         
-        # Call BAML function
-        result = b.EditSlide(slide_edit_request)
+        # Call BAML function (a repeated edit is a retry: skip the response cache)
+        result = b.EditSlide(slide_edit_request, bypass_cache=True)
         
         logger.info("Slide edit completed successfully")
         
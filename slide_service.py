@@ -1,17 +1,28 @@
 from google import genai
 from google.genai import types
-from PIL import Image
 from io import BytesIO
 import base64
 import os
 from flask import Flask, request, jsonify, Response
 from dotenv import load_dotenv
-import boto3
-import uuid
 from io import BytesIO
 import requests
 import pymysql
 import json
+import queue
+import threading
+from deck_store import (fetch_record, fetch_deck, fetch_deck_cached, fetch_content_block, save_deck,
+                        update_content_block, update_deck_fields, deck_revision, DeckNotFoundError,
+                        DeckReplacedError)
+from deck_writer import create_write_behind
+import time
+from rate_limit import provider_call, classify_error, OVERLOAD
+from image_cache import ImageCache, content_key
+from image_upload import prepare_upload, image_size
+from image_variants import VariantProcessor, VARIANTS, variant_keys, IMAGE_VARIANT_DPR
+from image_events import create_event_bus
+from image_scheduler import ImageRun
+import s3_store
 
 
 
@@ -30,69 +41,151 @@ db_config = {
     "port": int(os.getenv("DB_PORT", 3306))
 }
 
-# S3 Configuration from environment variables
-S3_BUCKET_NAME = os.getenv("AWS_S3_BUCKET_NAME")
-S3_REGION = os.getenv("AWS_REGION")
-
-# AWS S3 Setup from environment variables
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION")
-
-# ✅ Use resource for high-level access (.Bucket())
-s3_resource = boto3.resource(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
-
-# ✅ Keep client if needed elsewhere (e.g. presigned URLs)
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+# Buffers per-image progress of generate_all_images_for_presentation
+progress_writer = create_write_behind(db_config)
 
 client = genai.Client()
 
+# Images generated concurrently per presentation; Gemini calls from every
+# thread share one rate limit (RATE_LIMIT_GEMINI_RPS / RATE_LIMIT_GEMINI_BURST),
+# an adaptive in-flight limit (CONCURRENCY_GEMINI_*) and a circuit breaker
+# (CIRCUIT_GEMINI_*), see rate_limit.provider_call.
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 4))
+# Retries of an image whose Gemini call was overloaded (429 / 5xx / timeout)
+GEMINI_OVERLOAD_RETRIES = int(os.getenv("GEMINI_OVERLOAD_RETRIES", 2))
+GEMINI_RETRY_BACKOFF = float(os.getenv("GEMINI_RETRY_BACKOFF", 2.0))
+
+# Images already rendered for the same normalized prompt are reused from S3
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+image_cache = ImageCache(db_config)
+# Right-sized master, WebP and thumbnail variants per image element
+image_variants = VariantProcessor()
+# Per-image progress for GET /api/v1/slides/images/stream (slide2.py), and
+# priority / cancel messages for running generations
+image_events = create_event_bus()
+
+
+class ImageRunCancelled(RuntimeError):
+    """Raised inside a cancelled image generation run instead of calling Gemini."""
 
 
 # --- helpers ---
 
 def fetch_request_record(request_id):
-    conn = pymysql.connect(**db_config)
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT mindmap_json, slide_json, updated_at FROM slide_requests WHERE id = %s",
-                (request_id,)
-            )
-            row = cursor.fetchone()
-    finally:
-        conn.close()
-    return row  # (mindmap_json, slide_json, updated_at)
+    return fetch_record(db_config, request_id)  # (mindmap_json, slide_json, updated_at)
 
 
 def update_slide_record(request_id, updated_slide_json):
-    conn = pymysql.connect(**db_config)
+    if isinstance(updated_slide_json, str):
+        updated_slide_json = json.loads(updated_slide_json)
+    save_deck(db_config, request_id, updated_slide_json)
+
+
+def generate_image_content(prompt, cancelled=None):
+    """
+    Gemini image response for ``prompt``, through the shared Gemini circuit
+    breaker, adaptive concurrency limit and rate limit. Overloaded calls are
+    retried GEMINI_OVERLOAD_RETRIES times with exponential backoff.
+    """
+    for attempt in range(GEMINI_OVERLOAD_RETRIES + 1):
+        try:
+            with provider_call("gemini"):
+                if cancelled is not None and cancelled.is_set():
+                    raise ImageRunCancelled("Image generation was cancelled")
+                return client.models.generate_content(
+                    model=IMAGE_MODEL,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
+                )
+        except Exception as e:
+            if attempt == GEMINI_OVERLOAD_RETRIES or classify_error(e) != OVERLOAD:
+                raise
+            delay = GEMINI_RETRY_BACKOFF * (2 ** attempt)
+            print(f"[WARN] Gemini overloaded ({e}); retrying in {delay:.1f}s")
+            if cancelled is not None and cancelled.wait(delay):
+                raise ImageRunCancelled("Image generation was cancelled")
+            elif cancelled is None:
+                time.sleep(delay)
+
+
+def source_image_for_prompt(prompt, cancelled=None, bypass_cache=False):
+    """
+    ``(s3_key, url, data)`` of an image for ``prompt``: reused from the image cache when
+    the same normalized prompt was rendered before (``data`` is None then), otherwise
+    generated with Gemini and uploaded under a content-addressed key. ``bypass_cache``
+    always generates, and the new image replaces the cached one for the prompt.
+    Returns None if Gemini returned no image; raises ImageRunCancelled if
+    ``cancelled`` is set while waiting for Gemini capacity.
+    """
+    cached = image_cache.lookup(prompt, IMAGE_MODEL, bypass=bypass_cache)
+    if cached:
+        print(f"[INFO] Image cache hit: {cached['url']}")
+        return cached["s3_key"], cached["url"], None
+
+    resp = generate_image_content(prompt, cancelled)
+
+    for part in resp.candidates[0].content.parts:
+        if part.inline_data:
+            # Upload Gemini's encoded bytes as they are; only IMAGE_UPLOAD_FORMAT re-encodes
+            data, content_type, extension = prepare_upload(part.inline_data.data, part.inline_data.mime_type)
+            key = content_key(data, extension)
+            image_url = s3_store.upload_bytes(data, key, content_type)
+
+            width, height = image_size(data)
+            image_cache.store(prompt, IMAGE_MODEL, key, image_url, width, height, len(data))
+            return key, image_url, data
+
+    return None
+
+
+def image_url_for_prompt(prompt):
+    """Public S3 URL of an image for ``prompt``, or None if Gemini returned no image."""
+    source = source_image_for_prompt(prompt)
+    return source[1] if source else None
+
+
+def image_fields_for_prompt(prompt, width=None, height=None, cancelled=None, bypass_cache=False):
+    """
+    Content block fields for an image element of ``width`` x ``height``:
+    ``src`` is a master sized for the element at IMAGE_VARIANT_DPR, with ``srcset``
+    (WebP 1x/2x), ``thumbnail`` and the full-size ``original_src``. Without a size,
+    or if the variants can't be produced, only ``src`` (the full-size image).
+    Returns None if Gemini returned no image. ``bypass_cache`` as for
+    source_image_for_prompt.
+    """
+    source = source_image_for_prompt(prompt, cancelled, bypass_cache)
+    if not source:
+        return None
+    key, url, data = source
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                UPDATE slide_requests
-                   SET slide_json = %s
-                     , updated_at = NOW()
-                 WHERE id = %s
-                """,
-                (updated_slide_json, request_id)
-            )
-        conn.commit()
-    finally:
-        conn.close()
+        width, height = int(width or 0), int(height or 0)
+    except (TypeError, ValueError):
+        width = height = 0
+    if not (image_variants.enabled and width > 0 and height > 0):
+        return {"src": url}
 
+    keys = variant_keys(key, width, height)
+    try:
+        # The master is uploaded last, so its presence means every variant exists
+        if data is not None or not s3_store.exists(keys["master"]):
+            if data is None:
+                data = s3_store.download_bytes(key)
+            rendered = image_variants.render(data, width, height)
+            for name in VARIANTS:
+                body, content_type = rendered[name]
+                s3_store.upload_bytes(body, keys[name], content_type)
+        else:
+            image_variants.count("reused")
+    except Exception as e:
+        print(f"[WARN] Could not create image variants for {key}: {e}")
+        return {"src": url}
 
+    return {
+        "src": s3_store.public_url(keys["master"]),
+        "srcset": f"{s3_store.public_url(keys['webp_1x'])} 1x, {s3_store.public_url(keys['webp_2x'])} {IMAGE_VARIANT_DPR}x",
+        "thumbnail": s3_store.public_url(keys["thumb"]),
+        "original_src": url,
+    }
 
 
 @app.route('/generate-image', methods=['POST'])
@@ -105,29 +198,9 @@ def generate_image_route():
         return jsonify({"error": "Prompt is required"}), 400
 
     prompt = data['prompt']
-    
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-preview-image-generation",
-        contents=prompt,
-        config=types.GenerateContentConfig(
-          response_modalities=['TEXT', 'IMAGE']
-        )
-    )
-    for part in response.candidates[0].content.parts:
-      if part.text is not None:
-        print(part.text)
-      elif part.inline_data is not None:
-        image = Image.open(BytesIO((part.inline_data.data)))
-        image.save('gemini-native-image.png')
-        image.show()
-        # Save the image to S3
-        image_name = f"{uuid.uuid4()}.png"
-        image_path = f"images/{image_name}"
-        image_bytes = BytesIO()
-        image.save(image_bytes, format='PNG')
-        image_bytes.seek(0)
-        s3_client.upload_fileobj(image_bytes, S3_BUCKET_NAME, image_path)
-        image_url = f"https://{S3_BUCKET_NAME}.s3.{S3_REGION}.amazonaws.com/{image_path}"
+
+    image_url = image_url_for_prompt(prompt)
+    if image_url:
         return jsonify({"image_url": image_url}), 200
     return jsonify({"error": "No image generated"}), 500
 
@@ -145,21 +218,15 @@ def generate_image_for_slide_content():
     if not (rid and sid and cid):
         return jsonify({"error": "Missing one or more of: request_id, slide_id, content_id"}), 400
 
-    # 2. fetch existing slide_json
-    record = fetch_request_record(rid)
-    if not record:
+    # 2. fetch the target content block
+    try:
+        slide_found, content = fetch_content_block(db_config, rid, sid, cid)
+    except DeckNotFoundError:
         return jsonify({"error": f"No record for request_id {rid}"}), 404
 
-    _, slide_json_str, _ = record
-    slide_doc = json.loads(slide_json_str)
-    slides = slide_doc.get("slides", [])
-
-    # 3. locate slide & content
-    slide = next((s for s in slides if s.get("slide_id") == sid), None)
-    if not slide:
+    # 3. check slide & content
+    if not slide_found:
         return jsonify({"error": f"Slide '{sid}' not found"}), 404
-
-    content = next((c for c in slide.get("content", []) if c.get("id") == cid), None)
     if not content:
         return jsonify({"error": f"Content '{cid}' not found in slide '{sid}'"}), 404
 
@@ -167,30 +234,15 @@ def generate_image_for_slide_content():
     if not prompt:
         return jsonify({"error": "No prompt on that content block"}), 400
 
-    # 4. generate image via Gemini
-    resp = client.models.generate_content(
-        model="gemini-2.0-flash-preview-image-generation",
-        contents=prompt,
-        config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
-    )        # 5. extract & upload first image we find
-    for part in resp.candidates[0].content.parts:
-        if part.inline_data:
-            img = Image.open(BytesIO(part.inline_data.data))
-            key = f"images/{uuid.uuid4()}.png"
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            buf.seek(0)
-            s3_client.upload_fileobj(buf, S3_BUCKET_NAME, key)
-            new_url = f"https://{S3_BUCKET_NAME}.s3.{S3_REGION}.amazonaws.com/{key}"
-
-            # 6. update the JSON in memory and persist it
-            content["src"] = new_url
-            content["is_image_created"] = True
-            updated_json_str = json.dumps(slide_doc)
-            update_slide_record(rid, updated_json_str)
-
-            # 7. return just that updated block
-            return jsonify({"data": content}), 200
+    # 4. generate a new image (an explicit request for this block, so not the
+    #    cached one), upload it and its variants to S3
+    fields = image_fields_for_prompt(prompt, content.get("width"), content.get("height"), bypass_cache=True)
+    if fields:
+        # 5. persist just this block
+        content = update_content_block(db_config, rid, sid, cid, {**fields, "is_image_created": True})
+
+        # 6. return just that updated block
+        return jsonify({"data": content}), 200
 
     return jsonify({"error": "Gemini returned no image"}), 500
 
@@ -200,7 +252,7 @@ def generate_image_for_slide_content():
 def generate_slides():
     try:
         request_id = request.args.get("id")
-        record = fetch_request_record(request_id)
+        record = fetch_deck_cached(db_config, request_id)
         if not record:
             return jsonify({"error": "No record found"}), 404
 
@@ -211,7 +263,7 @@ def generate_slides():
                 json.dumps({
                     "cached": True,
                     "last_updated": updated_at.strftime("%Y-%m-%d %H:%M:%S") if updated_at else None,
-                    "data": json.loads(cached_slides)
+                    "data": cached_slides
                 }, indent=2),
                 mimetype="application/json"
             )
@@ -228,27 +280,23 @@ def generate_slides():
         return jsonify({"error": str(e)}), 500
     
 
-def generate_image_for_content(request_id, slide_id, content_id):
+def generate_image_for_content(request_id, slide_id, content_id, bypass_cache=False):
     """
     Generates an image for the given slide content based on its prompt,
     uploads the image to S3, updates the slide_json in DB, and returns the updated content block.
+    ``bypass_cache`` generates a new image even if the prompt was rendered before.
     """
-    # 1. fetch existing record
-    record = fetch_request_record(request_id)
-    if not record:
+    # 1. fetch the target content block
+    try:
+        slide_found, content = fetch_content_block(db_config, request_id, slide_id, content_id)
+    except DeckNotFoundError:
         raise ValueError(f"No record for request_id {request_id}")
 
-    mindmap_json, slide_json_str, _ = record
-    slide_doc = json.loads(slide_json_str)
-
     # 2. locate slide
-    slides = slide_doc.get("slides", [])
-    slide = next((s for s in slides if s.get("slide_id") == slide_id), None)
-    if not slide:
+    if not slide_found:
         raise ValueError(f"Slide '{slide_id}' not found")
 
     # 3. locate content
-    content = next((c for c in slide.get("content", []) if c.get("id") == content_id), None)
     if not content:
         raise ValueError(f"Content '{content_id}' not found in slide '{slide_id}'")
 
@@ -256,60 +304,90 @@ def generate_image_for_content(request_id, slide_id, content_id):
     if not prompt:
         raise ValueError("No prompt found for content block")
 
-    # 4. generate image via Gemini
-    resp = client.models.generate_content(
-        model="gemini-2.0-flash-preview-image-generation",
-        contents=prompt,
-        config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
-    )
-
-    # 5. upload first image found
-    for part in resp.candidates[0].content.parts:
-        if part.inline_data:
-            img = Image.open(BytesIO(part.inline_data.data))
-            key = f"images/{uuid.uuid4()}.png"
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            buf.seek(0)
-            s3_client.upload_fileobj(buf, S3_BUCKET_NAME, key)
-            new_url = f"https://{S3_BUCKET_NAME}.s3.{S3_REGION}.amazonaws.com/{key}"
-
-            # 6. update JSON and persist
-            content["src"] = new_url
-            content["is_image_created"] = True
-            updated_json = json.dumps(slide_doc)
-            update_slide_record(request_id, updated_json)
-
-            return content
+    # 4. reuse or generate the image, upload it and its variants to S3
+    fields = image_fields_for_prompt(prompt, content.get("width"), content.get("height"),
+                                     bypass_cache=bypass_cache)
+    if fields:
+        # 5. persist just this block
+        return update_content_block(
+            db_config, request_id, slide_id, content_id, {**fields, "is_image_created": True}
+        )
 
     raise RuntimeError("Gemini did not return any image data")
 
 
 
-def generate_all_images_for_presentation(request_id):
+def generate_presentation_image(slide_id, content_id, prompt, width=None, height=None, cancelled=None):
+    """
+    Generate one image with Gemini and upload it and its variants to S3.
+    Safe to call from worker threads; returns the content block fields (see
+    image_fields_for_prompt), or None if Gemini returned no image.
+    """
+    print(f"[INFO] Generating image for {slide_id}/{content_id}...")
+    fields = image_fields_for_prompt(prompt, width, height, cancelled)
+    if fields:
+        print(f"[INFO] Image for {slide_id}/{content_id}: {fields['src']}")
+    return fields
+
+
+def generate_all_images_for_presentation(request_id, visible_slides=None, cancelled=None, final_attempt=True):
     """
     Generate images for all image content blocks in a presentation.
     This function runs in a background thread and logs all results to console.
+    Every completed or failed block, and the final result, is published to
+    image_events for the progress stream. A failed run that will be retried
+    (``final_attempt`` False) publishes no result, so the stream stays open
+    for the retry.
+
+    Blocks are generated in priority order (``visible_slides`` first, then
+    document order). ``priority`` and ``cancel`` messages published on
+    image_events for the deck re-order or stop the blocks not started yet,
+    as does setting ``cancelled``.
     
     Args:
         request_id (str): The ID of the slide request to process
+        visible_slides (list): slide_ids the client is showing, most important first
+        cancelled (threading.Event): set to stop the run
+        final_attempt (bool): False if a failed run will be retried
         
     Returns:
         dict: A dictionary containing the results of the image generation process
     """
+    result = _generate_all_images(request_id, visible_slides, cancelled)
+    if request_id and (final_attempt or result.get("success") or result.get("cancelled")):
+        image_events.publish(request_id, {"type": "summary", **result})
+    return result
+
+
+def _watch_controls(run, controls, finished):
+    """Apply ``priority`` / ``cancel`` messages for the deck to ``run`` until it finishes."""
+    while not finished.is_set():
+        try:
+            event = controls.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if event.get("type") == "priority":
+            print(f"[INFO] Re-prioritizing images for {run.request_id}: {event.get('slide_ids')}")
+            run.prioritize(event.get("slide_ids") or [])
+        elif event.get("type") == "cancel":
+            print(f"[INFO] Image generation for {run.request_id} cancelled")
+            run.cancel()
+
+
+def _generate_all_images(request_id, visible_slides=None, cancelled=None):
     if not request_id:
         print("[ERROR] Missing request_id")
         return {"success": False, "error": "Missing request_id", "generated": 0, "skipped": 0, "errors": []}
 
     print(f"[INFO] Fetching record for request_id: {request_id}")
-    record = fetch_request_record(request_id)
-    if not record:
+    slide_doc, _ = fetch_deck(db_config, request_id)
+    if slide_doc is None:
         print(f"[ERROR] No record found for request_id {request_id}")
         return {"success": False, "error": f"No record found for request_id {request_id}", "generated": 0, "skipped": 0, "errors": []}
 
-    _, slide_json_str, _ = record
-    slide_doc = json.loads(slide_json_str)
     slides = slide_doc.get("slides", [])
+    # Images are only written to this revision of the deck, not to a regenerated one
+    revision = deck_revision(slide_doc)
 
     generated_count = 0
     skipped_count = 0
@@ -317,7 +395,8 @@ def generate_all_images_for_presentation(request_id):
 
     print(f"[INFO] Starting image generation for {len(slides)} slides...")
 
-    for slide in slides:
+    pending = []
+    for slide_index, slide in enumerate(slides):
         slide_id = slide.get("slide_id", "unknown")
         print(f"[INFO] Processing slide: {slide_id}")
         content_blocks = slide.get("content", [])
@@ -340,68 +419,90 @@ def generate_all_images_for_presentation(request_id):
                     skipped_count += 1
                     continue
 
-                try:
-                    print(f"[INFO] Generating image for {slide_id}/{content_id} using Gemini...")
-                    resp = client.models.generate_content(
-                        model="gemini-2.0-flash-preview-image-generation",
-                        contents=prompt,
-                        config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
-                    )
-
-                    image_uploaded = False
-
-                    for part in resp.candidates[0].content.parts:
-                        if part.inline_data:
-                            print(f"[INFO] Image data received for {slide_id}/{content_id}. Preparing upload...")
-                            img = Image.open(BytesIO(part.inline_data.data))
-                            key = f"images/{uuid.uuid4()}.png"
-                            buf = BytesIO()
-                            img.save(buf, format="PNG")
-                            buf.seek(0)
-
-                            # Upload image to S3 (no ACLs)
-                            s3_resource.Bucket(S3_BUCKET_NAME).upload_fileobj(
-                                Fileobj=buf,
-                                Key=key,
-                                ExtraArgs={'ContentType': 'image/png'}
-                            )
-
-                            # Construct S3 public URL
-                            image_url = f"https://s3.ap-south-1.amazonaws.com/{S3_BUCKET_NAME}/{key}"
-
-                            print(f"[INFO] Image uploaded to S3: {image_url}")
-
-                            # Update content block
-                            content["src"] = image_url
-                            content["is_image_created"] = True
-                            # Update the global slide_doc dictionary and mark image as created
-                            generated_count += 1
-                            image_uploaded = True
-                            break
-
-                    if not image_uploaded:
-                        err = f"No image data returned for {slide_id}/{content_id}"
+                pending.append((slide_index, slide_id, content_id, content))
+
+    run = ImageRun(request_id, pending, visible_slides, cancelled)
+    if pending:
+        workers = max(1, min(IMAGE_WORKERS, len(pending)))
+        print(f"[INFO] Generating {len(pending)} images with {workers} workers...")
+
+        def generate(item):
+            _, slide_id, content_id, content = item
+            return generate_presentation_image(slide_id, content_id, content["prompt"],
+                                               content.get("width"), content.get("height"), run.cancelled)
+
+        finished = threading.Event()
+        with image_events.listen(request_id) as controls:
+            watcher = threading.Thread(target=_watch_controls, args=(run, controls, finished), daemon=True)
+            watcher.start()
+            try:
+                for (_, slide_id, content_id, content), fields, error in run.results(generate, workers):
+                    if run.cancelled.is_set():
+                        # The deck may be being regenerated or deleted; write nothing more
+                        continue
+
+                    if error is not None:
+                        err = f"Error generating image for {slide_id}/{content_id}: {str(error)}"
                         print(f"[ERROR] {err}")
                         errors.append(err)
+                        image_events.publish(request_id, {"type": "image", "status": "failed", "slide_id": slide_id,
+                                                          "content_id": content_id, "error": err})
+                        continue
 
-                except Exception as e:
-                    err = f"Error generating image for {slide_id}/{content_id}: {str(e)}"
-                    print(f"[ERROR] {err}")
-                    errors.append(err)
+                    if not fields:
+                        err = f"No image data returned for {slide_id}/{content_id}"
+                        print(f"[ERROR] {err}")
+                        errors.append(err)
+                        image_events.publish(request_id, {"type": "image", "status": "failed", "slide_id": slide_id,
+                                                          "content_id": content_id, "error": err})
+                        continue
+
+                    # Buffered; flushed every few images so clients see progress
+                    changes = {**fields, "is_image_created": True}
+                    progress_writer.update(request_id, slide_id, content_id, changes, revision=revision)
+                    content.update(changes)
+                    image_events.publish(request_id, {"type": "image", "status": "completed", "slide_id": slide_id,
+                                                      "content_id": content_id, **fields})
+                    generated_count += 1
+            finally:
+                finished.set()
+
+    if run.cancelled.is_set():
+        print(f"[INFO] Image generation for {request_id} cancelled after {generated_count} images")
+        # The deck may have been regenerated with the same block ids: drop the
+        # images still buffered (they stay in the image cache for a later run)
+        progress_writer.discard(request_id)
+        return {
+            "success": False,
+            "cancelled": True,
+            "error": "Image generation was cancelled",
+            "generated": generated_count,
+            "skipped": skipped_count,
+            "not_started": run.remaining(),
+            "errors": errors
+        }
 
     print("[INFO] Image generation process completed.")
     print(f"[INFO] Generated: {generated_count}, Skipped: {skipped_count}, Errors: {len(errors)}")
 
-    # Save updated JSON if any new images were added
+    # Write any buffered images, then flag the presentation
     if generated_count > 0:
         try:
-            slide_doc = slide_doc  # Update global reference
-            # Mark the entire presentation as having all images created
-            slide_doc["is_image_created"] = True
-            updated_json_str = json.dumps(slide_doc)
             print(f"[INFO] Updating database with new slide JSON...")
-            update_slide_record(request_id, updated_json_str)
+            progress_writer.flush(request_id)
+            # Mark the entire presentation as having all images created
+            update_deck_fields(db_config, request_id, {"is_image_created": True})
             print(f"[SUCCESS] Database updated successfully!")
+        except DeckReplacedError as e:
+            print(f"[INFO] Deck {request_id} was replaced during image generation: {e}")
+            return {
+                "success": False,
+                "cancelled": True,
+                "error": "The deck was replaced during image generation",
+                "generated": generated_count,
+                "skipped": skipped_count,
+                "errors": errors
+            }
         except Exception as e:
             err = f"Failed to update database: {str(e)}"
             print(f"[ERROR] {err}")
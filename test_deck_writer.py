@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test that images of a cancelled generation run are never written onto the
+deck that replaced it (regenerate reuses the same slide and block ids).
+
+deck_store runs against an in-memory SQLite stand-in for MySQL, in the
+document layout without JSON projection; no database server needed.
+"""
+
+import sqlite3
+from contextlib import contextmanager
+
+import deck_store
+from deck_writer import DeckWriteBehind
+
+
+class SqliteCursor:
+    """The subset of a pymysql cursor deck_store uses, translated to SQLite."""
+
+    def __init__(self, db):
+        self._cursor = db.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def execute(self, sql, args=()):
+        sql = sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP").replace("FOR UPDATE", "")
+        self._cursor.execute(sql, tuple(args))
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+class SqliteConnection:
+    def __init__(self, db):
+        self._db = db
+
+    def cursor(self):
+        return SqliteCursor(self._db)
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+
+def deck(image_fields=None):
+    block = {"id": "s1_img", "type": "image", "prompt": "a lighthouse at dusk", "is_image_created": False}
+    return {"slides": [{"slide_id": "slide_1", "content": [{**block, **(image_fields or {})}]}]}
+
+
+def stored_block():
+    slide_doc, _ = deck_store.fetch_deck({}, "r1")
+    return slide_doc["slides"][0]["content"][0]
+
+
+def test_cancelled_run_does_not_write_onto_regenerated_deck(monkeypatch):
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    db.execute("CREATE TABLE slide_requests (id TEXT PRIMARY KEY, slide_json TEXT, "
+               "slide_version INTEGER NOT NULL DEFAULT 0, updated_at TEXT)")
+    db.execute("INSERT INTO slide_requests (id) VALUES ('r1')")
+
+    @contextmanager
+    def connection(db_config):
+        yield SqliteConnection(db)
+
+    monkeypatch.setattr(deck_store, "db_connection", connection)
+    monkeypatch.setattr(deck_store, "DECK_JSON_PROJECTION", False)
+    monkeypatch.setattr(deck_store, "SLIDE_STORAGE_MODE", "document")
+
+    deck_store.save_deck({}, "r1", deck())
+    old_revision = deck_store.deck_revision(deck_store.fetch_deck({}, "r1")[0])
+
+    # Two runs on the old deck have an image buffered: one in this process,
+    # one in another process that the cancel doesn't reach in time
+    local_run = DeckWriteBehind({}, flush_every=100, flush_interval_ms=60000)
+    other_process = DeckWriteBehind({}, flush_every=100, flush_interval_ms=60000)
+    old_image = {"src": "https://bucket/old.png", "is_image_created": True}
+    local_run.update("r1", "slide_1", "s1_img", old_image, revision=old_revision)
+    other_process.update("r1", "slide_1", "s1_img", old_image, revision=old_revision)
+
+    # Cancel, then regenerate with the same ids (and even the same prompt)
+    assert local_run.discard("r1") == 1
+    deck_store.save_deck({}, "r1", deck())
+    local_run.flush()
+    other_process.flush()
+
+    block = stored_block()
+    assert block["is_image_created"] is False
+    assert "src" not in block
+    assert other_process.stats()["discarded"] == 1
+
+    # A run on the regenerated deck still writes its images
+    new_revision = deck_store.deck_revision(deck_store.fetch_deck({}, "r1")[0])
+    other_process.update("r1", "slide_1", "s1_img", {"src": "https://bucket/new.png", "is_image_created": True},
+                         revision=new_revision)
+    other_process.flush("r1")
+    assert stored_block()["src"] == "https://bucket/new.png"
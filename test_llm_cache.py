@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Test that the LLM response cache serves repeated generations but never
+short-circuits an explicit regenerate.
+
+Uses a fake BAML client and a temporary cache file; no LLM calls are made.
+"""
+
+from typing import List
+
+import deck_sections
+from baml_client import types
+from llm_cache import CachedBamlClient, LLMResponseCache
+
+
+class FakeBamlClient:
+    """Stands in for BamlSyncClient, counting GeneratePresentation calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def GeneratePresentation(self, input: types.PresentationInput, baml_options: dict = {}) -> List[types.SlideContent]:
+        self.calls += 1
+        return [types.SlideContent(slide_id="slide_1", background=f"#00000{self.calls}", content=[])]
+
+
+def test_regenerate_calls_the_model(tmp_path, monkeypatch):
+    """bypass_cache=True calls the model every time and refreshes the cached deck."""
+    model = FakeBamlClient()
+    cache = LLMResponseCache(path=str(tmp_path / "llm_cache.sqlite3"))
+    monkeypatch.setattr(deck_sections, "sync_b", CachedBamlClient(model, cache))
+    presentation_input = {"id": 1, "title": "Q3 review", "outline": [{"id": 1, "title": "Intro", "points": ["a"]}]}
+
+    first = deck_sections.generate_slides(presentation_input)
+    assert deck_sections.generate_slides(presentation_input)[0].background == first[0].background
+    assert model.calls == 1
+
+    regenerated = deck_sections.generate_slides(presentation_input, bypass_cache=True)
+    assert model.calls == 2
+    assert regenerated[0].background != first[0].background
+
+    # The refreshed response is what later identical requests get
+    assert deck_sections.generate_slides(presentation_input)[0].background == regenerated[0].background
+    assert model.calls == 2
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Test that decks copied from the shared cache tier into a worker's in-process
+cache are dropped when another process invalidates them.
+
+Uses the in-process MemoryBackend; no Redis or MySQL needed.
+"""
+
+from datetime import datetime
+
+import deck_store
+from deck_cache import DeckCache
+from shared_cache import MemoryBackend, SharedDeckCache
+
+
+def test_peek_only_worker_receives_invalidation(monkeypatch):
+    """A worker only reached through single slide reads still drops invalidated decks."""
+    backend = MemoryBackend()
+    writer = SharedDeckCache(backend)
+    reader = SharedDeckCache(backend)
+    reader_local = DeckCache()
+    reader.add_listener(reader_local.invalidate)
+    monkeypatch.setattr(deck_store, "deck_cache", reader_local)
+    monkeypatch.setattr(deck_store, "shared_deck_cache", reader)
+
+    deck = {"slides": [{"slide_id": "slide_1", "content": []}], "v": 1}
+    writer.put("r1", ("{}", deck, datetime(2024, 1, 1)), writer.generation("r1"))
+
+    # Single slide read: fills the reader's local tier from the shared tier
+    assert deck_store.fetch_slide_cached({}, "r1", "slide_1") == deck["slides"][0]
+    assert reader_local.get("r1") is not None
+
+    writer.invalidate("r1")
+    assert reader_local.get("r1") is None
+    assert reader.stats()["invalidations_received"] == 1